@@ -0,0 +1,80 @@
+# archive.py
+# Перенос завершённых ордеров (Filled/Cancelled/Killed …) из orders в
+# orders_archive вместе с raw_json, чтобы горячая таблица оставалась
+# маленькой. Движок зовёт archive_orders() раз в ORDERS_ARCHIVE_INTERVAL;
+# вручную:  python archive.py
+import os
+import time
+import asyncio
+import logging
+
+from dbpool import DBPool, get_pool, retry_busy
+from logsetup import setup_logging
+from schema import OPEN_STATUS_SQL, migrate
+
+log = logging.getLogger("archive")
+
+# завершённый ордер уезжает в архив, если не менялся столько секунд
+ORDERS_ARCHIVE_AFTER = float(os.getenv("ORDERS_ARCHIVE_AFTER", str(24 * 3600)))
+ORDERS_ARCHIVE_BATCH = int(os.getenv("ORDERS_ARCHIVE_BATCH", "5000"))
+ORDERS_ARCHIVE_INTERVAL = float(os.getenv("ORDERS_ARCHIVE_INTERVAL", "3600"))
+
+_COLUMNS = ("orderId, clientId, permId, action, symbol, orderType, lmtPrice, tif, outsideRth, status, filled, "
+            "remaining, avgFillPrice, lastFillPrice, whyHeld, raw_json, created_at, updated_at")
+
+# одна и та же выборка для INSERT и DELETE: внутри BEGIN IMMEDIATE
+# никто другой писать не может, так что строки совпадут
+_PICK_SQL = (f"SELECT id FROM orders WHERE status IS NOT NULL AND NOT {OPEN_STATUS_SQL} "
+             f"AND updated_at < ? ORDER BY id LIMIT ?")
+
+
+async def archive_orders(pool: DBPool, older_than: float = ORDERS_ARCHIVE_AFTER,
+                         batch: int = ORDERS_ARCHIVE_BATCH) -> int:
+    """Перенести завершённые ордера старше older_than сек. Вернёт число строк."""
+    now = int(time.time())
+    cutoff = int(now - older_than)
+
+    async def move_batch() -> int:
+        async with pool.acquire() as cx:
+            if cx.in_transaction:
+                await cx.commit()
+            await cx.execute("BEGIN IMMEDIATE")
+            try:
+                await cx.execute(
+                    f"INSERT OR REPLACE INTO orders_archive (id, {_COLUMNS}, archived_at) "
+                    f"SELECT id, {_COLUMNS}, ? FROM orders WHERE id IN ({_PICK_SQL})",
+                    (now, cutoff, batch))
+                cur = await cx.execute(f"DELETE FROM orders WHERE id IN ({_PICK_SQL})", (cutoff, batch))
+                await cx.commit()
+                return cur.rowcount
+            except BaseException:
+                await cx.rollback()
+                raise
+
+    total = 0
+    while True:
+        moved = await retry_busy(move_batch)
+        total += moved
+        if moved < batch:
+            break
+        # большой хвост — пачками, между ними отдаём цикл остальным
+        await asyncio.sleep(0)
+    if total:
+        log.info("archive: moved %d finished orders to orders_archive", total)
+    return total
+
+
+async def _main() -> None:
+    pool = get_pool(os.getenv("DB_PATH", "bot.db"))
+    await pool.start()
+    try:
+        async with pool.acquire() as cx:
+            await migrate(cx)
+        await archive_orders(pool)
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(_main())
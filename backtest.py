@@ -0,0 +1,284 @@
+# backtest.py
+# Офлайн-прогон стратегии DCA/TP по историческим барам/тикам.
+# Решения — та же strategy.decide_arrays, что и в dca_loop; вместо buy_now/sell_now
+# и IB — модель исполнения лимитных заявок по high/low следующих баров.
+#
+#   python backtest.py AAPL_1m.csv --dca 0.01,0.02,0.03 --tp 0.02,0.04 --qty 1 --processes 4
+import os
+import csv
+import sys
+import time
+import argparse
+import itertools
+from dataclasses import dataclass, asdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+from recorder import read_file
+from strategy import decide_arrays, SKIP, TP_SELL
+
+try:  # Parquet — только если установлен pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pq = None
+
+# окно поиска следующего сигнала/исполнения (бар): начинаем с малого и
+# удваиваем, пока ничего не нашли — и частые, и редкие сделки дёшевы
+SCAN_WINDOW = 32
+SCAN_WINDOW_MAX = 1 << 16
+
+
+class Bars(NamedTuple):
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+
+
+@dataclass
+class Params:
+    base_qty: float = 1
+    dca_pct: float = 0.02
+    tp_pct: float = 0.02
+    # через сколько баров неисполненная заявка снимается (None — живёт до исполнения)
+    order_ttl: Optional[int] = None
+    fee_per_share: float = 0.0
+
+
+@dataclass
+class BacktestResult:
+    base_qty: float
+    dca_pct: float
+    tp_pct: float
+    bars: int
+    fills: int
+    buys: int
+    sells: int
+    cancels: int
+    realized_pnl: float
+    unrealized_pnl: float
+    total_pnl: float
+    fees: float
+    max_capital: float
+    final_qty: float
+    final_avg: float
+    elapsed: float
+
+
+# ---------------------------
+# Загрузка данных
+# ---------------------------
+def _columns(names: Iterable[str]) -> Dict[str, int]:
+    return {n.strip().lower(): i for i, n in enumerate(names)}
+
+
+def _bars_from_columns(cols: Dict[str, np.ndarray]) -> Bars:
+    if "close" in cols:
+        close = cols["close"]
+    elif "price" in cols:        # тики
+        close = cols["price"]
+    elif "last" in cols:
+        close = cols["last"]
+    else:
+        raise ValueError("need a close/price/last column")
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    return Bars(
+        np.ascontiguousarray(cols.get("open", close), dtype=np.float64),
+        np.ascontiguousarray(cols.get("high", close), dtype=np.float64),
+        np.ascontiguousarray(cols.get("low", close), dtype=np.float64),
+        close,
+    )
+
+
+def load_bars(path: str) -> Bars:
+    """
+    CSV (с заголовком) или Parquet. Колонки open/high/low/close или
+    price/last для тиков (тогда open=high=low=close). Время не нужно —
+    порядок строк считается хронологическим.
+    .ticks — дневной файл recorder.py (цены, которые видел движок).
+    """
+    if path.endswith(".ticks"):
+        return _bars_from_columns({"price": read_file(path, "ticks")["price"]})
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise RuntimeError("reading Parquet requires pyarrow")
+        table = pq.read_table(path)
+        wanted = {"open", "high", "low", "close", "price", "last"}
+        cols = {n.lower(): table.column(n).to_numpy() for n in table.column_names if n.lower() in wanted}
+        return _bars_from_columns(cols)
+
+    with open(path, newline="") as f:
+        header = _columns(next(csv.reader(f)))
+    wanted = [n for n in ("open", "high", "low", "close", "price", "last") if n in header]
+    if not wanted:
+        raise ValueError(f"{path}: need a close/price/last column")
+    data = np.loadtxt(path, delimiter=",", skiprows=1, usecols=[header[n] for n in wanted],
+                      dtype=np.float64, ndmin=2)
+    return _bars_from_columns({n: data[:, i] for i, n in enumerate(wanted)})
+
+
+# ---------------------------
+# Симуляция
+# ---------------------------
+class Signal(NamedTuple):
+    bar: int
+    sell: bool
+    qty: float
+    limit: float
+
+
+def _next_signal(bars: Bars, t: int, qty: float, avg: float, p: Params) -> Optional[Signal]:
+    """
+    Первый бар >= t, на котором стратегия (без открытого ордера) что-то делает.
+    Состояние между сделками не меняется, поэтому decide_arrays считается
+    сразу по окну баров, а не по одному.
+    """
+    n = len(bars.close)
+    w = SCAN_WINDOW
+    while t < n:
+        last = bars.close[t:t + w]
+        m = len(last)
+        d = decide_arrays(np.full(m, qty), np.full(m, avg), last,
+                          np.zeros(m, dtype=bool), np.ones(m, dtype=bool),
+                          p.base_qty, p.dca_pct, p.tp_pct)
+        hit = np.flatnonzero(d.kind != SKIP)
+        if hit.size:
+            i = int(hit[0])
+            return Signal(t + i, bool(d.kind[i] == TP_SELL), float(d.qty[i]), float(d.limit[i]))
+        t += m
+        w = min(w * 2, SCAN_WINDOW_MAX)
+    return None
+
+
+def _next_fill(bars: Bars, t: int, end: int, sell: bool, limit: float) -> int:
+    """Первый бар в [t, end), где лимитка исполнилась бы (low<=limit / high>=limit)."""
+    w = SCAN_WINDOW
+    while t < end:
+        stop = min(end, t + w)
+        if sell:
+            hit = np.flatnonzero(bars.high[t:stop] >= limit)
+        else:
+            hit = np.flatnonzero(bars.low[t:stop] <= limit)
+        if hit.size:
+            return t + int(hit[0])
+        t = stop
+        w = min(w * 2, SCAN_WINDOW_MAX)
+    return end
+
+
+def run_backtest(bars: Bars, p: Params) -> BacktestResult:
+    """
+    Одна дорожка: не больше одного активного ордера, как в dca_loop.
+    Заявка ставится по close бара-сигнала и может исполниться начиная со
+    следующего бара: покупка — если low <= limit (по min(limit, open)),
+    продажа — если high >= limit (по max(limit, open)).
+    """
+    started = time.perf_counter()
+    n = len(bars.close)
+    qty = avg = realized = fees = max_capital = 0.0
+    buys = sells = cancels = 0
+
+    t = 0
+    while t < n:
+        sig = _next_signal(bars, t, qty, avg, p)
+        if sig is None:
+            break
+        sell, order_qty, limit = sig.sell, sig.qty, sig.limit
+
+        end = n if p.order_ttl is None else min(n, sig.bar + 1 + p.order_ttl)
+        f = _next_fill(bars, sig.bar + 1, end, sell, limit)
+        if f >= end:
+            if end >= n:
+                break
+            cancels += 1
+            t = end
+            continue
+
+        op = float(bars.open[f])
+        fee = order_qty * p.fee_per_share
+        fees += fee
+        if sell:
+            px = max(limit, op)
+            realized += order_qty * (px - avg) - fee
+            qty -= order_qty
+            if qty <= 0:
+                qty = avg = 0.0
+            sells += 1
+        else:
+            px = min(limit, op)
+            avg = (qty * avg + order_qty * px) / (qty + order_qty)
+            qty += order_qty
+            realized -= fee
+            buys += 1
+            max_capital = max(max_capital, qty * avg)
+        # после исполнения решаем уже по close бара исполнения
+        t = f
+
+    unrealized = qty * (float(bars.close[-1]) - avg) if n and qty else 0.0
+    return BacktestResult(
+        base_qty=p.base_qty, dca_pct=p.dca_pct, tp_pct=p.tp_pct, bars=n,
+        fills=buys + sells, buys=buys, sells=sells, cancels=cancels,
+        realized_pnl=realized, unrealized_pnl=unrealized, total_pnl=realized + unrealized,
+        fees=fees, max_capital=max_capital, final_qty=qty, final_avg=avg,
+        elapsed=time.perf_counter() - started,
+    )
+
+
+# ---------------------------
+# Перебор параметров
+# ---------------------------
+_worker_bars: Dict[str, Bars] = {}
+
+
+def _run_one(args) -> BacktestResult:
+    path, p = args
+    bars = _worker_bars.get(path)
+    if bars is None:
+        bars = _worker_bars[path] = load_bars(path)
+    return run_backtest(bars, p)
+
+
+def run_sweep(path: str, grid: List[Params], processes: int = 1) -> List[BacktestResult]:
+    """Все комбинации параметров по одному файлу; processes > 1 — через пул процессов."""
+    if processes <= 1:
+        bars = load_bars(path)
+        return [run_backtest(bars, p) for p in grid]
+    with ProcessPoolExecutor(max_workers=processes) as ex:
+        return list(ex.map(_run_one, [(path, p) for p in grid], chunksize=max(1, len(grid) // (processes * 4))))
+
+
+def _floats(s: str) -> List[float]:
+    return [float(x) for x in s.split(",") if x.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="DCA/TP backtest over historical bars/ticks")
+    ap.add_argument("path", help="CSV/Parquet with open/high/low/close (or price) columns, or a recorder .ticks file")
+    ap.add_argument("--qty", default=os.getenv("BASE_QTY", "1"), help="BASE_QTY, comma-separated for a sweep")
+    ap.add_argument("--dca", default=os.getenv("DCA_STEP_PCT", "0.02"), help="DCA_STEP_PCT list")
+    ap.add_argument("--tp", default=os.getenv("TAKE_PROFIT_PCT", "0.02"), help="TAKE_PROFIT_PCT list")
+    ap.add_argument("--ttl", type=int, default=None, help="cancel unfilled orders after N bars")
+    ap.add_argument("--fee", type=float, default=0.0, help="commission per share")
+    ap.add_argument("--processes", type=int, default=1)
+    args = ap.parse_args(argv)
+
+    grid = [Params(q, d, t, args.ttl, args.fee)
+            for q, d, t in itertools.product(_floats(args.qty), _floats(args.dca), _floats(args.tp))]
+    started = time.perf_counter()
+    results = run_sweep(args.path, grid, args.processes)
+    elapsed = time.perf_counter() - started
+
+    w = csv.DictWriter(sys.stdout, fieldnames=list(asdict(results[0]).keys()) if results else [])
+    w.writeheader()
+    for r in sorted(results, key=lambda r: r.total_pnl, reverse=True):
+        w.writerow({k: (round(v, 6) if isinstance(v, float) else v) for k, v in asdict(r).items()})
+    bars = sum(r.bars for r in results)
+    print(f"# {len(results)} runs, {bars} bars in {elapsed:.2f}s "
+          f"({bars / elapsed * 60 / 1e6:.1f}M bars/min)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
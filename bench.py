@@ -0,0 +1,296 @@
+# bench.py
+# Бенчмарк движка и db.py на fake_ib.FakeIB (без TWS/Gateway).
+# Каждый размер white_list гоняется в отдельном процессе со своей БД:
+# модули движка читают DB_PATH/METRICS из окружения при импорте.
+#
+#   python bench.py --symbols 10,100,1000 --seconds 10 --latency 0.005
+#
+# Результаты дописываются в bench_results.jsonl (одна строка на запуск) —
+# сравнивать прогоны между коммитами.
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+BENCH_OUT = os.getenv("BENCH_OUT", "bench_results.jsonl")
+
+
+# ---------------------------
+# Замеры
+# ---------------------------
+def _quantiles(samples: List[float]) -> Dict[str, float]:
+    s = sorted(samples)
+    if not s:
+        return {}
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))] * 1e3
+    return {"n": len(s), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def _io_bytes() -> Optional[int]:
+    """Байты, отданные процессом в write() (Linux /proc/self/io: wchar)."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _stages(registry) -> Dict[str, Dict[str, float]]:
+    out = {}
+    for (name, labels), h in sorted(registry.histograms.items()):
+        tag = dict(labels).get("stage", name)
+        out[tag] = _quantiles(list(h.samples))
+    return out
+
+
+def _reset(registry) -> None:
+    registry.histograms.clear()
+    registry.counters.clear()
+    registry.gauges.clear()
+
+
+class _Write:
+    """Сколько строк/коммитов/байт ушло в SQLite за фазу — write amplification."""
+
+    def __init__(self, writer=None):
+        self.writer = writer
+        self.io0 = _io_bytes()
+        self.rows0 = writer.rows_written if writer else 0
+        self.flushes0 = writer.flushes if writer else 0
+
+    def result(self, rows: Optional[int] = None) -> Dict[str, float]:
+        io = _io_bytes()
+        written = None if io is None or self.io0 is None else io - self.io0
+        if rows is None:
+            rows = self.writer.rows_written - self.rows0
+        out = {"rows": rows, "bytes": written}
+        if self.writer is not None:
+            out["commits"] = self.writer.flushes - self.flushes0
+        if written is not None and rows:
+            out["bytes_per_row"] = round(written / rows, 1)
+        return out
+
+
+# ---------------------------
+# Дочерний процесс: движок
+# ---------------------------
+def _symbols(n: int) -> List[str]:
+    return [f"S{i:04d}" for i in range(n)]
+
+
+async def _bench_engine(n: int, args) -> dict:
+    from fake_ib import FakeIB
+    fake = FakeIB(latency=args.latency, tick_interval=args.tick_interval)
+
+    import engine
+    import metrics
+    logging.getLogger().setLevel(logging.WARNING)
+    engine.session.ib = fake
+
+    symbols = _symbols(n)
+    res: dict = {"target": "engine", "symbols": n, "reactive": engine.REACTIVE}
+    await engine.pool.start()
+    try:
+        await engine.ensure_schema()
+        async with engine._db() as cx:
+            await cx.executemany("INSERT OR IGNORE INTO white_list(pair) VALUES(?)", [(s,) for s in symbols])
+            await cx.commit()
+        await engine.contracts.load()
+
+        # холодный старт: квалификация, подписки, первая запись positions
+        t0 = time.perf_counter()
+        await engine.reconcile_positions_with_ib(symbols)
+        res["cold_reconcile_positions_ms"] = (time.perf_counter() - t0) * 1e3
+
+        # reconcile по отдельности
+        for name, fn in (("reconcile_orders", engine.reconcile_orders_with_ib),
+                         ("reconcile_positions", lambda: engine.reconcile_positions_with_ib(symbols))):
+            _reset(metrics.registry)
+            w = _Write(engine.writer)
+            lat = []
+            for _ in range(args.iterations):
+                t0 = time.perf_counter()
+                await fn()
+                lat.append(time.perf_counter() - t0)
+            res[name] = {**_quantiles(lat), "stages": _stages(metrics.registry), "writes": w.result()}
+
+        # dca_loop целиком
+        _reset(metrics.registry)
+        w = _Write(engine.writer)
+        placed0 = fake.requests.get("place", 0)
+        task = asyncio.ensure_future(engine.dca_loop())
+        started = time.perf_counter()
+        await asyncio.sleep(args.seconds)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        elapsed = time.perf_counter() - started
+        await engine.writer.flush()
+        cycles = metrics.registry.counters.get(("cycles_total", ()), 0)
+        res["dca_loop"] = {
+            "seconds": round(elapsed, 3),
+            "cycles": int(cycles),
+            "cycles_per_sec": round(cycles / elapsed, 2),
+            "orders_placed": fake.requests.get("place", 0) - placed0,
+            "stages": _stages(metrics.registry),
+            "writes": w.result(),
+        }
+        res["ib_requests"] = dict(fake.requests)
+    finally:
+        fake.stop()
+        await engine.writer.close()
+        await engine.config.close()
+        await engine.pool.close()
+    return res
+
+
+# ---------------------------
+# Дочерний процесс: db.py
+# ---------------------------
+async def _bench_db(n: int, args) -> dict:
+    import db
+    symbols = _symbols(n)
+    res: dict = {"target": "db", "symbols": n}
+    await db.pool.start()
+    try:
+        await db.init_db()
+        async with db.pool.acquire() as cx:
+            await cx.executemany("INSERT INTO white_list(pair) VALUES(?)", [(s,) for s in symbols])
+            await cx.commit()
+
+        def info(i: int, sym: str, status: str) -> dict:
+            return {"orderId": i + 1, "permId": 10_000_000 + i, "action": "BUY", "symbol": sym,
+                    "orderType": "LMT", "lmtPrice": 100.0, "tif": "DAY", "outsideRth": True,
+                    "status": status, "filled": 0.0, "remaining": 1.0, "avgFillPrice": 0.0,
+                    "lastFillPrice": 0.0, "whyHeld": ""}
+
+        async def op(name, calls):
+            w = _Write()
+            lat = []
+            started = time.perf_counter()
+            for call in calls:
+                t0 = time.perf_counter()
+                await call()
+                lat.append(time.perf_counter() - t0)
+            elapsed = time.perf_counter() - started
+            res[name] = {**_quantiles(lat), "ops_per_sec": round(len(lat) / elapsed, 1),
+                         "writes": w.result(rows=len(lat))}
+
+        await op("upsert_order_insert", [lambda i=i, s=s: db.upsert_order(info(i, s, "Submitted"))
+                                         for i, s in enumerate(symbols)])
+        await op("upsert_order_update", [lambda i=i, s=s: db.upsert_order(info(i, s, "Filled"))
+                                         for i, s in enumerate(symbols)])
+        await op("upsert_symbol_from_ib", [lambda s=s: db.upsert_symbol_from_ib(s, 1.0, 100.0) for s in symbols])
+        await op("set_avg_qty", [lambda s=s: db.set_avg_qty(s, 101.0, 2.0) for s in symbols])
+        await op("has_active_order", [lambda s=s: db.has_active_order(s) for s in symbols])
+        await op("load_avg_qty_for", [lambda: db.load_avg_qty_for(symbols)] * args.iterations)
+        await op("fetch_white_list_pairs", [db.fetch_white_list_pairs] * args.iterations)
+        await op("mark_missing_open_orders_as_killed",
+                 [lambda: db.mark_missing_open_orders_as_killed(range(10_000_000, 10_000_000 + n // 2))])
+    finally:
+        await db.config.close()
+        await db.pool.close()
+    return res
+
+
+def _child(args) -> int:
+    fn = _bench_engine if args.target == "engine" else _bench_db
+    res = asyncio.run(fn(args.one, args))
+    print(json.dumps(res))
+    return 0
+
+
+# ---------------------------
+# Родитель: по процессу на (target, размер)
+# ---------------------------
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _run_child(target: str, n: int, args, tmp: str) -> dict:
+    db_path = os.path.join(tmp, f"bench_{target}_{n}.db")
+    env = {**os.environ, "DB_PATH": db_path, "METRICS": "true", "METRICS_PORT": "0",
+           "METRICS_SUMMARY_SEC": "0", "LOOP_SLEEP": str(args.loop_sleep),
+           "IB_MSG_RATE": str(args.ib_rate),
+           "REACTIVE": "true" if args.reactive else "false"}
+    cmd = [sys.executable, os.path.abspath(__file__), "--one", str(n), "--target", target,
+           "--seconds", str(args.seconds), "--iterations", str(args.iterations),
+           "--latency", str(args.latency), "--tick-interval", str(args.tick_interval)]
+    p = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    if p.returncode != 0:
+        raise RuntimeError(f"{target}/{n} failed:\n{p.stderr[-2000:]}")
+    return json.loads(p.stdout.strip().splitlines()[-1])
+
+
+def _print_summary(results: List[dict]) -> None:
+    for r in results:
+        if r["target"] == "engine":
+            loop = r["dca_loop"]
+            w = loop["writes"]
+            print(f"engine  {r['symbols']:>5} symbols: {loop['cycles_per_sec']:>8.2f} cycles/s  "
+                  f"reconcile_orders p50={r['reconcile_orders'].get('p50_ms', 0):.1f}ms  "
+                  f"reconcile_positions p50={r['reconcile_positions'].get('p50_ms', 0):.1f}ms  "
+                  f"rows={w['rows']} commits={w.get('commits')} bytes/row={w.get('bytes_per_row')}")
+        else:
+            parts = [f"{k}={v['ops_per_sec']:.0f}/s" for k, v in r.items() if isinstance(v, dict)]
+            print(f"db      {r['symbols']:>5} symbols: " + "  ".join(parts))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Engine/db benchmark on a fake IB")
+    ap.add_argument("--symbols", default="10,100,1000", help="white_list sizes, comma-separated")
+    ap.add_argument("--targets", default="engine,db")
+    ap.add_argument("--seconds", type=float, default=10, help="how long to run dca_loop per size")
+    ap.add_argument("--iterations", type=int, default=20, help="reconcile calls per size")
+    ap.add_argument("--latency", type=float, default=0.005, help="fake IB round-trip, sec")
+    ap.add_argument("--tick-interval", type=float, default=0.25)
+    ap.add_argument("--loop-sleep", type=float, default=0.0, help="LOOP_SLEEP for dca_loop")
+    ap.add_argument("--ib-rate", type=float, default=0.0,
+                    help="IB_MSG_RATE for the engine (0 = no limit, measure code paths only)")
+    ap.add_argument("--reactive", action="store_true")
+    ap.add_argument("--out", default=BENCH_OUT)
+    ap.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    ap.add_argument("--target", default="engine", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.one is not None:
+        return _child(args)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in (int(x) for x in args.symbols.split(",") if x.strip()):
+            for target in (t.strip() for t in args.targets.split(",") if t.strip()):
+                results.append(_run_child(target, n, args, tmp))
+    _print_summary(results)
+
+    record = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": _git_rev(),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("one", "target", "out")},
+        "results": results,
+    }
+    with open(args.out, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"# appended to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
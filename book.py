@@ -0,0 +1,304 @@
+# book.py
+import os
+import time
+import asyncio
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+# Какие статусы считаем «открытыми» локально
+OPEN_STATUSES = {"Submitted", "PreSubmitted", "PendingSubmit", "Inactive"}
+
+# начальная ёмкость массивов книги (тикеров); растёт удвоением
+BOOK_INITIAL_CAPACITY = 64
+
+# исполнение, которого позиция из IB ещё не отразила, держит тикер занятым;
+# не дольше стольких секунд (позиция могла прийти раньше статуса ордера)
+FILL_SETTLE_SEC = float(os.getenv("FILL_SETTLE_SEC", "120"))
+
+# ---------------------------
+# Вспомогательные структуры
+# ---------------------------
+class Position(NamedTuple):
+    """Снимок позиции (только для чтения); в книге позиции лежат в массивах."""
+    symbol: str
+    qty: float
+    avg_cost: float
+    last: float
+
+
+OrderKey = Tuple[str, int, int]
+
+
+def order_key(order_id: Optional[int], perm_id: Optional[int], client_id: Optional[int] = 0) -> OrderKey:
+    """
+    permId стабилен в IB; пока его нет (только что отправили) — ключ по
+    (clientId, orderId): orderId уникален только в пределах clientId.
+    """
+    if perm_id:
+        return ("p", 0, int(perm_id))
+    return ("o", int(client_id or 0), int(order_id or 0))
+
+
+# поля ордера — имена как в IB (Order / OrderStatus) и в таблице orders
+_ORDER_ATTRS = ("orderId", "clientId", "permId", "action", "orderType", "lmtPrice", "tif", "outsideRth")
+_STATUS_ATTRS = ("status", "filled", "remaining", "avgFillPrice", "lastFillPrice", "whyHeld")
+_FIELDS = _ORDER_ATTRS + _STATUS_ATTRS
+
+
+class OrderRec:
+    """
+    Ордер в книге: одна запись на ордер, обновляется на месте.
+    update_*() вернут True, если изменилось хоть одно поле — только тогда
+    ордер нужно переписать в БД.
+    """
+    __slots__ = ("symbol", "idx") + _FIELDS
+
+    def __init__(self, symbol: str, idx: int):
+        self.symbol = symbol
+        self.idx = idx
+        for name in _FIELDS:
+            setattr(self, name, None)
+
+    def update_trade(self, trade) -> bool:
+        """Из ib_insync.Trade, без промежуточного dict."""
+        changed = False
+        o, st = trade.order, trade.orderStatus
+        for name in _ORDER_ATTRS:
+            v = getattr(o, name, None)
+            if getattr(self, name) != v:
+                setattr(self, name, v)
+                changed = True
+        for name in _STATUS_ATTRS:
+            v = getattr(st, name, None)
+            if getattr(self, name) != v:
+                setattr(self, name, v)
+                changed = True
+        return changed
+
+    def update_info(self, info: dict) -> bool:
+        changed = False
+        for name in _FIELDS:
+            v = info.get(name)
+            if getattr(self, name) != v:
+                setattr(self, name, v)
+                changed = True
+        return changed
+
+    def as_dict(self) -> dict:
+        out = {"symbol": self.symbol}
+        for name in _FIELDS:
+            out[name] = getattr(self, name)
+        return out
+
+    @property
+    def is_open(self) -> bool:
+        return self.status in OPEN_STATUSES
+
+
+class LiveBook:
+    """
+    In-memory книга ордеров и позиций. Её обновляют колбэки IB
+    (orderStatusEvent / execDetailsEvent / positionEvent), цены и
+    периодический reconcile. dirty — тикеры, у которых с прошлой оценки
+    изменилось состояние или цена; changed будит реактивный цикл.
+
+    Исполнение ордера меняет позицию не сразу: Filled приходит раньше
+    positionEvent / reqPositions. unsettled — сколько исполнено (BUY +, SELL −)
+    сверх того, что уже видно в qty; пока он не погашен, тикер занят (busy),
+    иначе оценка по старой позиции поставит второй DCA-BUY. Позиция, снятая
+    после исполнения (fill_at), его уже содержит — unsettled сбрасывается.
+    Исполнения ордера, впервые увиденного уже с filled > 0 (старт, reconcile),
+    не считаются: когда они были и видны ли в qty — неизвестно.
+
+    Позиции — struct-of-arrays по индексу тикера (qty/avg/last/known/open_n):
+    обновление не создаёт объектов, снимок для стадии решений — срез массивов.
+    В orders только открытые ордера (OrderRec); завершённые уходят из книги,
+    так что память не растёт с историей.
+    """
+
+    def __init__(self, capacity: int = BOOK_INITIAL_CAPACITY):
+        capacity = max(1, capacity)
+        self._index: Dict[str, int] = {}
+        self.symbols: List[str] = []
+        self.qty = np.zeros(capacity)
+        self.avg = np.zeros(capacity)
+        self.last = np.zeros(capacity)
+        self.known = np.zeros(capacity, dtype=bool)       # позиция уже пришла из IB
+        self.open_n = np.zeros(capacity, dtype=np.int32)  # открытых ордеров по тикеру
+        self.unsettled = np.zeros(capacity)                # исполнено, но ещё не в qty
+        self.settle_by = np.zeros(capacity)                # time.monotonic() — ждать не дольше
+        self.fill_at = np.zeros(capacity)                  # time.monotonic() последнего исполнения
+        self.orders: Dict[OrderKey, OrderRec] = {}
+        self._dirty: Set[str] = set()
+        self.changed = asyncio.Event()
+
+    # ---------- индекс тикеров ----------
+    def index(self, symbol: str) -> int:
+        i = self._index.get(symbol)
+        if i is None:
+            i = self._index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            if i >= self.qty.shape[0]:
+                self._grow(2 * self.qty.shape[0])
+        return i
+
+    def _grow(self, capacity: int) -> None:
+        for name in ("qty", "avg", "last", "known", "open_n", "unsettled", "settle_by", "fill_at"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:old.shape[0]] = old
+            setattr(self, name, new)
+
+    # ---------- ордера ----------
+    def apply_trade(self, trade, live: bool = False) -> Tuple[bool, Optional[OrderRec]]:
+        """
+        Статус ордера из IB → (изменился ли, запись). Для ордера без тикера — (False, None).
+        live — вызов из execDetailsEvent: исполнение только что случилось, считаем
+        его и у ордера, которого книга ещё не видела.
+        """
+        sym = trade.contract.symbol
+        if not sym:
+            return False, None
+        o = trade.order
+        key, rec = self._locate(sym, o.orderId, o.permId, o.clientId)
+        seen = live or key in self.orders
+        was_open, filled = rec.is_open, rec.filled or 0.0
+        changed = rec.update_trade(trade)
+        if changed and seen and (rec.filled or 0.0) > filled:
+            self._fill(rec, (rec.filled or 0.0) - filled)
+        return self._settle(key, rec, was_open, changed), rec
+
+    def apply_order(self, info: dict) -> Tuple[bool, Optional[OrderRec]]:
+        """То же из dict (orderId, clientId, permId, symbol, status, …)."""
+        sym = info.get("symbol")
+        if not sym:
+            return False, None
+        key, rec = self._locate(sym, info.get("orderId"), info.get("permId"), info.get("clientId"))
+        was_open = rec.is_open
+        return self._settle(key, rec, was_open, rec.update_info(info)), rec
+
+    def _locate(self, sym: str, order_id, perm_id, client_id) -> Tuple[OrderKey, OrderRec]:
+        key = order_key(order_id, perm_id, client_id)
+        rec = self.orders.get(key)
+        if rec is None and key[0] == "p" and order_id:
+            # ордер получил permId — запись по orderId переезжает под новый ключ
+            rec = self.orders.pop(order_key(order_id, None, client_id), None)
+            if rec is not None:
+                self.orders[key] = rec
+        if rec is None:
+            rec = OrderRec(sym, self.index(sym))
+        return key, rec
+
+    def _settle(self, key: OrderKey, rec: OrderRec, was_open: bool, changed: bool) -> bool:
+        now_open = rec.is_open
+        if now_open:
+            self.orders[key] = rec
+        else:
+            self.orders.pop(key, None)
+        if now_open != was_open:
+            self.open_n[rec.idx] += 1 if now_open else -1
+        if changed:
+            self.mark_dirty(rec.symbol)
+        return changed
+
+    def _fill(self, rec: OrderRec, qty: float) -> None:
+        i = rec.idx
+        now = time.monotonic()
+        self.unsettled[i] += qty if rec.action == "BUY" else -qty
+        self.fill_at[i] = now
+        self.settle_by[i] = now + FILL_SETTLE_SEC
+
+    def retain_open(self, open_keys: Iterable[Tuple[int, int, int]]) -> List[OrderRec]:
+        """
+        open_keys — (orderId, permId, clientId) открытых в IB.
+        Всё открытое в книге, чего там нет, → Killed. Вернёт убитые.
+        """
+        alive = {order_key(oid, pid, cid) for (oid, pid, cid) in open_keys}
+        alive |= {order_key(oid, None, cid) for (oid, _, cid) in open_keys if oid}
+        killed = []
+        for key, rec in list(self.orders.items()):
+            if key not in alive:
+                rec.status = "Killed"
+                del self.orders[key]
+                self.open_n[rec.idx] -= 1
+                killed.append(rec)
+                self.mark_dirty(rec.symbol)
+        return killed
+
+    def has_open(self, symbol: str) -> bool:
+        i = self._index.get(symbol)
+        return i is not None and bool(self.open_n[i] > 0)
+
+    def settling(self, symbol: str) -> bool:
+        """Есть исполнение, которого позиция ещё не отразила."""
+        i = self._index.get(symbol)
+        return i is not None and self.unsettled[i] != 0 and self.settle_by[i] > time.monotonic()
+
+    def busy(self, symbol: str) -> bool:
+        return self.has_open(symbol) or self.settling(symbol)
+
+    def open_count(self) -> int:
+        return len(self.orders)
+
+    # ---------- позиции и цены ----------
+    def set_position(self, symbol: str, qty: float, avg_cost: float, last: Optional[float] = None,
+                     asof: Optional[float] = None) -> None:
+        """
+        asof — time.monotonic(), на который снята позиция (для reqPositions —
+        момент запроса); None — только что (positionEvent).
+        """
+        i = self.index(symbol)
+        changed = not self.known[i] or self.qty[i] != qty or self.avg[i] != avg_cost
+        u = self.unsettled[i]
+        if u and (asof is None or asof > self.fill_at[i]):
+            # позиция снята после исполнения — оно в qty (даже если qty не сдвинулся:
+            # positionEvent пришёл раньше Filled) — тикер свободен
+            self.unsettled[i] = 0.0
+            changed = True
+        elif u and self.known[i] and self.qty[i] != qty:
+            # снимок старше исполнения, но позиция уже сдвинулась — гасим на сдвиг
+            rest = u - (qty - self.qty[i])
+            self.unsettled[i] = 0.0 if abs(rest) < 1e-9 or rest * u < 0 else rest
+        self.known[i] = True
+        self.qty[i] = qty
+        self.avg[i] = avg_cost
+        # last=None — цену не знаем, оставляем пришедшую тиком раньше
+        if last is not None and self.last[i] != last:
+            self.last[i] = last
+            changed = True
+        if changed:
+            self.mark_dirty(symbol)
+
+    def set_last(self, symbol: str, last: float) -> None:
+        i = self.index(symbol)
+        if self.last[i] != last:
+            self.last[i] = last
+            # позиции ещё не знаем — цену запомним до reconcile
+            if self.known[i]:
+                self.mark_dirty(symbol)
+
+    def position(self, symbol: str) -> Optional[Position]:
+        i = self._index.get(symbol)
+        if i is None or not self.known[i]:
+            return None
+        return Position(symbol, float(self.qty[i]), float(self.avg[i]), float(self.last[i]))
+
+    def arrays(self, symbols: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (qty, avg, last, busy, known) по списку тикеров — срезом массивов;
+        busy — открытый ордер или исполнение, которого ещё нет в qty.
+        """
+        idx = np.fromiter((self.index(s) for s in symbols), dtype=np.intp, count=len(symbols))
+        busy = (self.open_n[idx] > 0) | ((self.unsettled[idx] != 0) & (self.settle_by[idx] > time.monotonic()))
+        return self.qty[idx], self.avg[idx], self.last[idx], busy, self.known[idx]
+
+    # ---------- dirty ----------
+    def mark_dirty(self, symbol: str) -> None:
+        self._dirty.add(symbol)
+        self.changed.set()
+
+    def take_dirty(self) -> Set[str]:
+        dirty, self._dirty = self._dirty, set()
+        self.changed.clear()
+        return dirty
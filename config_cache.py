@@ -0,0 +1,104 @@
+# config_cache.py
+import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+
+from schema import migrate
+
+log = logging.getLogger("config_cache")
+
+
+def norm_symbol(symbol: str) -> str:
+    return (symbol or "").strip().upper()
+
+
+class ConfigCache:
+    """
+    white_list и активная строка trade_params в памяти.
+    refresh() дёшев: PRAGMA data_version на собственном соединении говорит,
+    коммитил ли кто-то ещё; только тогда читаем config_version, и только
+    если он сдвинулся (правка из Telegram) — перечитываем таблицы.
+    config_version и его триггеры создаёт миграция schema.py.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._cx: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Lock()
+        self._data_version: Optional[int] = None
+        self.version: Optional[int] = None
+        self._pairs: List[str] = []
+        self._pair_set: frozenset = frozenset()
+        self._trade_params: Dict[str, Any] = {}
+        self.reloads = 0
+
+    async def _connect(self) -> aiosqlite.Connection:
+        if self._cx is None:
+            cx = await aiosqlite.connect(self.path)
+            await cx.execute("PRAGMA busy_timeout=5000;")
+            # обычно схема уже актуальна (engine/db мигрируют на старте) — тогда это один PRAGMA
+            await migrate(cx)
+            self._cx = cx
+        return self._cx
+
+    async def refresh(self) -> bool:
+        """Вернёт True, если конфигурация перечитана."""
+        async with self._lock:
+            cx = await self._connect()
+            async with cx.execute("PRAGMA data_version") as cur:
+                dv = (await cur.fetchone())[0]
+            if dv == self._data_version and self.version is not None:
+                return False
+            self._data_version = dv
+
+            # сначала версия, потом данные: правка между ними даст лишь лишнее перечитывание
+            async with cx.execute("SELECT v FROM config_version WHERE id = 1") as cur:
+                v = (await cur.fetchone())[0]
+            if v == self.version:
+                return False
+
+            rows = await cx.execute_fetchall("SELECT pair FROM white_list")
+            pairs = sorted({norm_symbol(r[0]) for r in rows if r[0] and r[0].strip()})
+            cx.row_factory = aiosqlite.Row
+            try:
+                async with cx.execute("SELECT * FROM trade_params ORDER BY id ASC LIMIT 1") as cur:
+                    row = await cur.fetchone()
+            finally:
+                cx.row_factory = None
+
+            self._pairs = pairs
+            self._pair_set = frozenset(pairs)
+            self._trade_params = dict(row) if row else {}
+            self.version = v
+            self.reloads += 1
+            log.info("config reloaded (v=%s): %d pairs in white_list", v, len(pairs))
+            return True
+
+    def pairs(self) -> List[str]:
+        return list(self._pairs)
+
+    def is_whitelisted(self, symbol: str) -> bool:
+        return norm_symbol(symbol) in self._pair_set
+
+    def trade_params(self) -> Dict[str, Any]:
+        return dict(self._trade_params)
+
+    async def close(self) -> None:
+        if self._cx is not None:
+            await self._cx.close()
+            self._cx = None
+
+
+_caches: Dict[str, ConfigCache] = {}
+
+
+def get_config(path: str) -> ConfigCache:
+    """Один кэш на файл БД — db.py и engine.py делят его."""
+    key = os.path.abspath(path)
+    cache = _caches.get(key)
+    if cache is None:
+        cache = _caches[key] = ConfigCache(path)
+    return cache
@@ -0,0 +1,108 @@
+# contracts.py
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+from ib_insync import IB, Contract, Stock
+
+from dbpool import get_pool
+from ratelimit import TokenBucket, ib_limiter
+
+log = logging.getLogger("contracts")
+
+# через сколько секунд перепроверять квалификацию (по умолчанию — сутки)
+CONTRACT_TTL = float(os.getenv("CONTRACT_TTL", str(24 * 3600)))
+
+CREATE_CONTRACTS_SQL = """
+CREATE TABLE IF NOT EXISTS contracts(
+    symbol TEXT PRIMARY KEY,
+    conId INTEGER NOT NULL,
+    exchange TEXT,
+    primaryExchange TEXT,
+    currency TEXT,
+    updated_at INTEGER
+);
+"""
+
+
+def _new_stock(symbol: str) -> Stock:
+    return Stock(symbol, "SMART", "USD", primaryExchange="NASDAQ")
+
+
+class ContractCache:
+    """
+    Квалифицированные контракты по тикеру (conId, exchange, primaryExchange).
+    Живут в памяти и в таблице contracts — холодный старт не квалифицирует
+    весь white_list заново. Промахи и протухшие (старше CONTRACT_TTL)
+    квалифицируются одним qualifyContractsAsync(*contracts); это запрос на
+    каждый контракт — из limiter берём столько же токенов.
+    """
+
+    def __init__(self, db_path: str, ttl: float = CONTRACT_TTL,
+                 limiter: Optional[TokenBucket] = ib_limiter):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.limiter = limiter
+        self._cache: Dict[str, Tuple[Contract, int]] = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> int:
+        async with get_pool(self.db_path).acquire() as cx:
+            rows = await cx.execute_fetchall(
+                "SELECT symbol, conId, exchange, primaryExchange, currency, updated_at FROM contracts")
+        for sym, con_id, exchange, primary, currency, updated_at in rows:
+            c = Stock(sym, exchange or "SMART", currency or "USD", primaryExchange=primary or "", conId=con_id)
+            self._cache[sym] = (c, int(updated_at or 0))
+        log.info("contracts: %d loaded from DB", len(rows))
+        return len(rows)
+
+    def _fresh(self, symbol: str, now: int) -> bool:
+        hit = self._cache.get(symbol)
+        return hit is not None and now - hit[1] < self.ttl
+
+    async def get(self, ib: IB, symbol: str) -> Contract:
+        c = (await self.qualify_many(ib, [symbol])).get(symbol)
+        if c is None:
+            raise ValueError(f"cannot qualify contract for {symbol}")
+        return c
+
+    async def qualify_many(self, ib: IB, symbols: Iterable[str]) -> Dict[str, Contract]:
+        symbols = list(symbols)
+        now = int(time.time())
+        if any(not self._fresh(s, now) for s in symbols):
+            async with self._lock:
+                # пока ждали лок, кто-то мог уже квалифицировать
+                misses = [s for s in dict.fromkeys(symbols) if not self._fresh(s, now)]
+                if misses:
+                    await self._qualify(ib, misses, now)
+        return {s: self._cache[s][0] for s in symbols if s in self._cache}
+
+    async def _qualify(self, ib: IB, symbols: list, now: int) -> None:
+        contracts = [_new_stock(s) for s in symbols]
+        if self.limiter is not None:
+            await self.limiter.acquire(len(contracts))
+        await ib.qualifyContractsAsync(*contracts)
+        rows = []
+        for sym, c in zip(symbols, contracts):
+            if not c.conId:
+                log.error("contract %s not qualified", sym)
+                continue
+            self._cache[sym] = (c, now)
+            rows.append((sym, c.conId, c.exchange, c.primaryExchange, c.currency, now))
+        if not rows:
+            return
+        async with get_pool(self.db_path).acquire() as cx:
+            await cx.executemany("""
+            INSERT INTO contracts(symbol, conId, exchange, primaryExchange, currency, updated_at)
+            VALUES(?,?,?,?,?,?)
+            ON CONFLICT(symbol) DO UPDATE SET
+                conId=excluded.conId,
+                exchange=excluded.exchange,
+                primaryExchange=excluded.primaryExchange,
+                currency=excluded.currency,
+                updated_at=excluded.updated_at
+            """, rows)
+            await cx.commit()
+        log.info("contracts: qualified %d/%d", len(rows), len(symbols))
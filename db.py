@@ -1,35 +1,45 @@
 # db.py
 import os
 import json
+from collections import OrderedDict
 from typing import Any, Dict
-import aiosqlite
 from typing import Iterable
+from dbpool import get_pool
+from config_cache import get_config
+from schema import (CREATE_SYMBOLS_SQL, CREATE_WHITE_LIST_SQL, CREATE_TRADE_PARAMS_SQL,
+                    CREATE_ORDERS_SQL, NOW_SQL, OPEN_STATUS_SQL, kill_missing_open_orders,
+                    migrate, upsert_order_sql)
 # Путь к базе: берём из .env или по умолчанию bot.db
 DB_PATH = os.getenv("DB_PATH", "bot.db").strip()
-ACTIVE_STATUSES = ("Submitted", "PreSubmitted", "PendingSubmit", "Inactive")
+ACTIVE_STATUSES = ("Submitted", "PreSubmitted", "PendingSubmit", "Inactive")  # = schema.OPEN_STATUS_SQL
+
+# пул долгоживущих соединений (WAL, synchronous=NORMAL, busy_timeout), общий с engine.py
+pool = get_pool(DB_PATH)
+# white_list/trade_params в памяти, перечитываются по config_version
+config = get_config(DB_PATH)
 
 async def is_whitelisted(symbol: str) -> bool:
-    q = "SELECT 1 FROM white_list WHERE UPPER(pair)=UPPER(?) LIMIT 1"
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(q, (symbol,)) as cur:
-            return await cur.fetchone() is not None
+    await config.refresh()
+    return config.is_whitelisted(symbol)
 
 async def has_active_order(symbol: str) -> bool:
+    # symbol в orders — COLLATE NOCASE: регистр не важен, индекс (symbol, status) работает
+    # статусы литералами (OPEN_STATUS_SQL) — под частичный индекс открытых ордеров
     q = f"""
     SELECT 1
     FROM orders
-    WHERE UPPER(symbol)=UPPER(?)
-      AND status IN ({",".join("?"*len(ACTIVE_STATUSES))})
+    WHERE symbol=?
+      AND {OPEN_STATUS_SQL}
     LIMIT 1
     """
-    params = (symbol, *ACTIVE_STATUSES)
-    async with aiosqlite.connect(DB_PATH) as db:
+    params = (symbol,)
+    async with pool.acquire() as db:
         async with db.execute(q, params) as cur:
             return await cur.fetchone() is not None
 
 async def mark_order_killed(perm_id: int) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE orders SET status='Killed', updated_at=CURRENT_TIMESTAMP WHERE permId=?", (perm_id,))
+    async with pool.acquire() as db:
+        await db.execute(f"UPDATE orders SET status='Killed', updated_at={NOW_SQL} WHERE permId=?", (perm_id,))
         await db.commit()
 
 async def mark_missing_open_orders_as_killed(active_perm_ids: Iterable[int]) -> int:
@@ -37,142 +47,19 @@ async def mark_missing_open_orders_as_killed(active_perm_ids: Iterable[int]) ->
     Всё активное в БД, чего нет среди активных в IB → пометить Killed.
     Вернёт кол-во помеченных строк.
     """
-    ids = list(int(x) for x in active_perm_ids if x)
-    placeholders = ",".join("?"*len(ids)) if ids else ""
-    base = f"status IN ({','.join('?'*len(ACTIVE_STATUSES))})"
-    if ids:
-        sql = f"UPDATE orders SET status='Killed', updated_at=CURRENT_TIMESTAMP WHERE {base} AND permId NOT IN ({placeholders})"
-        params = (*ACTIVE_STATUSES, *ids)
-    else:
-        sql = f"UPDATE orders SET status='Killed', updated_at=CURRENT_TIMESTAMP WHERE {base}"
-        params = (*ACTIVE_STATUSES,)
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(sql, params)
+    # permId из IB — во временную таблицу, Killed — одним UPDATE (без NOT IN (?,?,…))
+    async with pool.acquire() as db:
+        killed = await kill_missing_open_orders(db, active_perm_ids)
         await db.commit()
-        return cur.rowcount
-
-
-# ---------- схемы ----------
-CREATE_SYMBOLS_SQL = """
-CREATE TABLE IF NOT EXISTS symbols(
-    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-    pair TEXT UNIQUE,
-    baseAsset TEXT, quoteAsset TEXT, stepSize TEXT, tickSize TEXT, minNotional TEXT,
-    priceChangePercent TEXT, bidPrice TEXT, askPrice TEXT, value TEXT, averagePrice TEXT,
-    buyPrice TEXT, sellPrice TEXT, trailingPrice TEXT, allQuantity TEXT, freeQuantity TEXT,
-    lockQuantity TEXT, orderId TEXT, profit TEXT, totalQuote TEXT, stepAveraging TEXT,
-    numAveraging TEXT, statusOrder TEXT, timer TEXT, pumpDetector TEXT, pumpSignal TEXT,
-    lowPrice TEXT, multiplierDown TEXT, multiplierUp TEXT, lockedQuote TEXT, twSignal TEXT,
-    oco BOOLEAN, lastEvent TEXT, manualReinvest BOOLEAN, rowSell TEXT, sellCount TEXT,
-    bidMultiplierDown TEXT, askMultiplierUp TEXT, signal TEXT, averagingBlocking BOOLEAN,
-    rowTimer TEXT, delisting BOOLEAN, volatility TEXT
-);
-"""
-
-CREATE_WHITE_LIST_SQL = """
-CREATE TABLE IF NOT EXISTS white_list(
-    id   INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-    pair TEXT
-);
-"""
-
-CREATE_TRADE_PARAMS_SQL = """
-CREATE TABLE IF NOT EXISTS trade_params(
-    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-    timeout_socket TEXT,
-    min_bnb TEXT,
-    min_balance TEXT,
-    position_size TEXT,
-    min_order TEXT,
-    min_price TEXT,
-    min_daily_percent TEXT,
-    daily_percent TEXT,
-    auto_daily_percent TEXT,
-    order_timer TEXT,
-    min_value TEXT,
-    sell_up TEXT,
-    buy_down TEXT,
-    max_trade_pairs TEXT,
-    auto_trade_pairs BOOLEAN,
-    progressive_max_pairs BOOLEAN,
-    delta_percent BOOLEAN,
-    delta_deep BOOLEAN,
-    num_aver BOOLEAN,
-    step_aver TEXT,
-    max_aver TEXT,
-    quantity_aver TEXT,
-    average_percent TEXT,
-    trailing_stop BOOLEAN,
-    trailing_percent TEXT,
-    trailing_part TEXT,
-    trailing_price TEXT,
-    new_listing BOOLEAN,
-    listing_order TEXT,
-    max_buy_listing TEXT,
-    user_order BOOLEAN,
-    fiat_currencies TEXT,
-    quote_asset TEXT,
-    double_asset BOOLEAN,
-    pump_detector BOOLEAN,
-    pump_order TEXT,
-    pump_up TEXT,
-    max_pump_pairs TEXT,
-    trailing_pump BOOLEAN,
-    tg_template TEXT,
-    individual_depth BOOLEAN,
-    reinvest_position BOOLEAN,
-    reinvest_percent TEXT,
-    trading_view BOOLEAN,
-    max_trading_view TEXT,
-    row_sell TEXT,
-    sell_count BOOLEAN,
-    trailing_value TEXT,
-    signals BOOLEAN,
-    max_signals TEXT,
-    volatility BOOLEAN,
-    delisting_sale BOOLEAN,
-    conf_key TEXT,
-    dev_signals BOOLEAN,
-    max_dev_signals TEXT,
-    average_dev_signals BOOLEAN
-);
-"""
+        return killed
 
-# Новая таблица под ордера IB
-CREATE_ORDERS_SQL = """
-CREATE TABLE IF NOT EXISTS orders(
-    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-    orderId INTEGER,
-    permId  INTEGER UNIQUE,          -- ключ для UPSERT
-    action TEXT,
-    symbol TEXT,
-    orderType TEXT,
-    lmtPrice REAL,
-    tif TEXT,
-    outsideRth INTEGER,
-    status TEXT,
-    filled REAL,
-    remaining REAL,
-    avgFillPrice REAL,
-    lastFillPrice REAL,
-    whyHeld TEXT,
-    raw_json TEXT,
-    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-);
-CREATE INDEX IF NOT EXISTS idx_orders_permId ON orders(permId);
-CREATE INDEX IF NOT EXISTS idx_orders_orderId ON orders(orderId);
-"""
 
-# ---------- инициализация ----------
+# ---------- схема ----------
+# CREATE_*_SQL живут в schema.py (импортированы выше ради совместимости);
+# таблицы создаёт и обновляет migrate() по PRAGMA user_version
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.executescript(CREATE_SYMBOLS_SQL)
-        await db.executescript(CREATE_WHITE_LIST_SQL)
-        await db.executescript(CREATE_TRADE_PARAMS_SQL)
-        await db.executescript(CREATE_ORDERS_SQL)
-        await db.commit()
+    async with pool.acquire() as db:
+        await migrate(db)
 
 # ---------- helpers ----------
 def _bool_to_int(v: Any) -> int | None:
@@ -181,17 +68,48 @@ def _bool_to_int(v: Any) -> int | None:
     return 1 if bool(v) else 0
 
 # ---------- upsert ордера ----------
+# по permId; строку, которую движок записал до прихода permId, находим по (clientId, orderId).
+# raw_json=NULL — «payload не изменился», колонку не трогаем
+_UPSERT_ORDER_SQL = upsert_order_sql((
+    "orderId", "clientId", "permId", "action", "symbol", "orderType", "lmtPrice", "tif", "outsideRth",
+    "status", "filled", "remaining", "avgFillPrice", "lastFillPrice", "whyHeld", "raw_json",
+), named=True, keep=("raw_json",))
+
+# хеш последнего записанного payload открытых ордеров (по permId), LRU
+_raw_hash: OrderedDict[int, int] = OrderedDict()
+RAW_HASH_MAX = int(os.getenv("RAW_HASH_MAX", "10000"))
+
+# меняются на каждом апдейте статуса и лежат в своих колонках — в хеш не входят,
+# иначе raw_json переписывался бы каждый раз
+_VOLATILE_FIELDS = frozenset(("status", "filled", "remaining", "avgFillPrice", "lastFillPrice", "whyHeld"))
+
+def _payload_hash(info: Dict[str, Any]) -> int:
+    stable = tuple((k, v) for k, v in info.items() if k not in _VOLATILE_FIELDS)
+    try:
+        return hash(stable)
+    except TypeError:
+        # вложенные списки/словари — хешируем их JSON
+        return hash(json.dumps(dict(stable), sort_keys=True, default=str))
+
 async def upsert_order(info: Dict[str, Any]) -> None:
     """
     Сохранить/обновить запись об ордере по permId.
     Ожидает словарь вида, который возвращает _trade_summary в app.py.
     """
     perm_id = info.get("permId")
-    if perm_id is None:
+    if not perm_id:
         raise ValueError("permId is required for upsert_order")
+    # json.dumps на каждый апдейт статуса дорог — raw_json только если изменились
+    # сами параметры ордера (цена, объём, tif...), статус/исполнение — в колонках
+    h = _payload_hash(info)
+    seen = _raw_hash.get(perm_id)
+    if seen is not None:
+        _raw_hash.move_to_end(perm_id)
+    raw = None if seen == h else json.dumps(info, ensure_ascii=False)
 
     payload = {
-        "orderId":       info.get("orderId"),
+        "orderId":       info.get("orderId") or None,
+        "clientId":      info.get("clientId"),
         "permId":        perm_id,
         "action":        info.get("action"),
         "symbol":        info.get("symbol"),
@@ -205,51 +123,40 @@ async def upsert_order(info: Dict[str, Any]) -> None:
         "avgFillPrice":  info.get("avgFillPrice"),
         "lastFillPrice": info.get("lastFillPrice"),
         "whyHeld":       info.get("whyHeld"),
-        "raw_json":      json.dumps(info, ensure_ascii=False),
+        "raw_json":      raw,
     }
 
-    cols = ", ".join(payload.keys())
-    placeholders = ", ".join([f":{k}" for k in payload.keys()])
-    set_clause = ", ".join([f"{k}=excluded.{k}" for k in payload.keys() if k != "permId"])
-
-    sql = f"""
-    INSERT INTO orders ({cols})
-    VALUES ({placeholders})
-    ON CONFLICT(permId) DO UPDATE SET
-        {set_clause},
-        updated_at = CURRENT_TIMESTAMP
-    ;
-    """
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-        await db.execute(sql, payload)
+    async with pool.acquire() as db:
+        await db.execute(_UPSERT_ORDER_SQL, payload)
         await db.commit()
+    if info.get("status") in ACTIVE_STATUSES:
+        _raw_hash[perm_id] = h
+        _raw_hash.move_to_end(perm_id)
+        while len(_raw_hash) > RAW_HASH_MAX:
+            _raw_hash.popitem(last=False)
+    else:
+        # завершённый ордер может уехать в архив — новая строка должна получить raw_json
+        _raw_hash.pop(perm_id, None)
 
 # ---------- оставшиеся утилиты из твоего db.py ----------
 async def fetch_trade_params() -> dict[str, Any]:
     """Берём первую строку trade_params как активный профиль."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM trade_params ORDER BY id ASC LIMIT 1") as cur:
-            row = await cur.fetchone()
-            return dict(row) if row else {}
+    await config.refresh()
+    return config.trade_params()
 
 async def upsert_symbol_from_ib(symbol: str, qty: float, avg_price: float):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT id FROM symbols WHERE pair=?", (symbol,)) as cur:
-            row = await cur.fetchone()
-        if row:
-            await db.execute(
-                "UPDATE symbols SET averagePrice=?, allQuantity=?, freeQuantity=?, statusOrder=? WHERE pair=?",
-                (str(avg_price), str(qty), str(qty), "OPEN" if qty != 0 else "FLAT", symbol),
-            )
-        else:
-            await db.execute(
-                "INSERT INTO symbols(pair, averagePrice, allQuantity, freeQuantity, statusOrder) VALUES(?,?,?,?,?)",
-                (symbol, str(avg_price), str(qty), str(qty), "OPEN" if qty != 0 else "FLAT"),
-            )
+    async with pool.acquire() as db:
+        await db.execute(
+            """
+            INSERT INTO symbols(pair, averagePrice, allQuantity, freeQuantity, statusOrder) VALUES(?,?,?,?,?)
+            ON CONFLICT(pair) DO UPDATE SET
+                averagePrice=excluded.averagePrice,
+                allQuantity=excluded.allQuantity,
+                freeQuantity=excluded.freeQuantity,
+                statusOrder=excluded.statusOrder
+            """,
+            (symbol, float(avg_price), float(qty), float(qty), "OPEN" if qty != 0 else "FLAT"),
+        )
         await db.commit()
 
 async def load_avg_qty_for(symbols: list[str]) -> dict[str, tuple[float, float]]:
@@ -257,27 +164,21 @@ async def load_avg_qty_for(symbols: list[str]) -> dict[str, tuple[float, float]]
     if not symbols:
         return {}
     placeholders = ",".join("?" for _ in symbols)
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            f"SELECT pair, averagePrice, freeQuantity FROM symbols WHERE pair IN ({placeholders})", symbols
-        ) as cur:
-            rows = await cur.fetchall()
-            return {
-                r["pair"]: (float(r["averagePrice"] or 0), float(r["freeQuantity"] or 0))
-                for r in rows
-            }
+    # averagePrice/freeQuantity — REAL (schema v3), float() не нужен
+    async with pool.acquire() as db:
+        rows = await db.execute_fetchall(
+            f"SELECT pair, COALESCE(averagePrice, 0), COALESCE(freeQuantity, 0) FROM symbols "
+            f"WHERE pair IN ({placeholders})", symbols)
+        return {pair: (avg, qty) for pair, avg, qty in rows}
 
 async def set_avg_qty(symbol: str, avg: float, qty: float):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.acquire() as db:
         await db.execute(
             "UPDATE symbols SET averagePrice=?, freeQuantity=?, allQuantity=? WHERE pair=?",
-            (str(avg), str(qty), str(qty), symbol),
+            (float(avg), float(qty), float(qty), symbol),
         )
         await db.commit()
 
 async def fetch_white_list_pairs() -> list[str]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT pair FROM white_list ORDER BY pair ASC") as cur:
-            return [r["pair"] for r in await cur.fetchall()]
+    await config.refresh()
+    return config.pairs()
@@ -0,0 +1,120 @@
+# dbpool.py
+import os
+import asyncio
+import logging
+import sqlite3
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import aiosqlite
+
+log = logging.getLogger("dbpool")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# размер кэша подготовленных выражений sqlite3 на соединение
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+# сколько раз повторить транзакцию, если write-лок держат дольше busy_timeout
+DB_BUSY_RETRIES = int(os.getenv("DB_BUSY_RETRIES", "5"))
+
+T = TypeVar("T")
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",   # в WAL commit не делает fsync, только checkpoint
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS};",
+    "PRAGMA foreign_keys=ON;",
+)
+
+
+def is_busy(e: BaseException) -> bool:
+    """SQLITE_BUSY/LOCKED — временная ошибка: файл делят несколько процессов."""
+    if not isinstance(e, sqlite3.OperationalError):
+        return False
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+
+async def retry_busy(fn: Callable[[], Awaitable[T]], retries: int = DB_BUSY_RETRIES) -> T:
+    """Выполнить fn() (транзакцию целиком), при busy/locked — повторить с backoff."""
+    delay = 0.05
+    for attempt in range(1, retries + 1):
+        try:
+            return await fn()
+        except sqlite3.OperationalError as e:
+            if not is_busy(e) or attempt == retries:
+                raise
+            log.warning("DB busy (%s), retry %d/%d in %.2fs", e, attempt, retries - 1, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+    raise AssertionError("unreachable")
+
+
+class DBPool:
+    """
+    Небольшой пул долгоживущих aiosqlite-соединений: поток и файл открываются
+    один раз на старте, а не на каждый запрос. Соединения в WAL с
+    synchronous=NORMAL и busy_timeout; одинаковые SQL-строки берутся из
+    кэша подготовленных выражений sqlite3.
+    """
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE):
+        self.path = path
+        self.size = max(1, size)
+        self._all: List[aiosqlite.Connection] = []
+        self._free: Optional[asyncio.Queue] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._free is not None
+
+    async def start(self) -> None:
+        async with self._lock:
+            if self._free is not None:
+                return
+            free: asyncio.Queue = asyncio.Queue()
+            for _ in range(self.size):
+                cx = await aiosqlite.connect(self.path, cached_statements=DB_STATEMENT_CACHE)
+                for pragma in PRAGMAS:
+                    await cx.execute(pragma)
+                self._all.append(cx)
+                free.put_nowait(cx)
+            self._free = free
+            log.info("DB pool started: %s (%d connections, WAL)", self.path, self.size)
+
+    async def close(self) -> None:
+        async with self._lock:
+            for cx in self._all:
+                await cx.close()
+            self._all.clear()
+            self._free = None
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        if self._free is None:
+            await self.start()
+        free = self._free
+        cx = await free.get()
+        try:
+            yield cx
+        except BaseException:
+            # не отдаём в пул соединение с висящей транзакцией
+            if cx.in_transaction:
+                await cx.rollback()
+            raise
+        finally:
+            cx.row_factory = None
+            free.put_nowait(cx)
+
+
+_pools: Dict[str, DBPool] = {}
+
+
+def get_pool(path: str) -> DBPool:
+    """Один пул на файл БД — db.py и engine.py делят его."""
+    key = os.path.abspath(path)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _pools[key] = DBPool(path)
+    return pool
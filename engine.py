@@ -1,19 +1,41 @@
 # engine.py
+import gc
 import os
 import time
-import math
 import asyncio
 import logging
-from dataclasses import dataclass
-from typing import Optional, List, Tuple
+from typing import AsyncContextManager, Awaitable, Callable, Dict, Optional, List, Set, Tuple
 
 import aiosqlite
-from ib_insync import IB, Stock, Ticker
-
-from app import buy_now, sell_now
+import numpy as np
+from ib_insync import IB
+
+import metrics
+from logsetup import noisy, setup_logging
+from metrics import span
+from dbpool import get_pool, retry_busy
+from writebehind import WriteBehind
+from config_cache import get_config
+from ib_session import IBSession
+from book import LiveBook, OrderRec, Position, order_key
+from prices import PriceCache, PRICE_STALE_SEC
+from recorder import Recorder
+from indicators import Indicators, IND_FLUSH_SEC
+from startup import Readiness, StartupTimer
+from snapshot_api import SNAPSHOT_SOCKET, SnapshotServer, pnl_of, position_row, socket_path
+from contracts import ContractCache
+from order_pipeline import OrderPipeline, DuplicateOrder, OrderRejected
+from ratelimit import ib_limiter
+from scheduler import SymbolScheduler
+from shard import Shard
+from schema import OPEN_STATUS_SQL, kill_missing_open_orders, migrate, upsert_order_sql
+from archive import archive_orders, ORDERS_ARCHIVE_INTERVAL
+from strategy import (Action, decide, SKIP, FIRST_BUY, DCA_BUY, TP_SELL,
+                      R_OPEN_ORDER, R_NO_ROW, R_NO_LAST, R_INVALID, R_TP_NOTHING)
 
 log = logging.getLogger("engine")
-logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:%(message)s")
+# записи — в очередь, в stderr их пишет отдельный поток (logsetup.py)
+setup_logging()
 
 DB_PATH = os.getenv("DB_PATH", "bot.db")
 
@@ -23,188 +45,241 @@ DCA_STEP_PCT = float(os.getenv("DCA_STEP_PCT", "0.02"))         # 2% вниз 
 TAKE_PROFIT_PCT = float(os.getenv("TAKE_PROFIT_PCT", "0.02"))   # 2% вверх — частичная фиксация
 USE_TIMESTAMP_ID = os.getenv("USE_TIMESTAMP_ID", "true").lower() == "true"
 
-# Какие статусы считаем «открытыми» локально
-OPEN_STATUSES = {"Submitted", "PreSubmitted", "PendingSubmit", "Inactive"}
+# Реактивный режим: состояние из колбэков IB, оцениваем только изменившиеся тикеры,
+# полный reconcile — раз в RECONCILE_INTERVAL сек как страховка
+REACTIVE = os.getenv("REACTIVE", "false").lower() == "true"
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "30"))
+PRICE_INTERVAL = float(os.getenv("PRICE_INTERVAL", "2"))
 
-# ---------------------------
-# Вспомогательные структуры
-# ---------------------------
-@dataclass
-class Position:
-    symbol: str
-    qty: float
-    avg_cost: float
-    last: float
+# Сколько тикеров оцениваем параллельно и сколько ждём один тикер
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "8"))
+SYMBOL_TIMEOUT = float(os.getenv("SYMBOL_TIMEOUT", "15"))
+# режим опроса: полный reconcile с IB не чаще раза в LOOP_SLEEP сек; между ними
+# тикеры оцениваются по расписанию (scheduler.py) на стриминговых ценах
+LOOP_SLEEP = float(os.getenv("LOOP_SLEEP", "2"))
+
+# ордера и позиции в памяти (в реактивном режиме — источник правды для стратегии)
+book = LiveBook()
+
+# снимок состояния тикеров для стадии решений: (qty, avg, last, has_open, known)
+StateArrays = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+Snapshot = Callable[[List[str]], Awaitable[StateArrays]]
+# перепроверка «есть открытый ордер» перед отправкой: из БД или из книги
+OpenCheck = Callable[[str], Awaitable[bool]]
 
 # ---------------------------
 # DB helpers (SQLite, aiosqlite)
 # ---------------------------
-async def _db() -> aiosqlite.Connection:
-    return await aiosqlite.connect(DB_PATH)
+# общий пул соединений (WAL, synchronous=NORMAL) — с db.py делим один на файл
+pool = get_pool(DB_PATH)
+
+def _db() -> AsyncContextManager[aiosqlite.Connection]:
+    return pool.acquire()
 
 async def ensure_schema():
-    async with await _db() as cx:
-        await cx.execute("""
-        CREATE TABLE IF NOT EXISTS white_list(
-            pair TEXT PRIMARY KEY
-        );
-        """)
-        await cx.execute("""
-        CREATE TABLE IF NOT EXISTS orders(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            orderId INTEGER,
-            permId INTEGER,
-            symbol TEXT,
-            side TEXT,
-            type TEXT,
-            lmtPrice REAL,
-            tif TEXT,
-            outsideRth INTEGER,
-            status TEXT,
-            filled REAL,
-            remaining REAL,
-            avgFillPrice REAL,
-            lastFillPrice REAL,
-            whyHeld TEXT,
-            created_at INTEGER,
-            updated_at INTEGER
-        );
-        """)
-        await cx.execute("""
-        CREATE INDEX IF NOT EXISTS idx_orders_symbol ON orders(symbol);
-        """)
-        await cx.execute("""
-        CREATE TABLE IF NOT EXISTS positions(
-            symbol TEXT PRIMARY KEY,
-            qty REAL,
-            avg_cost REAL,
-            last REAL,
-            updated_at INTEGER
-        );
-        """)
-        await cx.commit()
+    """Схема БД одна на engine.py и db.py — см. schema.MIGRATIONS."""
+    async with _db() as cx:
+        await migrate(cx)
+
+# white_list/trade_params в памяти; перечитываются только после правки
+config = get_config(DB_PATH)
+# под supervisor.py (WORKERS > 1) воркер ведёт только свою часть тикеров
+shard = Shard()
 
 async def get_white_list() -> List[str]:
-    async with await _db() as cx:
-        rows = await cx.execute_fetchall("SELECT pair FROM white_list")
-        return [r[0] for r in rows]
+    await config.refresh()
+    return shard.filter(config.pairs())
 
-async def has_open_local_order(symbol: str) -> bool:
-    placeholders = ",".join("?" * len(OPEN_STATUSES))
-    sql = f"SELECT 1 FROM orders WHERE symbol=? AND status IN ({placeholders}) LIMIT 1"
-    async with await _db() as cx:
-        row = await cx.execute_fetchone(sql, (symbol, *OPEN_STATUSES))
-        return row is not None
+# статусы литералами — так работает частичный индекс ix_orders_open_symbol
+_HAS_OPEN_SQL = f"SELECT 1 FROM orders WHERE symbol=? AND {OPEN_STATUS_SQL} LIMIT 1"
 
-async def upsert_order_from_info(info: dict):
+async def has_open_local_order(symbol: str) -> bool:
+    async with _db() as cx:
+        async with cx.execute(_HAS_OPEN_SQL, (symbol,)) as cur:
+            return await cur.fetchone() is not None
+
+# по permId, пока его нет — по orderId (оба уникальны, см. schema.py)
+UPSERT_ORDER_SQL = upsert_order_sql((
+    "orderId", "clientId", "permId", "symbol", "action", "orderType", "lmtPrice", "tif", "outsideRth",
+    "status", "filled", "remaining", "avgFillPrice", "lastFillPrice", "whyHeld",
+    "created_at", "updated_at",
+))
+
+UPSERT_POSITION_SQL = """
+INSERT INTO positions(symbol, qty, avg_cost, last, updated_at)
+VALUES(?,?,?,?,?)
+ON CONFLICT(symbol) DO UPDATE SET
+    qty=excluded.qty,
+    avg_cost=excluded.avg_cost,
+    last=excluded.last,
+    updated_at=excluded.updated_at
+"""
+
+UPSERT_INDICATORS_SQL = """
+INSERT INTO symbols(pair, volatility, pumpDetector, pumpSignal, priceChangePercent, lowPrice)
+VALUES(?,?,?,?,?,?)
+ON CONFLICT(pair) DO UPDATE SET
+    volatility=excluded.volatility,
+    pumpDetector=excluded.pumpDetector,
+    pumpSignal=excluded.pumpSignal,
+    priceChangePercent=excluded.priceChangePercent,
+    lowPrice=excluded.lowPrice
+"""
+
+# отложенная запись: последнее состояние по ключу, executemany раз в WB_MAX_DELAY
+writer = WriteBehind(pool)
+writer.register("orders", UPSERT_ORDER_SQL)
+writer.register("positions", UPSERT_POSITION_SQL)
+writer.register("symbol_indicators", UPSERT_INDICATORS_SQL)
+
+_OPEN_SYMBOLS_SQL = f"SELECT DISTINCT symbol FROM orders WHERE {OPEN_STATUS_SQL}"
+
+async def open_order_symbols() -> Set[str]:
+    async with _db() as cx:
+        rows = await cx.execute_fetchall(_OPEN_SYMBOLS_SQL)
+        return {r[0] for r in rows}
+
+async def upsert_order(rec: OrderRec, durable: bool = False):
+    """
+    Ставит UPSERT ордера из книги в буфер записи. durable=True — дождаться,
+    пока строка реально попадёт в БД (после выставления ордера).
+    """
     now = int(time.time())
-    # простая UPSERT по (symbol, orderId)
-    async with await _db() as cx:
-        await cx.execute("""
-        INSERT INTO orders (orderId, permId, symbol, side, type, lmtPrice, tif, outsideRth,
-                            status, filled, remaining, avgFillPrice, lastFillPrice, whyHeld,
-                            created_at, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(orderId) DO UPDATE SET
-            status=excluded.status,
-            filled=excluded.filled,
-            remaining=excluded.remaining,
-            avgFillPrice=excluded.avgFillPrice,
-            lastFillPrice=excluded.lastFillPrice,
-            updated_at=excluded.updated_at
-        """, (
-            info.get("orderId"),
-            info.get("permId"),
-            info.get("symbol"),
-            info.get("action"),
-            info.get("orderType"),
-            info.get("lmtPrice"),
-            info.get("tif"),
-            1 if info.get("outsideRth") else 0,
-            info.get("status"),
-            info.get("filled"),
-            info.get("remaining"),
-            info.get("avgFillPrice"),
-            info.get("lastFillPrice"),
-            info.get("whyHeld"),
-            now, now
-        ))
-        await cx.commit()
+    # 0 от IB = «ещё нет» → NULL, иначе уникальные ключи склеят разные ордера
+    order_id = rec.orderId or None
+    perm_id = rec.permId or None
+    done = writer.put("orders", order_key(order_id, perm_id, rec.clientId), (
+        order_id,
+        rec.clientId,
+        perm_id,
+        rec.symbol,
+        rec.action,
+        rec.orderType,
+        rec.lmtPrice,
+        rec.tif,
+        1 if rec.outsideRth else 0,
+        rec.status,
+        rec.filled,
+        rec.remaining,
+        rec.avgFillPrice,
+        rec.lastFillPrice,
+        rec.whyHeld,
+        now, now
+    ))
+    if durable:
+        try:
+            await writer.flush()
+        except Exception:
+            # flush уже залогировал; исход нашей строки — в done: занятая БД —
+            # дождётся повтора, сбой другой таблицы её не касается
+            pass
+        await done
 
 async def upsert_position(p: Position):
+    writer.put("positions", p.symbol, (p.symbol, p.qty, p.avg_cost, p.last, int(time.time())))
+
+async def upsert_positions(ps: List[Position]):
+    """Пачка позиций — в буфер записи, на диск уйдут одним executemany."""
     now = int(time.time())
-    async with await _db() as cx:
-        await cx.execute("""
-        INSERT INTO positions(symbol, qty, avg_cost, last, updated_at)
-        VALUES(?,?,?,?,?)
-        ON CONFLICT(symbol) DO UPDATE SET
-            qty=excluded.qty,
-            avg_cost=excluded.avg_cost,
-            last=excluded.last,
-            updated_at=excluded.updated_at
-        """, (p.symbol, p.qty, p.avg_cost, p.last, now))
-        await cx.commit()
+    for p in ps:
+        writer.put("positions", p.symbol, (p.symbol, p.qty, p.avg_cost, p.last, now))
+
+async def load_positions() -> Dict[str, Tuple[float, float, float]]:
+    """{symbol: (qty, avg_cost, last)} — текущее содержимое positions."""
+    async with _db() as cx:
+        rows = await cx.execute_fetchall("SELECT symbol, qty, avg_cost, last FROM positions")
+        return {r[0]: (r[1] or 0.0, r[2] or 0.0, r[3] or 0.0) for r in rows}
 
 async def get_position(symbol: str) -> Optional[Position]:
-    async with await _db() as cx:
-        row = await cx.execute_fetchone(
-            "SELECT symbol, qty, avg_cost, last FROM positions WHERE symbol=?",
-            (symbol,))
+    async with _db() as cx:
+        async with cx.execute("SELECT symbol, qty, avg_cost, last FROM positions WHERE symbol=?",
+                              (symbol,)) as cur:
+            row = await cur.fetchone()
         if not row:
             return None
         return Position(symbol=row[0], qty=row[1] or 0.0, avg_cost=row[2] or 0.0, last=row[3] or 0.0)
 
-async def mark_missing_open_orders_as_killed(open_keys: List[Tuple[int, int]]):
+async def mark_missing_open_orders_as_killed(open_keys: List[Tuple[int, int, int]],
+                                            symbols: Optional[List[str]] = None):
     """
-    open_keys: список (orderId, permId), которые реально открыты в IB.
-    В БД найдём ордера в OPEN_STATUSES, которых нет в open_keys — и пометим Killed.
+    open_keys: список (orderId, permId, clientId), которые реально открыты в IB.
+    Ордера в OPEN_STATUSES, которых нет в open_keys (ни по permId, ни по
+    (clientId, orderId)) — Killed; сверка целиком в SQL, см. schema.kill_missing_open_orders.
+    symbols — сверять только эти тикеры (None — все).
     """
-    async with await _db() as cx:
-        rows = await cx.execute_fetchall(
-            f"SELECT rowid, orderId, permId FROM orders WHERE status IN ({','.join('?'*len(OPEN_STATUSES))})",
-            (*OPEN_STATUSES,))
-        to_kill = []
-        ib_set = {(oid or -1, pid or -1) for (oid, pid) in open_keys}
-        for rowid, orderId, permId in rows:
-            key = (orderId or -1, permId or -1)
-            if key not in ib_set:
-                to_kill.append(rowid)
-        if to_kill:
-            qmarks = ",".join("?" * len(to_kill))
-            await cx.execute(f"UPDATE orders SET status='Killed', updated_at=? WHERE rowid IN ({qmarks})",
-                             (int(time.time()), *to_kill))
+    async def kill() -> int:
+        async with _db() as cx:
+            n = await kill_missing_open_orders(cx, (pid for _, pid, _ in open_keys),
+                                               ((cid, oid) for oid, _, cid in open_keys), symbols)
             await cx.commit()
-            log.info("Reconcile: marked %d orders as Killed (missing in IB)", len(to_kill))
+            return n
+
+    # БД могут делить несколько воркеров — write-лок бывает занят
+    killed = await retry_busy(kill)
+    if killed:
+        log.info("Reconcile: marked %d orders as Killed (missing in IB)", killed)
 
 # ---------------------------
 # IB helpers (цена и reconcile)
 # ---------------------------
+# одно подключение на всё время жизни движка (clientId=103 по умолчанию)
+session = IBSession()
+
 async def _ib_connect() -> IB:
-    ib = IB()
-    await ib.connectAsync("127.0.0.1", 7497, clientId=103)
-    return ib
+    return await session.get()
+
+# квалифицированные контракты: память + таблица contracts, с TTL
+contracts = ContractCache(DB_PATH)
 
 async def _qualify(ib: IB, symbol: str):
-    c = Stock(symbol, "SMART", "USD", primaryExchange="NASDAQ")
-    await ib.qualifyContractsAsync(c)
-    return c
+    return await contracts.get(ib, symbol)
+
+# когда оценивать тикер снова: по близости к порогам DCA/TP и волатильности
+scheduler = SymbolScheduler(DCA_STEP_PCT, TAKE_PROFIT_PCT)
+
+# все цены и исполнения — в файлы по тикеру и дню (если задан RECORD_DIR)
+recorder = Recorder()
+
+# волатильность / памп / дневное изменение по тикам → колонки symbols
+indicators = Indicators(reference=lambda s: prices.prev_close(s))
+
+def _on_ready(sym: str) -> None:
+    scheduler.wake(sym)
+    if REACTIVE:
+        book.mark_dirty(sym)
+
+# тикер торгуется, только когда по нему сверены ордера, позиция и есть цена
+readiness = Readiness(on_ready=_on_ready)
+
+def _on_price(sym: str, px: float) -> None:
+    recorder.tick(sym, px)
+    indicators.on_tick(sym, px)
+    scheduler.observe(sym, px)
+    readiness.priced(sym)
+    if REACTIVE:
+        book.set_last(sym, px)
+
+# стриминговые цены по white_list; в реактивном режиме каждый тик будит книгу.
+# snapshot-запросы — из общего бюджета сообщений IB
+prices = PriceCache(_qualify, on_price=_on_price, limiter=ib_limiter)
+session.on_connect(lambda ib: prices.reset())
+
+def flush_indicators() -> int:
+    """Изменившиеся с прошлого раза индикаторы — в буфер записи (symbols)."""
+    indicators.configure(config.trade_params())
+    rows = indicators.take_rows()
+    for row in rows:
+        writer.put("symbol_indicators", row[0], row)
+    return len(rows)
 
 async def get_last(ib: IB, symbol: str) -> float:
-    c = await _qualify(ib, symbol)
-    t: Ticker = await ib.reqMktDataAsync(c, "", snapshot=True)
-    # ждём пока придёт last/close
-    for _ in range(50):
-        px = t.last or t.close or t.marketPrice()
-        if px and px > 0:
-            return float(px)
-        await asyncio.sleep(0.1)
-    # если так и не пришло — вернём 0
-    return float(t.last or t.close or 0.0)
+    """Цена из стримингового кэша; snapshot — только если цена протухла."""
+    return await prices.last(ib, symbol)
 
 async def reconcile_orders_with_ib():
     """
     1) Получаем открытые ордера из IB.
-    2) Обновляем/вставляем их в БД.
+    2) Изменившиеся (по книге) — обновляем/вставляем в БД.
     3) Те, которых нет в IB, но в БД числятся как open — помечаем Killed.
     """
     try:
@@ -213,153 +288,598 @@ async def reconcile_orders_with_ib():
         log.error("reconcile connect failed: %s", e)
         return
 
-    try:
-        await ib.reqOpenOrdersAsync()
-        open_trades = list(ib.openTrades())
-        open_keys = []
-        for t in open_trades:
-            info = {
-                "orderId": getattr(t.order, "orderId", None),
-                "permId": getattr(t.order, "permId", None),
-                "action": t.order.action,
-                "symbol": t.contract.symbol,
-                "orderType": t.order.orderType,
-                "lmtPrice": getattr(t.order, "lmtPrice", None),
-                "tif": getattr(t.order, "tif", None),
-                "outsideRth": getattr(t.order, "outsideRth", None),
-                "status": getattr(t.orderStatus, "status", None),
-                "filled": getattr(t.orderStatus, "filled", None),
-                "remaining": getattr(t.orderStatus, "remaining", None),
-                "avgFillPrice": getattr(t.orderStatus, "avgFillPrice", None),
-                "lastFillPrice": getattr(t.orderStatus, "lastFillPrice", None),
-                "whyHeld": getattr(t.orderStatus, "whyHeld", None),
-            }
-            await upsert_order_from_info(info)
-            open_keys.append((info["orderId"], info["permId"]))
-
-        await mark_missing_open_orders_as_killed(open_keys)
-    finally:
-        ib.disconnect()
+    with span("req_open_orders"):
+        await ib_limiter.acquire()
+        if shard.sharded:
+            # у воркеров разные clientId: свои тикеры могли выставить другим
+            # clientId (до шардирования, при другом WORKERS) — берём все
+            open_trades = [t for t in await ib.reqAllOpenOrdersAsync() if shard.owns(t.contract.symbol)]
+        else:
+            await ib.reqOpenOrdersAsync()
+            open_trades = list(ib.openTrades())
+    # заявки «в полёте», которых IB так и не увидел, — из реестра вон
+    for lost in pipeline.retain(open_trades):
+        log.warning("[%s] %s order %s not seen by IB, released", lost.symbol, lost.side, lost.tag)
+    open_keys = []
+    for t in open_trades:
+        changed, rec = book.apply_trade(t)
+        if rec is None:
+            continue
+        if changed:
+            await upsert_order(rec)
+        open_keys.append((rec.orderId, rec.permId, rec.clientId))
+
+    # всё состояние из IB — на диск одной транзакцией, затем сверка Killed
+    with span("db_flush"):
+        await writer.flush()
+    with span("db_kill_missing"):
+        # воркер сверяет только свои тикеры (по хешу, не по white_list —
+        # ордера удалённых из white_list тикеров тоже кто-то должен сверить)
+        scope = shard.filter(await open_order_symbols()) if shard.sharded else None
+        await mark_missing_open_orders_as_killed(open_keys, scope)
+    book.retain_open(open_keys)
+    readiness.set_orders_synced()
+
+def _index_positions(ib_positions) -> Tuple[Dict[int, Tuple[float, float]], Dict[str, Tuple[float, float]]]:
+    """
+    Снимок позиций аккаунта → индексы по conId и по тикеру (только STK).
+    Если тикер есть в нескольких аккаунтах — суммируем qty, avg взвешиваем.
+    """
+    by_con: Dict[int, Tuple[float, float]] = {}
+    by_sym: Dict[str, Tuple[float, float]] = {}
+
+    def add(index, key, qty, avg):
+        q0, a0 = index.get(key, (0.0, 0.0))
+        q = q0 + qty
+        index[key] = (q, (q0 * a0 + qty * avg) / q if q else 0.0)
+
+    for p in ib_positions:
+        qty = float(p.position or 0.0)
+        avg = float(p.avgCost or 0.0)
+        con_id = getattr(p.contract, "conId", 0)
+        if con_id:
+            add(by_con, con_id, qty, avg)
+        if getattr(p.contract, "secType", "STK") == "STK":
+            add(by_sym, getattr(p.contract, "symbol", ""), qty, avg)
+    return by_con, by_sym
+
+_foreign_reported: Set[str] = set()
+
+async def _sync_market_data(ib: IB, symbols: List[str]):
+    """Промахи кэша контрактов — одним батчем, затем подписки на цены whitelisted тикеров."""
+    with span("qualify"):
+        qualified = await contracts.qualify_many(ib, symbols)
+    with span("price_sync"):
+        await prices.sync(ib, symbols)
+    return qualified
+
+async def _req_positions(ib: IB):
+    """(by_con, by_sym, asof): asof — момент запроса, позиция его уже отражает."""
+    with span("req_positions"):
+        await ib_limiter.acquire()
+        asof = time.monotonic()
+        return (*_index_positions(await ib.reqPositionsAsync()), asof)
+
+async def _last_prices(ib: IB, symbols: List[str]) -> Dict[str, float]:
+    """Цены из кэша; протухшие — snapshot-запросами параллельно (не больше MAX_CONCURRENCY)."""
+    out = {}
+    missing = []
+    for sym in symbols:
+        px = prices.get(sym)
+        if px is None:
+            missing.append(sym)
+        else:
+            out[sym] = px
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def one(sym):
+        async with sem:
+            try:
+                with span("get_last"):
+                    out[sym] = await get_last(ib, sym)
+            except Exception as e:
+                log.error("ticker %s last failed: %s", sym, e)
+                out[sym] = 0.0
 
-async def reconcile_positions_with_ib(symbols: List[str]):
+    await asyncio.gather(*(one(s) for s in missing))
+    return out
+
+async def reconcile_positions_with_ib(symbols: List[str], snapshots: bool = True) -> List[str]:
     """
-    Обновляем таблицу positions из IB.
+    Обновляем таблицу positions из IB: один reqPositions на цикл (параллельно
+    с квалификацией и подписками), в БД пишем только изменившиеся строки
+    (одной транзакцией). snapshots=False — за протухшими ценами не ходим
+    (на старте их принесут только что оформленные подписки).
+    Вернёт тикеры, позиции по которым есть в IB, но нет в white_list.
     """
     try:
         ib = await _ib_connect()
     except Exception as e:
         log.error("reconcile positions connect failed: %s", e)
+        return []
+
+    with span("db_load_positions"):
+        stored = await load_positions()
+    qualified, (by_con, by_sym, asof) = await asyncio.gather(_sync_market_data(ib, symbols), _req_positions(ib))
+    return await _apply_positions(ib, symbols, qualified, by_con, by_sym, asof, stored, snapshots)
+
+async def _apply_positions(ib: IB, symbols: List[str], qualified, by_con, by_sym, asof: float,
+                           stored: Dict[str, Tuple[float, float, float]], snapshots: bool = True) -> List[str]:
+    lasts = await _last_prices(ib, symbols) if snapshots else {}
+    changed: List[Position] = []
+    for sym in symbols:
+        row = stored.get(sym)
+        last = lasts.get(sym) if snapshots else prices.get(sym)
+
+        c = qualified.get(sym)
+        hit = by_con.get(c.conId) if c is not None else None
+        qty, avg = hit if hit is not None else by_sym.get(sym, (0.0, 0.0))
+
+        # цены ещё нет (старт без snapshot) — в книге остаётся пришедшая тиком,
+        # в БД — прежняя
+        book.set_position(sym, qty, avg, last, asof=asof)
+        if last is None:
+            last = row[2] if row is not None else 0.0
+        if row != (qty, avg, last):
+            changed.append(Position(sym, qty, avg, last))
+            if row is None or row[:2] != (qty, avg):
+                # позиция изменилась (исполнение) — пороги сдвинулись, оценить сейчас
+                scheduler.wake(sym)
+
+    await upsert_positions(changed)
+    with span("db_flush"):
+        await writer.flush()
+    metrics.inc("position_rows_written_total", len(changed))
+    _price_gauges(symbols)
+    readiness.confirm(symbols)
+
+    # позиции вне white_list — сообщаем один раз, пока набор не изменится
+    wl = set(symbols)
+    foreign = sorted(s for s, (q, _) in by_sym.items() if q and s not in wl and shard.owns(s))
+    if set(foreign) != _foreign_reported:
+        _foreign_reported.clear()
+        _foreign_reported.update(foreign)
+        if foreign:
+            log.warning("IB positions not in white_list: %s", ", ".join(foreign))
+    return foreign
+
+async def refresh_prices(symbols: List[str]):
+    """
+    Реактивный режим: цены приходят тиками в book.set_last; здесь только
+    синхронизируем подписки и добираем snapshot для протухших цен.
+    """
+    try:
+        ib = await _ib_connect()
+    except Exception as e:
+        log.error("refresh prices connect failed: %s", e)
         return
+    await _sync_market_data(ib, symbols)
+    await _last_prices(ib, symbols)
+    _price_gauges(symbols)
 
-    try:
-        # получаем last для whitelisted тикеров
-        for sym in symbols:
-            try:
-                last = await get_last(ib, sym)
-            except Exception as e:
-                log.error("ticker %s last failed: %s", sym, e)
-                last = 0.0
-
-            # из IB заберём позицию (если есть)
-            qty = 0.0
-            avg = 0.0
-            for p in await ib.reqPositionsAsync():
-                if getattr(p.contract, "symbol", "") == sym:
-                    qty = float(p.position or 0.0)
-                    avg = float(p.avgCost or 0.0)
-                    break
-
-            await upsert_position(Position(sym, qty, avg, last))
-    finally:
-        ib.disconnect()
+def _price_gauges(symbols: List[str]):
+    """Возраст цен по white_list: максимум и сколько протухших (только при METRICS=true)."""
+    if not metrics.ENABLED or not symbols:
+        return
+    ages = [prices.age(s) for s in symbols]
+    metrics.gauge("price_age_max_seconds", max(ages))
+    metrics.gauge("prices_stale", sum(1 for a in ages if a > PRICE_STALE_SEC))
+
+# ---------------------------
+# Колбэки IB (реактивный режим)
+# ---------------------------
+def _persist(coro) -> None:
+    task = asyncio.ensure_future(coro)
+    task.add_done_callback(lambda t: t.cancelled() or not t.exception()
+                           or log.error("persist failed: %s", t.exception()))
+
+def _on_order_status(trade, live: bool = False) -> None:
+    changed, rec = book.apply_trade(trade, live)
+    if changed:
+        _persist(upsert_order(rec))
+
+def _on_exec_details(trade, fill) -> None:
+    # execDetailsEvent — только живые исполнения (не ответы reqExecutions)
+    _on_order_status(trade, live=True)
+
+def _on_position(p) -> None:
+    sym = getattr(p.contract, "symbol", "")
+    # positionEvent приходит по всему аккаунту — каждый воркер хранит только свои тикеры
+    if not sym or not shard.owns(sym):
+        return
+    book.set_position(sym, float(p.position or 0.0), float(p.avgCost or 0.0))
+    _persist(upsert_position(book.position(sym)))
+
+def attach_ib_events(ib: IB) -> None:
+    ib.orderStatusEvent += _on_order_status
+    ib.execDetailsEvent += _on_exec_details
+    ib.positionEvent += _on_position
+
+# отправка ордеров: реестр «в полёте», orderRef-теги, общий лимит сообщений IB.
+# В режиме опроса статусы своих заявок ловим через pipeline (в реактивном —
+# уже подписаны на orderStatusEvent целиком).
+# Воркеры supervisor.py ставят заявки одновременно: timestamp-orderId у них
+# совпадают — там orderId выдаёт ib_insync (client.getReqId() своего clientId).
+pipeline = OrderPipeline(session, contracts, use_timestamp_id=USE_TIMESTAMP_ID and not shard.sharded,
+                         on_update=None if REACTIVE else _on_order_status)
 
 # ---------------------------
 # DCA цикл
 # ---------------------------
+async def _snapshot_from_db(symbols: List[str]) -> StateArrays:
+    stored = await load_positions()
+    opened = await open_order_symbols()
+    # last — из стримингового кэша, если свежий: в БД он с последнего reconcile
+    for sym in symbols:
+        px = prices.get(sym)
+        if px is not None and sym in stored:
+            q, a, _ = stored[sym]
+            stored[sym] = (q, a, px)
+    # Filled уже в БД, а позиции ещё прежние — тикер занят, пока позиция не догонит
+    return _state_arrays(symbols, stored, lambda s: s in opened or pipeline.busy(s) or book.settling(s))
+
+async def _snapshot_from_book(symbols: List[str]) -> StateArrays:
+    # срез массивов книги — без объектов на тикер; opened учитывает и исполнения,
+    # по которым positionEvent ещё не пришёл (Filled уже снял open_n)
+    qty, avg, last, opened, known = book.arrays(symbols)
+    if pipeline.inflight:
+        opened |= np.fromiter((pipeline.busy(s) for s in symbols), dtype=bool, count=len(symbols))
+    return qty, avg, last, opened, known
+
+def _state_arrays(symbols: List[str], stored: Dict[str, Tuple[float, float, float]],
+                  has_open: Callable[[str], bool]) -> StateArrays:
+    n = len(symbols)
+    qty, avg, last = np.zeros(n), np.zeros(n), np.zeros(n)
+    opened, known = np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)
+    for i, sym in enumerate(symbols):
+        opened[i] = has_open(sym)
+        row = stored.get(sym)
+        if row is not None:
+            known[i] = True
+            qty[i], avg[i], last[i] = row
+    return qty, avg, last, opened, known
+
+async def _has_open_in_db(sym: str) -> bool:
+    return pipeline.busy(sym) or book.settling(sym) or await has_open_local_order(sym)
+
+async def _has_open_in_book(sym: str) -> bool:
+    return pipeline.busy(sym) or book.busy(sym)
+
+# повторяются каждый цикл — в лог первое за LOG_DEDUP_WINDOW и сводка (logsetup.py)
+MSG_OPEN_ORDER = noisy("[%s] skip: already has open order")
+MSG_NO_ROW = noisy("[%s] no local pos row (will be created by reconcile), skip this turn")
+MSG_NO_LAST = noisy("[%s] no last price yet, skip")
+MSG_INVALID = noisy("[%s] avg/last invalid (avg=%.4f last=%.4f), skip")
+MSG_TP_NOTHING = noisy("[%s] TP: nothing to sell (qty=%.2f)")
+MSG_DUPLICATE = noisy("[%s] skip: %s")
+MSG_STILL_RUNNING = noisy("[%s] skip: previous evaluation still running")
+
+def _log_skip(a: Action):
+    if a.reason == R_OPEN_ORDER:
+        log.info(MSG_OPEN_ORDER, a.symbol)
+    elif a.reason == R_NO_ROW:
+        log.info(MSG_NO_ROW, a.symbol)
+    elif a.reason == R_NO_LAST:
+        log.info(MSG_NO_LAST, a.symbol)
+    elif a.reason == R_INVALID:
+        log.info(MSG_INVALID, a.symbol, a.avg, a.last)
+    elif a.reason == R_TP_NOTHING:
+        log.info(MSG_TP_NOTHING, a.symbol, a.pos_qty)
+
+_ACTION_LABELS = {FIRST_BUY: "first BUY", DCA_BUY: "DCA BUY", TP_SELL: "TP SELL"}
+
+async def execute_action(a: Action, has_open: OpenCheck):
+    """
+    Исполнить намерение стадии решений. Перед отправкой под локом тикера
+    перепроверяем открытый ордер — решение могло устареть, пока ждали.
+    """
+    sym = a.symbol
+    async with _symbol_locks.setdefault(sym, asyncio.Lock()):
+        if await has_open(sym):
+            log.info(MSG_OPEN_ORDER, sym)
+            return
+        label = _ACTION_LABELS[a.kind]
+        qty = int(a.qty)
+        if a.kind == FIRST_BUY:
+            # первая заявка — LIMIT на текущий last (чуть ниже на «тик»)
+            log.info("[%s] %s: qty=%s @%s (last=%.2f)", sym, label, qty, a.limit, a.last)
+        else:
+            log.info("[%s] %s: qty=%s @%s (avg=%.2f last=%.2f)", sym, label, qty, a.limit, a.avg, a.last)
+        side = "SELL" if a.kind == TP_SELL else "BUY"
+        try:
+            with span("place_order"):
+                trade = await pipeline.submit(sym, side, qty, a.limit)
+            metrics.inc("orders_placed_total", side=side)
+            _, rec = book.apply_trade(trade, live=True)   # своя заявка — исполнение свежее
+            with span("db_order_commit"):
+                await upsert_order(rec, durable=True)
+        except DuplicateOrder as e:
+            log.info(MSG_DUPLICATE, sym, e)
+        except OrderRejected as e:
+            metrics.inc("orders_rejected_total", side=side)
+            log.error("[%s] %s rejected: %s", sym, label, e)
+        except Exception as e:
+            metrics.inc("orders_rejected_total", side=side)
+            log.error("[%s] %s failed: %s", sym, label, e)
+
+_eval_sem = asyncio.Semaphore(MAX_CONCURRENCY)
+_symbol_locks: Dict[str, asyncio.Lock] = {}
+
+def _log_late_result(sym: str):
+    def cb(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            log.error("[%s] symbol loop error (late): %s", sym, task.exception())
+    return cb
+
+async def _execute_isolated(a: Action, has_open: OpenCheck):
+    sym = a.symbol
+    lock = _symbol_locks.get(sym)
+    if lock is not None and lock.locked():
+        log.info(MSG_STILL_RUNNING, sym)
+        return
+    async with _eval_sem:
+        task = asyncio.ensure_future(execute_action(a, has_open))
+        done, _ = await asyncio.wait({task}, timeout=SYMBOL_TIMEOUT)
+        if not done:
+            # не отменяем: ордер мог уже уйти в IB — пусть допишется, лок держит сама задача
+            metrics.inc("symbol_timeouts_total")
+            log.error("[%s] evaluation exceeded %.0fs, left running in background", sym, SYMBOL_TIMEOUT)
+            task.add_done_callback(_log_late_result(sym))
+            return
+        if task.exception():
+            log.error("[%s] symbol loop error: %s", sym, task.exception())
+
+async def evaluate_symbols(symbols: List[str], snapshot: Snapshot, has_open: OpenCheck):
+    """
+    1) снимок состояния всех тикеров → 2) решения одним проходом NumPy
+    (strategy.decide) → 3) исполнение параллельно (не больше MAX_CONCURRENCY),
+    ошибки и таймауты изолированы по тикеру.
+    """
+    if not symbols:
+        return
+    with span("snapshot"):
+        qty, avg, last, opened, known = await snapshot(symbols)
+    with span("decide"):
+        actions = decide(symbols, qty, avg, last, opened, known, BASE_QTY, DCA_STEP_PCT, TAKE_PROFIT_PCT)
+        scheduler.reschedule(symbols, qty, avg, last, opened, known)
+    todo = []
+    for a in actions:
+        if a.kind == SKIP:
+            _log_skip(a)
+        else:
+            todo.append(_execute_isolated(a, has_open))
+    metrics.inc("symbols_evaluated_total", len(actions))
+    with span("execute"):
+        await asyncio.gather(*todo)
+
+def _collect():
+    """Gauge'и, которые считаются при выдаче метрик: write-behind, сессия IB, книга."""
+    return [
+        ("wb_flushes", writer.flushes),
+        ("wb_rows_written", writer.rows_written),
+        ("wb_rows_coalesced", writer.rows_coalesced),
+        ("ib_connected", 1 if session.healthy else 0),
+        ("ib_connects", session.connects),
+        ("ib_connect_failures", session.failures),
+        ("open_orders", book.open_count()),
+        ("orders_in_flight", len(pipeline.inflight)),
+        ("orders_deduped", pipeline.deduped),
+        ("order_ack_timeouts", pipeline.ack_timeouts),
+        ("ib_limiter_wait_seconds", ib_limiter.waited),
+        ("sched_symbols", len(scheduler)),
+        ("sched_hot_symbols", scheduler.hot_count()),
+        ("price_subscriptions", len(prices.tickers)),
+        ("symbols_ready", len(readiness.ready)),
+    ]
+
+# счётчики цикла — для status() (метрики могут быть выключены)
+loop_stats = {"cycles": 0, "errors": 0, "last_cycle_seconds": 0.0}
+
+def status() -> dict:
+    """Краткое состояние воркера — supervisor.py собирает их со всех процессов."""
+    out = dict(_collect())
+    out.update(loop_stats)
+    out.update(worker=shard.index, client_id=session.client_id, symbols=len(scheduler))
+    return out
+
+_OPEN_ORDERS_SQL = (f"SELECT orderId, clientId, permId, symbol, action, orderType, lmtPrice, tif, outsideRth, status, "
+                    f"filled, remaining, avgFillPrice, lastFillPrice, whyHeld FROM orders WHERE {OPEN_STATUS_SQL}")
+
+async def restore_book(symbols: List[str]) -> int:
+    """Последнее известное состояние (позиции, открытые ордера) из SQLite → книга."""
+    async with _db() as cx:
+        cx.row_factory = aiosqlite.Row
+        try:
+            orders = await cx.execute_fetchall(_OPEN_ORDERS_SQL)
+        finally:
+            cx.row_factory = None
+    stored = await load_positions()
+    for sym in symbols:
+        row = stored.get(sym)
+        if row is not None:
+            book.set_position(sym, *row, asof=0.0)   # снимок прошлого запуска
+    n = 0
+    for r in orders:
+        if shard.owns(r["symbol"]):
+            book.apply_order(dict(r))
+            n += 1
+    return n
+
+async def warm_start(symbols: List[str]) -> StartupTimer:
+    """
+    Старт без ожидания по тикеру: книга из БД сразу, затем параллельно —
+    сверка ордеров, квалификация + подписки на цены, позиции из IB.
+    Snapshot-цены не запрашиваем: тикер станет готов, когда придёт первый тик.
+    """
+    timer = StartupTimer()
+    readiness.expect(symbols)
+    with timer.phase("restore"):
+        _, n_orders = await asyncio.gather(contracts.load(), restore_book(symbols))
+    log.info("startup: restored %d positions, %d open orders from DB",
+             sum(1 for s in symbols if book.position(s) is not None), n_orders)
+    try:
+        with timer.phase("connect"):
+            ib = await _ib_connect()
+    except Exception as e:
+        log.error("startup connect failed: %s", e)
+        timer.report()
+        return timer
+
+    async def orders():
+        with timer.phase("orders"):
+            await reconcile_orders_with_ib()
+
+    async def market_data():
+        with timer.phase("contracts"):
+            qualified = await contracts.qualify_many(ib, symbols)
+        with timer.phase("subscribe"):
+            await prices.sync(ib, symbols)
+        return qualified
+
+    async def positions():
+        with timer.phase("positions"):
+            return await _req_positions(ib), await load_positions()
+
+    results = await asyncio.gather(orders(), market_data(), positions(), return_exceptions=True)
+    for name, r in zip(("orders", "market data", "positions"), results):
+        if isinstance(r, Exception):
+            log.error("startup %s sync failed: %s", name, r)
+    _, qualified, pos = results
+    if not isinstance(qualified, Exception) and not isinstance(pos, Exception):
+        (by_con, by_sym, asof), stored = pos
+        with timer.phase("apply_positions"):
+            await _apply_positions(ib, symbols, qualified, by_con, by_sym, asof, stored, snapshots=False)
+    timer.report()
+    return timer
+
+def build_snapshot() -> dict:
+    """Позиции, открытые ордера, PnL и статус — из памяти, без БД (snapshot_api.py)."""
+    positions = []
+    qty, avg, last, known = book.qty, book.avg, book.last, book.known
+    for i, sym in enumerate(book.symbols):
+        if known[i] and qty[i] != 0:
+            px = prices.prices.get(sym) or float(last[i])
+            positions.append(position_row(sym, float(qty[i]), float(avg[i]), px))
+    orders = sorted((rec.as_dict() for rec in book.orders.values()), key=lambda o: o["symbol"])
+    st = status()
+    st.update(ready=len(readiness.ready), pending=len(readiness.pending()), reactive=REACTIVE)
+    return {"positions": positions, "orders": orders, "pnl": pnl_of(positions), "status": st}
+
+# снимки состояния для Telegram-части — по Unix-сокету, мимо SQLite
+snapshots = SnapshotServer(build_snapshot, socket_path(SNAPSHOT_SOCKET, shard.index, shard.workers))
+
 async def dca_loop():
     await ensure_schema()
-    log.info("DCA loop started (BASE_QTY=%s, DCA_STEP=%.2f%%, TP=%.2f%%)",
-             BASE_QTY, DCA_STEP_PCT*100, TAKE_PROFIT_PCT*100)
-
+    symbols = await get_white_list()
+    scheduler.sync(symbols)
+    await warm_start(symbols)
+    # загруженное на старте живёт до конца — не гоняем его через сборщик мусора
+    gc.freeze()
+    log.info("DCA loop started (BASE_QTY=%s, DCA_STEP=%.2f%%, TP=%.2f%%, reactive=%s, shard=%d/%d)",
+             BASE_QTY, DCA_STEP_PCT*100, TAKE_PROFIT_PCT*100, REACTIVE, shard.index, shard.workers)
+    if REACTIVE:
+        attach_ib_events(session.ib)
+    recorder.attach(session.ib)
+    recorder.start()
+    metrics.add_collector(_collect)
+
+    # стартовая сверка уже была — следующая по обычному расписанию
+    # (не удалась — сразу в первом цикле)
+    next_reconcile = 0.0 if not readiness.orders_synced else \
+        time.monotonic() + (RECONCILE_INTERVAL if REACTIVE else LOOP_SLEEP)
+    next_prices = time.monotonic() + PRICE_INTERVAL
+    next_archive = 0.0
+    next_indicators = time.monotonic() + IND_FLUSH_SEC
     while True:
+        started = time.perf_counter()
         try:
-            # 1) reconcile
-            await reconcile_orders_with_ib()
-            symbols = await get_white_list()
-            await reconcile_positions_with_ib(symbols)
-
-            # 2) по каждому тикеру — максимум 1 активный ордер
-            for sym in symbols:
-                try:
-                    if await has_open_local_order(sym):
-                        log.info("[%s] skip: already has open order", sym)
-                        continue
-
-                    pos = await get_position(sym)
-                    if not pos:
-                        log.info("[%s] no local pos row (will be created by reconcile), skip this turn", sym)
-                        continue
-
-                    # Если позиции нет — первая покупка
-                    if pos.qty <= 0:
-                        # первая заявка — LIMIT на текущий last (чуть ниже на «тик»)
-                        entry_px = pos.last
-                        if not entry_px or entry_px <= 0:
-                            log.info("[%s] no last price yet, skip", sym)
-                            continue
-                        limit = round(entry_px * 0.999, 2)  # на цент ниже
-                        log.info("[%s] first BUY: qty=%s @%s (last=%.2f)", sym, BASE_QTY, limit, entry_px)
-                        try:
-                            info = await buy_now(sym, BASE_QTY, limit, use_timestamp_id=USE_TIMESTAMP_ID)
-                            await upsert_order_from_info(info)
-                        except Exception as e:
-                            log.error("[%s] first BUY failed: %s", sym, e)
-                        continue
-
-                    # Есть позиция: проверим усреднение и тейк-профит
-                    avg = pos.avg_cost or 0.0
-                    last = pos.last or 0.0
-                    if avg <= 0 or last <= 0:
-                        log.info("[%s] avg/last invalid (avg=%.4f last=%.4f), skip", sym, avg, last)
-                        continue
-
-                    # DCA вниз
-                    if last <= avg * (1 - DCA_STEP_PCT):
-                        limit = round(last, 2)
-                        log.info("[%s] DCA BUY: qty=%s @%s (avg=%.2f last=%.2f)", sym, BASE_QTY, limit, avg, last)
-                        try:
-                            info = await buy_now(sym, BASE_QTY, limit, use_timestamp_id=USE_TIMESTAMP_ID)
-                            await upsert_order_from_info(info)
-                            continue
-                        except Exception as e:
-                            log.error("[%s] DCA BUY failed: %s", sym, e)
-
-                    # Тейк-профит вверх
-                    if last >= avg * (1 + TAKE_PROFIT_PCT) and pos.qty > 0:
-                        sell_qty = min(BASE_QTY, math.floor(pos.qty))
-                        if sell_qty <= 0:
-                            log.info("[%s] TP: nothing to sell (qty=%.2f)", sym, pos.qty)
-                        else:
-                            limit = round(last, 2)
-                            log.info("[%s] TP SELL: qty=%s @%s (avg=%.2f last=%.2f)", sym, sell_qty, limit, avg, last)
-                            try:
-                                info = await sell_now(sym, sell_qty, limit, use_timestamp_id=USE_TIMESTAMP_ID)
-                                await upsert_order_from_info(info)
-                                continue
-                            except Exception as e:
-                                log.error("[%s] TP SELL failed: %s", sym, e)
-
-                except Exception as e:
-                    log.error("[%s] symbol loop error: %s", sym, e)
+            # 1) reconcile (в реактивном режиме — только страховочный, раз в RECONCILE_INTERVAL)
+            with span("white_list"):
+                symbols = await get_white_list()
+            scheduler.sync(symbols)
+            indicators.sync(symbols)
+            if time.monotonic() >= next_reconcile:
+                with span("reconcile_orders"):
+                    await reconcile_orders_with_ib()
+                with span("reconcile_positions"):
+                    await reconcile_positions_with_ib(symbols)
+                next_reconcile = time.monotonic() + (RECONCILE_INTERVAL if REACTIVE else LOOP_SLEEP)
+                next_prices = time.monotonic() + PRICE_INTERVAL
+            elif time.monotonic() >= next_prices:
+                with span("refresh_prices"):
+                    await refresh_prices(symbols)
+                next_prices = time.monotonic() + PRICE_INTERVAL
+
+            # 2) по каждому тикеру — максимум 1 активный ордер (тикеры параллельно)
+            with span("evaluate"):
+                if REACTIVE:
+                    dirty = book.take_dirty()
+                    await evaluate_symbols(readiness.filter([s for s in symbols if s in dirty]),
+                                           _snapshot_from_book, _has_open_in_book)
+                else:
+                    # ещё не готовые вернутся в due(), когда readiness их разбудит
+                    due = readiness.filter(scheduler.due())
+                    metrics.observe("symbols_due", len(due))
+                    await evaluate_symbols(due, _snapshot_from_db, _has_open_in_db)
+
+            # 3) индикаторы по тикам — в symbols, пачкой
+            if time.monotonic() >= next_indicators:
+                next_indicators = time.monotonic() + IND_FLUSH_SEC
+                metrics.observe("indicator_rows", flush_indicators())
+
+            # 4) завершённые ордера — в orders_archive, чтобы orders не росла
+            # (таблица общая — при шардировании архивирует только воркер 0)
+            if shard.index == 0 and time.monotonic() >= next_archive:
+                next_archive = time.monotonic() + ORDERS_ARCHIVE_INTERVAL
+                with span("archive_orders"):
+                    await archive_orders(pool)
 
         except Exception as e:
+            metrics.inc("cycle_errors_total")
+            loop_stats["errors"] += 1
             log.error("DCA cycle error: %s", e)
 
-        # ⬇️ как просил: всегда 2 сек пауза
-        await asyncio.sleep(2)
+        elapsed = time.perf_counter() - started
+        loop_stats["cycles"] += 1
+        loop_stats["last_cycle_seconds"] = elapsed
+        metrics.observe("cycle_seconds", elapsed)
+        metrics.gauge("last_cycle_seconds", elapsed)
+        metrics.inc("cycles_total")
+
+        if REACTIVE:
+            # ждём изменения в книге, но не дольше чем до следующего опроса цен/reconcile
+            timeout = max(0.0, min(next_prices, next_reconcile) - time.monotonic())
+            try:
+                await asyncio.wait_for(book.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            # спим до ближайшего срока в расписании или до следующего reconcile
+            # (или пока readiness/reconcile не разбудит тикер)
+            timeout = min(scheduler.next_due(), next_reconcile) - time.monotonic()
+            try:
+                await asyncio.wait_for(scheduler.woken.wait(), max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+            scheduler.woken.clear()
+
+async def main():
+    await pool.start()
+    await metrics.start()
+    await snapshots.start()
+    try:
+        await dca_loop()
+    finally:
+        await snapshots.stop()
+        await metrics.stop()
+        await recorder.close()
+        session.disconnect()
+        await writer.close()
+        await config.close()
+        await pool.close()
 
 # ---------------------------
 # Пример запуска
 # ---------------------------
 if __name__ == "__main__":
-    asyncio.run(dca_loop())
+    asyncio.run(main())
@@ -0,0 +1,221 @@
+# fake_ib.py
+# Заглушка IB для бенчмарков и локальных прогонов без TWS/Gateway.
+# Отвечает на те же вызовы ib_insync, что использует движок
+# (qualifyContractsAsync, reqMktData, reqOpenOrdersAsync, openTrades,
+# reqPositionsAsync, placeOrder, cancelMktData), с настраиваемой задержкой.
+# Цены — случайное блуждание; лимитные заявки исполняются, когда цена их пересекла.
+import math
+import zlib
+import random
+import asyncio
+import itertools
+from typing import Dict, List, Optional
+
+from ib_insync import Contract, Event, LimitOrder, OrderStatus, Position, Stock, Ticker, Trade
+
+OPEN = ("PendingSubmit", "PreSubmitted", "Submitted")
+
+
+class FakeIB:
+    """
+    latency — задержка каждого запроса (сек), tick_interval — период тиков,
+    tick_share — доля тикеров, у которых меняется цена за тик,
+    volatility — σ относительного шага цены.
+    """
+
+    def __init__(self, latency: float = 0.005, tick_interval: float = 0.25, tick_share: float = 0.2,
+                 volatility: float = 0.004, seed: int = 1, account: str = "DU000000"):
+        self.latency = latency
+        self.tick_interval = tick_interval
+        self.tick_share = tick_share
+        self.volatility = volatility
+        self.account = account
+        self.rng = random.Random(seed)
+
+        self.pendingTickersEvent = Event("pendingTickersEvent")
+        self.orderStatusEvent = Event("orderStatusEvent")
+        self.execDetailsEvent = Event("execDetailsEvent")
+        self.positionEvent = Event("positionEvent")
+        self.disconnectedEvent = Event("disconnectedEvent")
+
+        self.prices: Dict[str, float] = {}
+        self.tickers: Dict[str, Ticker] = {}
+        self._by_contract: Dict[int, Ticker] = {}   # id(Contract) → Ticker
+        self.open: Dict[str, List[Trade]] = {}  # открытые заявки по тикеру
+        self.positions: Dict[str, Position] = {}
+        self.client_id = 0
+        self._ids = itertools.count(1)
+        self._perm_ids = itertools.count(10_000_000)
+        self._task: Optional[asyncio.Task] = None
+        self._connected = True
+        # счётчики запросов — бенчмарк показывает, сколько раз ходили «в IB»
+        self.requests: Dict[str, int] = {}
+
+    # ---------- соединение ----------
+    def isConnected(self) -> bool:
+        return self._connected
+
+    async def connectAsync(self, *args, **kwargs):
+        await self._rtt("connect")
+        self.client_id = kwargs.get("clientId", 0)
+        self._connected = True
+        return self
+
+    def disconnect(self) -> None:
+        self.stop()
+        self._connected = False
+
+    async def _rtt(self, name: str) -> None:
+        self.requests[name] = self.requests.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    # ---------- контракты и цены ----------
+    def _price(self, symbol: str) -> float:
+        px = self.prices.get(symbol)
+        if px is None:
+            px = self.prices[symbol] = round(self.rng.uniform(20, 500), 2)
+        return px
+
+    async def qualifyContractsAsync(self, *contracts: Contract) -> List[Contract]:
+        await self._rtt("qualify")
+        for c in contracts:
+            c.conId = 1 + (zlib.crc32(c.symbol.encode()) & 0x7FFFFFF)
+            c.exchange = c.exchange or "SMART"
+            c.primaryExchange = c.primaryExchange or "NASDAQ"
+            c.currency = c.currency or "USD"
+        return list(contracts)
+
+    def reqMktData(self, contract: Contract, genericTickList: str = "", snapshot: bool = False,
+                   regulatorySnapshot: bool = False, mktDataOptions=None) -> Ticker:
+        self.requests["mktdata"] = self.requests.get("mktdata", 0) + 1
+        # как ib_insync: один Ticker на объект Contract — snapshot на контракте
+        # подписки вернёт её же Ticker, без свежей цены
+        t = self._by_contract.get(id(contract))
+        if t is None:
+            t = Ticker(contract=contract)
+            t.last = self._price(contract.symbol)
+        if not snapshot:
+            self._by_contract[id(contract)] = t
+            self.tickers[contract.symbol] = t
+            self._ensure_ticks()
+            self.pendingTickersEvent.emit({t})
+        return t
+
+    def cancelMktData(self, contract: Contract) -> None:
+        self._by_contract.pop(id(contract), None)
+        self.tickers.pop(contract.symbol, None)
+
+    def _ensure_ticks(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._tick_loop())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _tick_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            self.tick()
+
+    def tick(self) -> None:
+        """Один шаг рынка: сдвинуть цены части тикеров и исполнить пересечённые заявки."""
+        symbols = list(self.tickers)
+        if not symbols:
+            return
+        k = max(1, int(len(symbols) * self.tick_share))
+        moved = set()
+        for sym in self.rng.sample(symbols, min(k, len(symbols))):
+            px = self.prices[sym] * math.exp(self.rng.gauss(0, self.volatility))
+            self.prices[sym] = round(px, 2)
+            t = self.tickers[sym]
+            t.last = self.prices[sym]
+            moved.add(t)
+        self._match({t.contract.symbol for t in moved})
+        self.pendingTickersEvent.emit(moved)
+
+    # ---------- ордера ----------
+    def placeOrder(self, contract: Contract, order: LimitOrder) -> Trade:
+        self.requests["place"] = self.requests.get("place", 0) + 1
+        if not order.orderId:
+            order.orderId = next(self._ids)
+        # как ib_insync: новый ордер помечается clientId подключения
+        order.clientId = self.client_id
+        order.permId = next(self._perm_ids)
+        status = OrderStatus(orderId=order.orderId, status="PendingSubmit", remaining=order.totalQuantity,
+                             permId=order.permId)
+        trade = Trade(contract=contract, order=order, orderStatus=status)
+        self.open.setdefault(contract.symbol, []).append(trade)
+        # как в IB: сразу PendingSubmit, подтверждение — через latency
+        try:
+            asyncio.get_running_loop().call_later(self.latency, self._ack, trade)
+        except RuntimeError:
+            self._ack(trade)
+        return trade
+
+    def _ack(self, trade: Trade) -> None:
+        if trade.orderStatus.status != "PendingSubmit":
+            return
+        trade.orderStatus.status = "Submitted"
+        trade.statusEvent.emit(trade)
+        self.orderStatusEvent.emit(trade)
+        self._match({trade.contract.symbol})
+
+    def place_limit(self, symbol: str, action: str, qty: float, limit: float,
+                    order_id: Optional[int] = None) -> Trade:
+        order = LimitOrder(action, qty, limit, tif="DAY", outsideRth=True)
+        if order_id:
+            order.orderId = order_id
+        return self.placeOrder(Stock(symbol, "SMART", "USD", primaryExchange="NASDAQ"), order)
+
+    def _match(self, symbols) -> None:
+        for sym in symbols:
+            trades = self.open.get(sym)
+            if not trades:
+                continue
+            px = self._price(sym)
+            for trade in list(trades):
+                o = trade.order
+                if trade.orderStatus.status == "PendingSubmit":
+                    continue
+                if (o.action == "BUY" and px <= o.lmtPrice) or (o.action == "SELL" and px >= o.lmtPrice):
+                    trades.remove(trade)
+                    self._fill(trade, o.lmtPrice)
+
+    def _fill(self, trade: Trade, px: float) -> None:
+        o, st, sym = trade.order, trade.orderStatus, trade.contract.symbol
+        qty = o.totalQuantity
+        st.status, st.filled, st.remaining = "Filled", qty, 0.0
+        st.avgFillPrice = st.lastFillPrice = px
+
+        pos = self.positions.get(sym)
+        q0, a0 = (pos.position, pos.avgCost) if pos else (0.0, 0.0)
+        if o.action == "BUY":
+            q = q0 + qty
+            a = (q0 * a0 + qty * px) / q
+        else:
+            q = q0 - qty
+            a = a0 if q else 0.0
+        pos = self.positions[sym] = Position(self.account, trade.contract, q, a)
+
+        trade.statusEvent.emit(trade)
+        trade.filledEvent.emit(trade)
+        self.orderStatusEvent.emit(trade)
+        self.positionEvent.emit(pos)
+
+    async def reqOpenOrdersAsync(self) -> List:
+        await self._rtt("open_orders")
+        return [t.order for t in self.openTrades()]
+
+    async def reqAllOpenOrdersAsync(self) -> List[Trade]:
+        await self._rtt("open_orders")
+        return self.openTrades()
+
+    def openTrades(self) -> List[Trade]:
+        return [t for trades in self.open.values() for t in trades]
+
+    async def reqPositionsAsync(self) -> List[Position]:
+        await self._rtt("positions")
+        return [p for p in self.positions.values() if p.position]
@@ -0,0 +1,113 @@
+# ib_session.py
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ib_insync import IB
+
+log = logging.getLogger("ib_session")
+
+IB_HOST = os.getenv("IB_HOST", "127.0.0.1")
+IB_PORT = int(os.getenv("IB_PORT", "7497"))
+IB_CLIENT_ID = int(os.getenv("IB_CLIENT_ID", "103"))
+IB_CONNECT_TIMEOUT = float(os.getenv("IB_CONNECT_TIMEOUT", "4"))
+# backoff между попытками переподключения (сек): 1, 2, 4 ... до MAX
+IB_RECONNECT_MIN = float(os.getenv("IB_RECONNECT_MIN", "1"))
+IB_RECONNECT_MAX = float(os.getenv("IB_RECONNECT_MAX", "30"))
+
+
+class IBSession:
+    """
+    Одно долгоживущее подключение к TWS/Gateway на всё время жизни движка.
+    get() отдаёт подключённый IB; если сокет упал — переподключается,
+    но не чаще, чем позволяет backoff (в паузе сразу бросает ConnectionError,
+    чтобы цикл не висел на сокете).
+    """
+
+    def __init__(self, host: str = IB_HOST, port: int = IB_PORT, client_id: int = IB_CLIENT_ID):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.ib = IB()
+        self.ib.disconnectedEvent += self._on_disconnected
+
+        self._lock = asyncio.Lock()
+        self._backoff = IB_RECONNECT_MIN
+        self._next_attempt = 0.0
+        self._on_connect: List[Callable[[IB], Optional[Awaitable[None]]]] = []
+
+        # состояние для health()
+        self.connected_at: Optional[float] = None
+        self.disconnected_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.connects = 0
+        self.failures = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.ib.isConnected()
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "connected": self.healthy,
+            "client_id": self.client_id,
+            "connected_at": self.connected_at,
+            "disconnected_at": self.disconnected_at,
+            "connects": self.connects,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "retry_in": max(0.0, self._next_attempt - time.monotonic()),
+        }
+
+    def on_connect(self, cb: Callable[[IB], Optional[Awaitable[None]]]) -> None:
+        """Колбэк после каждого (пере)подключения — переподписки и т.п."""
+        self._on_connect.append(cb)
+
+    async def get(self) -> IB:
+        if self.ib.isConnected():
+            return self.ib
+        async with self._lock:
+            if self.ib.isConnected():
+                return self.ib
+            wait = self._next_attempt - time.monotonic()
+            if wait > 0:
+                raise ConnectionError(f"IB reconnect backoff, next attempt in {wait:.1f}s")
+            try:
+                await self.ib.connectAsync(self.host, self.port, clientId=self.client_id,
+                                           timeout=IB_CONNECT_TIMEOUT)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e) or type(e).__name__
+                self._next_attempt = time.monotonic() + self._backoff
+                log.error("IB connect failed (clientId=%s): %s; retry in %.0fs",
+                          self.client_id, self.last_error, self._backoff)
+                self._backoff = min(self._backoff * 2, IB_RECONNECT_MAX)
+                # connectAsync мог оставить полуоткрытый сокет
+                self.ib.disconnect()
+                raise
+
+            self._backoff = IB_RECONNECT_MIN
+            self._next_attempt = 0.0
+            self.connected_at = time.time()
+            self.last_error = None
+            self.connects += 1
+            log.info("IB connected (clientId=%s, connect #%d)", self.client_id, self.connects)
+
+            for cb in self._on_connect:
+                try:
+                    res = cb(self.ib)
+                    if asyncio.iscoroutine(res):
+                        await res
+                except Exception as e:
+                    log.error("IB on_connect callback failed: %s", e)
+            return self.ib
+
+    def _on_disconnected(self) -> None:
+        self.disconnected_at = time.time()
+        log.warning("IB disconnected (clientId=%s)", self.client_id)
+
+    def disconnect(self) -> None:
+        if self.ib.isConnected():
+            self.ib.disconnect()
@@ -0,0 +1,188 @@
+# indicators.py
+# Потоковые индикаторы по тикерам для колонок symbols: волатильность,
+# детектор пампа, дневное изменение и минимум дня. Каждый тик — O(1):
+#   * volatility — σ лог-доходности за последние IND_VOL_TICKS тиков
+#     (кольцевой буфер + Уэлфорд со скользящим окном), в % за √час;
+#   * pumpDetector — рост last над минимумом за IND_PUMP_WINDOW сек
+#     (монотонная очередь), %; pumpSignal — '1', если рост ≥ trade_params.pump_up;
+#   * priceChangePercent — к закрытию прошлого дня (или к первому тику дня, UTC);
+#   * lowPrice — минимум дня.
+# Изменившиеся тикеры пачкой уходят в symbols раз в IND_FLUSH_SEC (engine.py).
+import os
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+IND_VOL_TICKS = int(os.getenv("IND_VOL_TICKS", "300"))
+IND_PUMP_WINDOW = float(os.getenv("IND_PUMP_WINDOW", "300"))
+IND_FLUSH_SEC = float(os.getenv("IND_FLUSH_SEC", "5"))
+# pump_up из trade_params не задан — порог по умолчанию, %
+IND_PUMP_UP = float(os.getenv("IND_PUMP_UP", "3"))
+
+# доходность на √сек: dt меньше этого не берём, чтобы пачка тиков не взрывала σ
+_MIN_DT = 0.05
+_HOUR_SQRT = math.sqrt(3600.0)
+
+
+class IndicatorValues(NamedTuple):
+    volatility: Optional[float]          # % за √час
+    pump: Optional[float]                # рост над минимумом окна, %
+    pump_signal: bool
+    change_pct: Optional[float]          # к закрытию прошлого дня, %
+    low: Optional[float]                 # минимум дня
+
+
+def _flag(v: Any) -> bool:
+    """BOOLEAN из trade_params: там лежат и 1/0, и 'True'/'False'."""
+    if isinstance(v, str):
+        return v.strip().lower() in ("1", "true", "yes", "on")
+    return bool(v)
+
+
+class _SymbolState:
+    __slots__ = ("ring", "pos", "n", "mean", "m2", "prev_px", "prev_ts",
+                 "mins", "day", "day_open", "day_low", "last")
+
+    def __init__(self, size: int):
+        self.ring = [0.0] * size     # последние доходности (на √сек)
+        self.pos = 0
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.prev_px = 0.0
+        self.prev_ts = 0.0
+        self.mins: deque = deque()   # (ts, px), px строго растут — минимум окна в голове
+        self.day = -1
+        self.day_open = 0.0
+        self.day_low = 0.0
+        self.last = 0.0
+
+    def push_return(self, r: float) -> None:
+        """Уэлфорд со скользящим окном: при полном буфере старое значение вычитаем."""
+        size = len(self.ring)
+        if self.n == size:
+            old = self.ring[self.pos]
+            self.n -= 1
+            d = old - self.mean
+            self.mean -= d / self.n
+            self.m2 -= d * (old - self.mean)
+        self.ring[self.pos] = r
+        self.pos = (self.pos + 1) % size
+        self.n += 1
+        d = r - self.mean
+        self.mean += d / self.n
+        self.m2 += d * (r - self.mean)
+        if self.m2 < 0.0:   # накопленная погрешность округления
+            self.m2 = 0.0
+
+
+class Indicators:
+    """
+    on_tick(symbol, px) — из колбэка цены; values() — текущие значения;
+    take_rows() — строки для UPSERT в symbols по изменившимся тикерам.
+    reference(symbol) — закрытие прошлого дня, если известно (ticker.close из IB).
+    """
+
+    def __init__(self, vol_ticks: int = IND_VOL_TICKS, pump_window: float = IND_PUMP_WINDOW,
+                 reference: Optional[Callable[[str], Optional[float]]] = None):
+        self.vol_ticks = max(2, vol_ticks)
+        self.pump_window = pump_window
+        self.reference = reference
+        self.pump_enabled = True
+        self.vol_enabled = True
+        self.pump_up = IND_PUMP_UP
+        self._state: Dict[str, _SymbolState] = {}
+        self._dirty: Set[str] = set()
+
+    def configure(self, trade_params: Dict[str, Any]) -> None:
+        """Переключатели pump_detector / volatility и порог pump_up из trade_params."""
+        self.pump_enabled = _flag(trade_params.get("pump_detector", True))
+        self.vol_enabled = _flag(trade_params.get("volatility", True))
+        try:
+            self.pump_up = float(trade_params.get("pump_up") or IND_PUMP_UP)
+        except (TypeError, ValueError):
+            self.pump_up = IND_PUMP_UP
+
+    def sync(self, symbols: List[str]) -> None:
+        """Тикеры, ушедшие из white_list, — забыть."""
+        wanted = set(symbols)
+        for sym in list(self._state):
+            if sym not in wanted:
+                del self._state[sym]
+                self._dirty.discard(sym)
+
+    # ---------- горячий путь ----------
+    def on_tick(self, symbol: str, px: float, ts: Optional[float] = None) -> None:
+        if px <= 0:
+            return
+        ts = time.time() if ts is None else ts
+        st = self._state.get(symbol)
+        if st is None:
+            st = self._state[symbol] = _SymbolState(self.vol_ticks)
+        st.last = px
+
+        # волатильность
+        if st.prev_px > 0:
+            dt = max(ts - st.prev_ts, _MIN_DT)
+            st.push_return(math.log(px / st.prev_px) / math.sqrt(dt))
+        st.prev_px, st.prev_ts = px, ts
+
+        # минимум окна для пампа: хвост с ценами не ниже новой уже не понадобится
+        mins = st.mins
+        while mins and mins[-1][1] >= px:
+            mins.pop()
+        mins.append((ts, px))
+        cutoff = ts - self.pump_window
+        while mins[0][0] < cutoff:
+            mins.popleft()
+
+        # день (UTC)
+        day = int(ts // 86400)
+        if day != st.day:
+            st.day = day
+            st.day_open = px
+            st.day_low = px
+        elif px < st.day_low:
+            st.day_low = px
+
+        self._dirty.add(symbol)
+
+    # ---------- выдача ----------
+    def values(self, symbol: str) -> Optional[IndicatorValues]:
+        st = self._state.get(symbol)
+        if st is None:
+            return None
+        vol = None
+        if self.vol_enabled and st.n >= 2:
+            vol = math.sqrt(st.m2 / (st.n - 1)) * _HOUR_SQRT * 100.0
+        pump, signal = None, False
+        if self.pump_enabled and st.mins:
+            pump = (st.last / st.mins[0][1] - 1.0) * 100.0
+            signal = pump >= self.pump_up
+        ref = self.reference(symbol) if self.reference else None
+        ref = ref if ref and ref > 0 else st.day_open
+        change = (st.last / ref - 1.0) * 100.0 if ref > 0 else None
+        return IndicatorValues(vol, pump, signal, change, st.day_low or None)
+
+    def take_rows(self) -> List[Tuple[str, Optional[float], Optional[str], Optional[str],
+                                      Optional[float], Optional[float]]]:
+        """(pair, volatility, pumpDetector, pumpSignal, priceChangePercent, lowPrice) по изменившимся."""
+        dirty, self._dirty = self._dirty, set()
+        rows = []
+        for sym in dirty:
+            v = self.values(sym)
+            if v is None:
+                continue
+            rows.append((
+                sym,
+                None if v.volatility is None else round(v.volatility, 4),
+                None if v.pump is None else f"{v.pump:.2f}",
+                None if v.pump is None else ("1" if v.pump_signal else "0"),
+                None if v.change_pct is None else round(v.change_pct, 4),
+                v.low,
+            ))
+        return rows
+
+    def __len__(self) -> int:
+        return len(self._state)
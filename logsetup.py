@@ -0,0 +1,186 @@
+# logsetup.py
+# Логирование без записи в поток на event loop'е: корневой логгер кладёт
+# записи в очередь (QueueHandler), в stderr их пишет отдельный поток
+# (QueueListener). Формат — JSON по строке на запись (LOG_FORMAT=text —
+# прежний «LEVEL:logger:msg»).
+# Повторы шумных per-symbol сообщений («[%s] skip: …», зарегистрированных
+# через noisy()) в пределах LOG_DEDUP_WINDOW сек не пишутся: первое проходит,
+# остальные считаются, раз в LOG_DEDUP_FLUSH_SEC в лог уходит сводка.
+# Остальное (выставление ордеров, исполнения, ошибки) пишется всегда.
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Set, Tuple
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_DEDUP_WINDOW = float(os.getenv("LOG_DEDUP_WINDOW", "60"))
+LOG_DEDUP_FLUSH_SEC = float(os.getenv("LOG_DEDUP_FLUSH_SEC", "60"))
+
+# per-symbol сообщение: шаблон начинается с тикера
+SYMBOL_PREFIX = "[%s]"
+
+log = logging.getLogger("log")
+
+# шаблоны, повторы которых гасит DedupFilter
+_NOISY: Set[str] = set()
+
+
+def noisy(template: str) -> str:
+    """Разрешить дедупликацию per-symbol шаблона; вернёт его же."""
+    _NOISY.add(template)
+    return template
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, static: Optional[Dict[str, object]] = None):
+        super().__init__()
+        self.static = static or {}
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **self.static,
+        }
+        sym = getattr(record, "symbol", None)
+        if sym is not None:
+            out["symbol"] = sym
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+# traceback → текст ещё в потоке вызывающего, пока exc_info жив
+_exc_formatter = logging.Formatter()
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Стандартный prepare() вклеивает traceback в msg и обнуляет exc_info/exc_text —
+    JSON-поле "exc" тогда не пишется никогда. Здесь msg — только сообщение,
+    traceback уходит в exc_text (сам exc_info с кадрами через очередь не тащим).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class DedupFilter(logging.Filter):
+    """
+    Записям с шаблоном «[%s] …» ставит record.symbol. Шаблоны из templates
+    (noisy()) не выше INFO: по (шаблон, тикер) пропускаем первую за window
+    сек, остальные только считаем.
+    Работает в потоке вызывающего — отсеянное даже не попадает в очередь.
+    """
+
+    def __init__(self, window: float = LOG_DEDUP_WINDOW, templates: Optional[Set[str]] = None):
+        super().__init__()
+        self.window = window
+        self.templates = _NOISY if templates is None else templates
+        self._seen: Dict[Tuple[str, str], float] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}  # шаблон → {тикер: подавлено}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        msg = record.msg
+        if not (isinstance(msg, str) and msg.startswith(SYMBOL_PREFIX) and record.args):
+            return True
+        args = record.args if isinstance(record.args, tuple) else (record.args,)
+        sym = str(args[0])
+        record.symbol = sym
+        if self.window <= 0 or record.levelno > logging.INFO or msg not in self.templates:
+            return True
+        now = record.created
+        key = (msg, sym)
+        with self._lock:
+            first = self._seen.get(key)
+            if first is None or now - first >= self.window:
+                self._seen[key] = now
+                return True
+            per = self._counts.setdefault(msg, {})
+            per[sym] = per.get(sym, 0) + 1
+        return False
+
+    def flush(self) -> None:
+        """Сводка подавленных повторов с прошлого flush()."""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            # устаревшие ключи — чтобы _seen не рос с числом тикеров × шаблонов
+            cutoff = time.time() - self.window
+            self._seen = {k: t for k, t in self._seen.items() if t >= cutoff}
+        for msg, per in counts.items():
+            top = sorted(per.items(), key=lambda kv: -kv[1])[:5]
+            log.info("suppressed %d repeats of %r for %d symbols (top: %s)",
+                     sum(per.values()), msg, len(per), ", ".join(f"{s}={n}" for s, n in top))
+
+
+_listener: Optional[QueueListener] = None
+_dedup: Optional[DedupFilter] = None
+_stop = threading.Event()
+
+
+def _flush_loop() -> None:
+    while not _stop.wait(LOG_DEDUP_FLUSH_SEC):
+        _dedup.flush()
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, **static) -> None:
+    """
+    Один раз на процесс; повторный вызов ничего не делает.
+    static — поля в каждую запись (например worker=1 у воркеров supervisor.py).
+    """
+    global _listener, _dedup
+    if _listener is not None:
+        return
+    out = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        out.setFormatter(JsonFormatter(static))
+    else:
+        prefix = "".join(f"{k}{v}:" for k, v in static.items())
+        out.setFormatter(logging.Formatter(f"%(levelname)s:{prefix}%(name)s:%(message)s"))
+
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _QueueHandler(q)
+    _dedup = DedupFilter()
+    handler.addFilter(_dedup)
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(q, out, respect_handler_level=True)
+    _listener.start()
+    if LOG_DEDUP_WINDOW > 0 and LOG_DEDUP_FLUSH_SEC > 0:
+        threading.Thread(target=_flush_loop, name="log-dedup", daemon=True).start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Сбросить сводку и дописать очередь (вызывается и через atexit)."""
+    global _listener
+    if _listener is None:
+        return
+    _stop.set()
+    _dedup.flush()
+    _listener.stop()
+    _listener = None
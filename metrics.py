@@ -0,0 +1,274 @@
+# metrics.py
+# Встроенные метрики горячего пути: тайминги стадий (span), счётчики, gauge'и.
+# Выключено по умолчанию — тогда span() отдаёт один и тот же пустой
+# контекст-менеджер, а inc/observe/gauge сразу возвращаются.
+#
+#   METRICS=true METRICS_PORT=9108 python engine.py
+#   curl -s 127.0.0.1:9108/metrics
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+log = logging.getLogger("metrics")
+
+ENABLED = os.getenv("METRICS", "false").lower() == "true"
+# HTTP в формате Prometheus (0 — не поднимать), слушаем только локально
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# периодическая сводка в лог (сек, 0 — выключена)
+METRICS_SUMMARY_SEC = float(os.getenv("METRICS_SUMMARY_SEC", "60"))
+# сколько последних замеров держит гистограмма для p50/p95/p99
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))
+
+PREFIX = "dca_"
+QUANTILES = (0.5, 0.95, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+Key = Tuple[str, Labels]
+Collector = Callable[[], Iterable[Tuple[str, float]]]
+
+
+class Histogram:
+    """Скользящее окно последних замеров + count/sum за всё время."""
+
+    __slots__ = ("samples", "count", "sum")
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, v: float) -> None:
+        self.samples.append(v)
+        self.count += 1
+        self.sum += v
+
+    def quantiles(self, qs: Iterable[float] = QUANTILES) -> List[float]:
+        s = sorted(self.samples)
+        if not s:
+            return [float("nan") for _ in qs]
+        return [s[min(len(s) - 1, int(q * len(s)))] for q in qs]
+
+
+def _key(name: str, labels: Dict[str, object]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(labels: Labels, extra: Labels = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v != v:
+        return "NaN"
+    if v in (float("inf"), float("-inf")):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v))
+
+
+class Registry:
+    def __init__(self):
+        self.counters: Dict[Key, float] = {}
+        self.gauges: Dict[Key, float] = {}
+        self.histograms: Dict[Key, Histogram] = {}
+        self._collectors: List[Collector] = []
+
+    def inc(self, name: str, n: float = 1, **labels) -> None:
+        k = _key(name, labels)
+        self.counters[k] = self.counters.get(k, 0.0) + n
+
+    def set(self, name: str, v: float, **labels) -> None:
+        self.gauges[_key(name, labels)] = v
+
+    def observe(self, name: str, v: float, **labels) -> None:
+        k = _key(name, labels)
+        h = self.histograms.get(k)
+        if h is None:
+            h = self.histograms[k] = Histogram()
+        h.observe(v)
+
+    def add_collector(self, fn: Collector) -> None:
+        """fn() → [(имя, значение)] — gauge'и, которые дешевле считать при выдаче."""
+        self._collectors.append(fn)
+
+    def _collected(self) -> Dict[Key, float]:
+        out: Dict[Key, float] = {}
+        for fn in self._collectors:
+            try:
+                for name, v in fn():
+                    out[(name, ())] = float(v)
+            except Exception as e:
+                log.error("metrics collector failed: %s", e)
+        return out
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (гистограммы — как summary с квантилями)."""
+        lines: List[str] = []
+        typed = set()
+
+        def head(name: str, kind: str):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), v in sorted(self.counters.items()):
+            head(name, "counter")
+            lines.append(f"{PREFIX}{name}{_fmt_labels(labels)} {_fmt_value(v)}")
+        gauges = {**self.gauges, **self._collected()}
+        for (name, labels), v in sorted(gauges.items()):
+            head(name, "gauge")
+            lines.append(f"{PREFIX}{name}{_fmt_labels(labels)} {_fmt_value(v)}")
+        for (name, labels), h in sorted(self.histograms.items()):
+            head(name, "summary")
+            for q, v in zip(QUANTILES, h.quantiles()):
+                lines.append(f"{PREFIX}{name}{_fmt_labels(labels, (('quantile', str(q)),))} {_fmt_value(v)}")
+            lines.append(f"{PREFIX}{name}_count{_fmt_labels(labels)} {h.count}")
+            lines.append(f"{PREFIX}{name}_sum{_fmt_labels(labels)} {_fmt_value(h.sum)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Короткая сводка для лога: стадии с p50/p95/p99 (мс) и счётчики."""
+        parts = []
+        for (name, labels), h in sorted(self.histograms.items()):
+            if not h.samples:
+                continue
+            p50, p95, p99 = h.quantiles()
+            tag = ",".join(v for _, v in labels) or name
+            parts.append(f"{tag} p50={p50 * 1e3:.1f} p95={p95 * 1e3:.1f} p99={p99 * 1e3:.1f}ms n={h.count}")
+        for (name, labels), v in sorted(self.counters.items()):
+            tag = ",".join(v for _, v in labels)
+            parts.append(f"{name}{'[' + tag + ']' if tag else ''}={v:g}")
+        return "; ".join(parts)
+
+
+registry = Registry()
+
+
+# ---------------------------
+# Горячий путь
+# ---------------------------
+class _Span:
+    __slots__ = ("stage", "t0")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        registry.observe("stage_seconds", time.perf_counter() - self.t0, stage=self.stage)
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            registry.inc("stage_errors_total", stage=self.stage)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(stage: str):
+    """with span("reconcile_orders"): ... — время стадии в dca_stage_seconds{stage=...}."""
+    if not ENABLED:
+        return _NOOP
+    return _Span(stage)
+
+
+def inc(name: str, n: float = 1, **labels) -> None:
+    if ENABLED:
+        registry.inc(name, n, **labels)
+
+
+def gauge(name: str, v: float, **labels) -> None:
+    if ENABLED:
+        registry.set(name, v, **labels)
+
+
+def observe(name: str, v: float, **labels) -> None:
+    if ENABLED:
+        registry.observe(name, v, **labels)
+
+
+def add_collector(fn: Collector) -> None:
+    if ENABLED:
+        registry.add_collector(fn)
+
+
+# ---------------------------
+# Выдача: HTTP /metrics и сводка в лог
+# ---------------------------
+_server: Optional[asyncio.AbstractServer] = None
+_summary_task: Optional[asyncio.Task] = None
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        # заголовки не нужны, но дочитаем их, чтобы клиент не получил RST
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode("latin-1").split()
+        path = parts[1] if len(parts) > 1 else "/"
+        if path.split("?")[0] == "/metrics":
+            status, body = "200 OK", registry.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\n"
+                     "Content-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     "Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception as e:
+        log.debug("metrics request failed: %s", e)
+    finally:
+        writer.close()
+
+
+async def _summary_loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        text = registry.summary()
+        if text:
+            log.info("metrics: %s", text)
+
+
+async def start(port: int = METRICS_PORT, summary_sec: float = METRICS_SUMMARY_SEC) -> None:
+    global _server, _summary_task
+    if not ENABLED:
+        return
+    if port and _server is None:
+        _server = await asyncio.start_server(_handle, METRICS_HOST, port)
+        log.info("metrics: serving http://%s:%d/metrics", METRICS_HOST, port)
+    if summary_sec > 0 and _summary_task is None:
+        _summary_task = asyncio.ensure_future(_summary_loop(summary_sec))
+
+
+async def stop() -> None:
+    global _server, _summary_task
+    if _summary_task is not None:
+        _summary_task.cancel()
+        try:
+            await _summary_task
+        except asyncio.CancelledError:
+            pass
+        _summary_task = None
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
@@ -0,0 +1,199 @@
+# order_pipeline.py
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from ib_insync import LimitOrder, OrderStatus, Trade
+
+from contracts import ContractCache
+from ib_session import IBSession
+from ratelimit import TokenBucket, ib_limiter
+
+log = logging.getLogger("order_pipeline")
+
+# сколько ждать подтверждения от IB (PendingSubmit → PreSubmitted/Submitted/…)
+ORDER_ACK_TIMEOUT = float(os.getenv("ORDER_ACK_TIMEOUT", "10"))
+ORDER_TIF = os.getenv("ORDER_TIF", "GTC")
+ORDER_OUTSIDE_RTH = os.getenv("ORDER_OUTSIDE_RTH", "true").lower() == "true"
+# префикс orderRef — по нему отличаем свои заявки от ручных
+ORDER_REF_PREFIX = os.getenv("ORDER_REF_PREFIX", "dca")
+
+PENDING = {"", OrderStatus.PendingSubmit, OrderStatus.ApiPending}
+REJECTED = {OrderStatus.Cancelled, OrderStatus.ApiCancelled}
+
+Key = Tuple[str, str]  # (symbol, side)
+
+
+class OrderRejected(Exception):
+    pass
+
+
+class DuplicateOrder(Exception):
+    pass
+
+
+@dataclass
+class InFlight:
+    symbol: str
+    side: str
+    tag: str
+    placed_at: float = field(default_factory=time.monotonic)
+    trade: Optional[Trade] = None
+    acked: Optional[asyncio.Future] = None
+
+
+def order_tag(symbol: str, side: str, qty: float, limit: float) -> str:
+    """
+    orderRef заявки: (symbol, side) — в префиксе, по нему повтор (ретрай,
+    следующий цикл) находит уже открытую заявку и не ставит вторую.
+    """
+    return f"{tag_prefix(symbol, side)}{qty:g}@{limit:.2f}"
+
+
+def tag_prefix(symbol: str, side: str) -> str:
+    """
+    Общая часть тегов заявок (symbol, side). Лимит пересчитывается от цены
+    каждый цикл — уже стоящую заявку ищем по префиксу, а не по тегу целиком.
+    """
+    return f"{ORDER_REF_PREFIX}:{symbol}:{side}:"
+
+
+class OrderPipeline:
+    """
+    Отправка заявок в IB:
+      * реестр «в полёте» по (symbol, side) — запись появляется до первого
+        await, так что параллельная или следующая оценка тикера не поставит дубль,
+        пока ордер не виден ни в книге, ни в БД; уходит, когда ордер завершён;
+      * orderRef-тег: заявка того же (symbol, side) уже открыта в IB → возвращаем её;
+      * подтверждение — по Trade.statusEvent, с таймаутом ORDER_ACK_TIMEOUT;
+      * общий токен-бакет сообщений IB (ratelimit.ib_limiter).
+    on_update(trade) зовётся на каждое изменение статуса своих заявок.
+    """
+
+    def __init__(self, session: IBSession, contracts: ContractCache,
+                 limiter: TokenBucket = ib_limiter, use_timestamp_id: bool = True,
+                 on_update: Optional[Callable[[Trade], None]] = None):
+        self.session = session
+        self.contracts = contracts
+        self.limiter = limiter
+        self.use_timestamp_id = use_timestamp_id
+        self.on_update = on_update
+        self.inflight: Dict[Key, InFlight] = {}
+        self._last_id = 0
+        # статистика
+        self.placed = 0
+        self.rejected = 0
+        self.deduped = 0
+        self.ack_timeouts = 0
+
+    # ---------- реестр ----------
+    def busy(self, symbol: str, side: Optional[str] = None) -> bool:
+        if side is not None:
+            return (symbol, side) in self.inflight
+        return (symbol, "BUY") in self.inflight or (symbol, "SELL") in self.inflight
+
+    def _release(self, key: Key, entry: InFlight) -> None:
+        if self.inflight.get(key) is entry:
+            del self.inflight[key]
+
+    def retain(self, open_trades: Iterable[Trade]) -> List[InFlight]:
+        """
+        После reconcile: убрать из реестра заявки, которых IB среди открытых
+        не знает, хотя подтверждение уже должно было прийти. Вернёт убранные.
+        """
+        refs = [getattr(t.order, "orderRef", "") or "" for t in open_trades]
+        stale_before = time.monotonic() - ORDER_ACK_TIMEOUT
+        dropped = []
+        for key, entry in list(self.inflight.items()):
+            prefix = tag_prefix(*key)
+            if entry.placed_at < stale_before and not any(r.startswith(prefix) for r in refs):
+                dropped.append(entry)
+                del self.inflight[key]
+        return dropped
+
+    # ---------- отправка ----------
+    def _next_order_id(self) -> int:
+        """
+        orderId = timestamp (как было), но строго растущий: одинаковый id в IB — это модификация.
+        Только для одного процесса: у параллельных движков timestamp совпадёт.
+        use_timestamp_id=False — orderId не задаём, его выдаст ib_insync (client.getReqId()).
+        """
+        oid = max(int(time.time()), self._last_id + 1)
+        self._last_id = oid
+        return oid
+
+    async def submit(self, symbol: str, side: str, qty: float, limit: float) -> Trade:
+        key = (symbol, side)
+        if key in self.inflight:
+            self.deduped += 1
+            raise DuplicateOrder(f"{symbol} {side} already in flight")
+        tag = order_tag(symbol, side, qty, limit)
+        prefix = tag_prefix(symbol, side)
+        entry = self.inflight[key] = InFlight(symbol, side, tag)
+        try:
+            ib = await self.session.get()
+            for t in ib.openTrades():
+                ref = getattr(t.order, "orderRef", "") or ""
+                if ref.startswith(prefix):
+                    # уже стоит (ретрай после обрыва, таймаут подтверждения, которое
+                    # потом всё же дошло) — пусть и по старой цене, второй не ставим
+                    self.deduped += 1
+                    entry.trade = t
+                    entry.tag = ref
+                    log.info("[%s] %s already open in IB (orderRef=%s)", symbol, side, ref)
+                    self._watch(key, entry, t)
+                    return t
+            contract = await self.contracts.get(ib, symbol)
+            order = LimitOrder(side, qty, limit, tif=ORDER_TIF, outsideRth=ORDER_OUTSIDE_RTH, orderRef=tag)
+            if self.use_timestamp_id:
+                order.orderId = self._next_order_id()
+            await self.limiter.acquire()
+            trade = ib.placeOrder(contract, order)
+            entry.trade = trade
+            self.placed += 1
+            self._watch(key, entry, trade)
+            await self._wait_ack(entry)
+        except BaseException:
+            self._release(key, entry)
+            raise
+        status = trade.orderStatus.status
+        if status in REJECTED:
+            self.rejected += 1
+            raise OrderRejected(f"{symbol} {side} {qty}@{limit}: {status} {trade.log[-1].message if trade.log else ''}")
+        return trade
+
+    def _watch(self, key: Key, entry: InFlight, trade: Trade) -> None:
+        entry.acked = asyncio.get_running_loop().create_future()
+        if trade.orderStatus.status not in PENDING:
+            entry.acked.set_result(trade.orderStatus.status)
+
+        def on_status(t: Trade) -> None:
+            status = t.orderStatus.status
+            if status not in PENDING and not entry.acked.done():
+                entry.acked.set_result(status)
+            if t.isDone():
+                self._release(key, entry)
+                t.statusEvent -= on_status
+            if self.on_update is not None:
+                try:
+                    self.on_update(t)
+                except Exception as e:
+                    log.error("[%s] order update handler failed: %s", entry.symbol, e)
+
+        trade.statusEvent += on_status
+        if trade.isDone():
+            self._release(key, entry)
+
+    async def _wait_ack(self, entry: InFlight) -> None:
+        if entry.acked.done():
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(entry.acked), ORDER_ACK_TIMEOUT)
+        except asyncio.TimeoutError:
+            # ордер мог уйти — оставляем в реестре, дубль не поставим; снимет retain()
+            self.ack_timeouts += 1
+            log.warning("[%s] %s: no ack from IB in %.0fs (orderRef=%s)",
+                        entry.symbol, entry.side, ORDER_ACK_TIMEOUT, entry.tag)
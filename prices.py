@@ -0,0 +1,165 @@
+# prices.py
+import os
+import copy
+import math
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from ib_insync import IB, Contract, Ticker
+
+from ratelimit import TokenBucket
+
+log = logging.getLogger("prices")
+
+# цена старше этого (сек) считается протухшей → snapshot-запрос
+PRICE_STALE_SEC = float(os.getenv("PRICE_STALE_SEC", "5"))
+# сколько ждать snapshot (50 × 100ms, как было в get_last)
+SNAPSHOT_TRIES = int(os.getenv("SNAPSHOT_TRIES", "50"))
+
+Qualifier = Callable[[IB, str], Awaitable[Contract]]
+
+
+def ticker_price(t: Ticker) -> float:
+    """last → close → marketPrice(); nan/0 пропускаем."""
+    for px in (t.last, t.close, t.marketPrice()):
+        if px and not math.isnan(px) and px > 0:
+            return float(px)
+    return 0.0
+
+
+def _forget_ticker(ib: IB, contract: Contract, t: Ticker) -> None:
+    """Ticker snapshot'а ib_insync сам из wrapper'а не убирает — на каждую копию контракта."""
+    wrapper = getattr(ib, "wrapper", None)
+    if wrapper is not None:
+        wrapper.endTicker(t, "mktData")
+        wrapper.tickers.pop(id(contract), None)
+
+
+class PriceCache:
+    """
+    Кэш цен на стриминговых подписках reqMktData — по одной на тикер из white_list.
+    get() — O(1) без обращения к IB; last() при протухшей цене
+    откатывается на snapshot-запрос. Подписки, отписки и snapshot'ы берут
+    токен из limiter, если он задан.
+    """
+
+    def __init__(self, qualify: Qualifier, on_price: Optional[Callable[[str, float], None]] = None,
+                 limiter: Optional[TokenBucket] = None):
+        self.qualify = qualify
+        self.on_price = on_price
+        self.limiter = limiter
+        self.tickers: Dict[str, Ticker] = {}
+        self.prices: Dict[str, float] = {}
+        # time.monotonic() последнего тика подписки; snapshot свежесть не продлевает
+        self.updated: Dict[str, float] = {}
+        self._sym_by_ticker: Dict[int, str] = {}
+        self._attached: Optional[IB] = None
+
+    def attach(self, ib: IB) -> None:
+        if self._attached is not ib:
+            ib.pendingTickersEvent += self._on_tickers
+            self._attached = ib
+
+    def reset(self) -> None:
+        """После переподключения старые подписки мертвы — забываем их (цены оставляем)."""
+        self.tickers.clear()
+        self._sym_by_ticker.clear()
+
+    def _on_tickers(self, tickers: Iterable[Ticker]) -> None:
+        now = time.monotonic()
+        for t in tickers:
+            sym = self._sym_by_ticker.get(id(t))
+            if sym is None:
+                continue
+            px = ticker_price(t)
+            if px <= 0:
+                continue
+            self.updated[sym] = now
+            if self.prices.get(sym) != px:
+                self.prices[sym] = px
+                if self.on_price:
+                    self.on_price(sym, px)
+
+    async def _spend(self) -> None:
+        """Сообщение в IB (подписка, отписка, snapshot) — токен из общего бюджета."""
+        if self.limiter is not None:
+            await self.limiter.acquire()
+
+    async def sync(self, ib: IB, symbols: Iterable[str]) -> None:
+        """Подписаться на новые тикеры white_list, отписаться от удалённых."""
+        self.attach(ib)
+        wanted = set(symbols)
+        for sym in list(self.tickers):
+            if sym not in wanted:
+                t = self.tickers.pop(sym)
+                self._sym_by_ticker.pop(id(t), None)
+                self.prices.pop(sym, None)
+                self.updated.pop(sym, None)
+                await self._spend()
+                try:
+                    ib.cancelMktData(t.contract)
+                except Exception as e:
+                    log.error("cancelMktData %s failed: %s", sym, e)
+        for sym in wanted:
+            if sym in self.tickers:
+                continue
+            try:
+                c = await self.qualify(ib, sym)
+                await self._spend()
+                t = ib.reqMktData(c, "", False, False)
+            except Exception as e:
+                log.error("reqMktData %s failed: %s", sym, e)
+                continue
+            self.tickers[sym] = t
+            self._sym_by_ticker[id(t)] = sym
+
+    def prev_close(self, symbol: str) -> Optional[float]:
+        """Закрытие прошлой сессии из подписки (ticker.close), если IB его прислал."""
+        t = self.tickers.get(symbol)
+        px = t.close if t is not None else None
+        return float(px) if px and not math.isnan(px) and px > 0 else None
+
+    def age(self, symbol: str) -> float:
+        ts = self.updated.get(symbol)
+        return math.inf if ts is None else time.monotonic() - ts
+
+    def get(self, symbol: str) -> Optional[float]:
+        """Свежая цена из кэша или None."""
+        if self.age(symbol) > PRICE_STALE_SEC:
+            return None
+        return self.prices.get(symbol)
+
+    async def last(self, ib: IB, symbol: str) -> float:
+        px = self.get(symbol)
+        if px:
+            return px
+        px = await self.snapshot(ib, symbol)
+        if px > 0:
+            if self.prices.get(symbol) != px:
+                self.prices[symbol] = px
+                if self.on_price:
+                    self.on_price(symbol, px)
+        return px
+
+    async def snapshot(self, ib: IB, symbol: str) -> float:
+        c = await self.qualify(ib, symbol)
+        await self._spend()
+        # ib_insync держит один Ticker на объект Contract: snapshot на контракте
+        # подписки вернул бы её (протухший) Ticker и перезаписал бы её reqId —
+        # cancelMktData потом отменил бы не тот запрос. Поэтому — копия.
+        c = copy.copy(c)
+        # в ib_insync нет reqMktDataAsync: reqMktData сразу отдаёт Ticker, он заполняется по мере ответа
+        t: Ticker = ib.reqMktData(c, "", True, False)
+        try:
+            # ждём пока придёт last/close
+            for _ in range(SNAPSHOT_TRIES):
+                px = ticker_price(t)
+                if px > 0:
+                    return px
+                await asyncio.sleep(0.1)
+            # если так и не пришло — вернём 0
+            return 0.0
+        finally:
+            _forget_ticker(ib, c, t)
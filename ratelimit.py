@@ -0,0 +1,66 @@
+# ratelimit.py
+import os
+import time
+import asyncio
+
+# IB отключает клиента при > 50 сообщений/сек; держим запас
+IB_MSG_RATE = float(os.getenv("IB_MSG_RATE", "40"))
+IB_MSG_BURST = int(os.getenv("IB_MSG_BURST", "10"))
+
+
+class TokenBucket:
+    """
+    Токен-бакет: rate токенов/сек, не больше burst в запасе.
+    acquire() ждёт ровно столько, сколько нужно до следующего токена;
+    ожидающие обслуживаются по очереди (лок), без гонок за токен.
+    """
+
+    def __init__(self, rate: float = IB_MSG_RATE, burst: int = IB_MSG_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited = 0.0  # суммарное ожидание, сек — для метрик
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def try_acquire(self, n: float = 1) -> bool:
+        """Без ожидания: True, если токен взят."""
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self._tokens >= n:
+            self._tokens -= n
+            return True
+        return False
+
+    async def acquire(self, n: float = 1) -> None:
+        if self.rate <= 0:
+            return
+        # больше burst в запасе не бывает — крупный запрос берём частями
+        while n > self.burst:
+            await self.acquire(self.burst)
+            n -= self.burst
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return
+                wait = (n - self._tokens) / self.rate
+                self.waited += wait
+                await asyncio.sleep(wait)
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+
+# общий бюджет сообщений в IB на процесс: ордера, snapshot'ы, подписки и
+# отписки на цены, квалификация контрактов (токен на контракт), сверки
+ib_limiter = TokenBucket()
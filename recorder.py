@@ -0,0 +1,258 @@
+# recorder.py
+# Запись всех цен и исполнений, которые видит движок, — для анализа и
+# повторного прогона (backtest.py) на тех же данных, на которых торговал бот.
+# Включается RECORD_DIR. Раскладка: RECORD_DIR/ГГГГММДД/<тикер>.ticks|.fills —
+# сырые массивы фиксированных записей NumPy (little-endian, без заголовка),
+# только дописываются. День — по UTC.
+#
+# Горячий путь (tick/fill) только кладёт кортеж в буфер; раз в RECORD_FLUSH_SEC
+# буферы превращаются в массивы и дописываются в файлы в отдельном потоке.
+#
+#   python recorder.py AAPL --from 20240102 --to 20240105     # сводка по записанному
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+
+log = logging.getLogger("recorder")
+
+RECORD_DIR = os.getenv("RECORD_DIR", "")
+RECORD_FLUSH_SEC = float(os.getenv("RECORD_FLUSH_SEC", "1"))
+# столько записей в буферах — сбрасываем, не дожидаясь таймера
+RECORD_MAX_ROWS = int(os.getenv("RECORD_MAX_ROWS", "100000"))
+
+TICK_DTYPE = np.dtype([("ts", "<f8"), ("price", "<f8")])
+# side: +1 покупка (BOT), -1 продажа (SLD)
+FILL_DTYPE = np.dtype([("ts", "<f8"), ("side", "<i1"), ("qty", "<f8"), ("price", "<f8"),
+                       ("perm_id", "<i8")])
+KINDS = {"ticks": TICK_DTYPE, "fills": FILL_DTYPE}
+
+
+def day_of(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%d")
+
+
+def _path(root: str, day: str, symbol: str, kind: str) -> str:
+    # тикеры вида «BRK B» / «BF.B» — в имени файла без пробелов и слэшей
+    name = symbol.upper().replace("/", "_").replace(" ", "_")
+    return os.path.join(root, day, f"{name}.{kind}")
+
+
+# ---------------------------
+# Запись
+# ---------------------------
+class Recorder:
+    """
+    tick(symbol, px) / fill(trade, fill) — O(1), без I/O; attach(ib) подписывает
+    fill на execDetailsEvent. start() запускает фоновый сброс, close() дописывает
+    остаток. С пустым root ничего не делает.
+    """
+
+    def __init__(self, root: str = RECORD_DIR, flush_sec: float = RECORD_FLUSH_SEC,
+                 max_rows: int = RECORD_MAX_ROWS):
+        self.root = root
+        self.flush_sec = flush_sec
+        self.max_rows = max_rows
+        self._buf: Dict[Tuple[str, str], list] = {}   # (kind, symbol) → [кортеж, …]
+        self._rows = 0
+        self._exec_ids: Dict[str, float] = {}          # execId → ts, повторы после переподключения
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._attached = None
+        self.rows_written = 0
+        self.bytes_written = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def attach(self, ib) -> None:
+        if self.enabled and self._attached is not ib:
+            ib.execDetailsEvent += self.fill
+            self._attached = ib
+
+    # ---------- горячий путь ----------
+    def _put(self, kind: str, symbol: str, row: tuple) -> None:
+        rows = self._buf.get((kind, symbol))
+        if rows is None:
+            rows = self._buf[(kind, symbol)] = []
+        rows.append(row)
+        self._rows += 1
+        if self._rows >= self.max_rows:
+            self._full.set()
+
+    def tick(self, symbol: str, px: float, ts: Optional[float] = None) -> None:
+        if self.enabled:
+            self._put("ticks", symbol, (time.time() if ts is None else ts, px))
+
+    def fill(self, trade, fill) -> None:
+        if not self.enabled:
+            return
+        ex = fill.execution
+        if ex.execId in self._exec_ids:
+            return
+        ts = ex.time.timestamp() if ex.time else time.time()
+        self._exec_ids[ex.execId] = ts
+        side = 1 if ex.side == "BOT" else -1
+        self._put("fills", trade.contract.symbol, (ts, side, float(ex.shares), float(ex.price),
+                                                   int(ex.permId or 0)))
+
+    # ---------- сброс ----------
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_sec)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error("recorder flush failed: %s", e)
+
+    async def flush(self) -> None:
+        if not self._buf:
+            return
+        buf, self._buf, self._rows = self._buf, {}, 0
+        self._full.clear()
+        await asyncio.get_running_loop().run_in_executor(None, self._write, buf)
+        # execId нужен только пока IB может прислать его повторно
+        cutoff = time.time() - 86400
+        if len(self._exec_ids) > 10000:
+            self._exec_ids = {k: t for k, t in self._exec_ids.items() if t >= cutoff}
+
+    def _write(self, buf: Dict[Tuple[str, str], list]) -> None:
+        """В потоке пула: по файлу на (день, тикер, вид), одна запись на файл."""
+        rows = nbytes = 0
+        for (kind, symbol), items in buf.items():
+            arr = np.array(items, dtype=KINDS[kind])
+            # номер суток UTC; на стыке дней буфер делится на два файла
+            days = (arr["ts"] // 86400).astype(np.int64)
+            uniq = np.unique(days).tolist()
+            for d in uniq:
+                part = arr if len(uniq) == 1 else arr[days == d]
+                path = _path(self.root, day_of(d * 86400.0), symbol, kind)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                data = part.tobytes()
+                with open(path, "ab") as f:
+                    _truncate_partial(f, kind)
+                    f.write(data)
+                rows += len(part)
+                nbytes += len(data)
+        self.rows_written += rows
+        self.bytes_written += nbytes
+        metrics.inc("recorder_rows_total", rows)
+        metrics.inc("recorder_bytes_total", nbytes)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+def _truncate_partial(f, kind: str) -> None:
+    """Хвост от оборванной записи (процесс убили посреди write) — отрезать."""
+    size = f.seek(0, os.SEEK_END)
+    extra = size % KINDS[kind].itemsize
+    if extra:
+        f.truncate(size - extra)
+        f.seek(0, os.SEEK_END)
+
+
+# ---------------------------
+# Чтение
+# ---------------------------
+def read_file(path: str, kind: Optional[str] = None) -> np.ndarray:
+    """
+    Файл целиком как np.memmap (без копирования); вид — по расширению.
+    Неполная последняя запись не видна.
+    """
+    kind = kind or os.path.splitext(path)[1].lstrip(".")
+    dtype = KINDS[kind]
+    n = os.path.getsize(path) // dtype.itemsize
+    if n == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(n,))
+
+
+def _days(start: str, end: str) -> Iterator[str]:
+    d = datetime.strptime(start, "%Y%m%d")
+    stop = datetime.strptime(end, "%Y%m%d")
+    while d <= stop:
+        yield d.strftime("%Y%m%d")
+        d += timedelta(days=1)
+
+
+def _bound(day: str) -> float:
+    return datetime.strptime(day, "%Y%m%d").replace(tzinfo=timezone.utc).timestamp()
+
+
+def iter_range(symbol: str, start: float, end: float, kind: str = "ticks",
+               root: str = RECORD_DIR) -> Iterator[np.ndarray]:
+    """
+    Записи тикера с ts в [start, end) — по дню за раз, срезами memmap
+    (без копирования). Внутри файла ts не убывает — границы ищем бинарно.
+    """
+    for day in _days(day_of(start), day_of(max(start, end - 1e-6))):
+        path = _path(root, day, symbol, kind)
+        if not os.path.exists(path):
+            continue
+        arr = read_file(path, kind)
+        ts = arr["ts"]
+        lo = 0 if start <= _bound(day) else int(np.searchsorted(ts, start, "left"))
+        hi = int(np.searchsorted(ts, end, "left"))
+        if hi > lo:
+            yield arr[lo:hi]
+
+
+def load_range(symbol: str, start: float, end: float, kind: str = "ticks",
+               root: str = RECORD_DIR) -> np.ndarray:
+    """То же одним массивом (копия, если дней больше одного)."""
+    parts = list(iter_range(symbol, start, end, kind, root))
+    if not parts:
+        return np.empty(0, dtype=KINDS[kind])
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Summary of recorded ticks/fills")
+    ap.add_argument("symbol")
+    ap.add_argument("--from", dest="start", default=day_of(time.time()), help="YYYYMMDD (UTC)")
+    ap.add_argument("--to", dest="end", default=None, help="YYYYMMDD inclusive, default = --from")
+    ap.add_argument("--root", default=RECORD_DIR or ".")
+    args = ap.parse_args(argv)
+    start = _bound(args.start)
+    end = _bound(args.end or args.start) + 86400
+    for kind in KINDS:
+        arr = load_range(args.symbol, start, end, kind, args.root)
+        if not len(arr):
+            print(f"{kind}: none")
+            continue
+        line = f"{kind}: {len(arr)} rows  {datetime.fromtimestamp(arr['ts'][0], timezone.utc):%Y-%m-%d %H:%M:%S}" \
+               f" .. {datetime.fromtimestamp(arr['ts'][-1], timezone.utc):%Y-%m-%d %H:%M:%S} UTC"
+        if kind == "ticks":
+            line += f"  price {arr['price'].min():g}..{arr['price'].max():g}"
+        else:
+            line += f"  bought {arr['qty'][arr['side'] > 0].sum():g}  sold {arr['qty'][arr['side'] < 0].sum():g}"
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# scheduler.py
+# Адаптивное расписание оценки тикеров вместо фиксированной паузы dca_loop.
+# Куча (due, symbol): чем ближе last к порогу DCA/TP в единицах недавней
+# волатильности, тем раньше тикер оценивается снова. Случайное блуждание
+# с σ (на √сек) проходит расстояние d примерно за (d/σ)² сек — берём
+# долю SCHED_SAFETY от этого времени, в пределах [MIN, MAX].
+import os
+import math
+import time
+import heapq
+import asyncio
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+SCHED_MIN_INTERVAL = float(os.getenv("SCHED_MIN_INTERVAL", "0.25"))
+SCHED_MAX_INTERVAL = float(os.getenv("SCHED_MAX_INTERVAL", "10"))
+SCHED_SAFETY = float(os.getenv("SCHED_SAFETY", "0.1"))
+# полураспад EWMA волатильности (сек) и её нижняя граница (доля цены на √сек)
+SCHED_VOL_HALFLIFE = float(os.getenv("SCHED_VOL_HALFLIFE", "60"))
+SCHED_VOL_FLOOR = float(os.getenv("SCHED_VOL_FLOOR", "0.0005"))
+# тикер «горячий», если его интервал не больше этого (сек) — для метрик
+SCHED_HOT_INTERVAL = float(os.getenv("SCHED_HOT_INTERVAL", "1"))
+
+
+class SymbolScheduler:
+    """
+    due() — тикеры, которым пора на оценку; reschedule() — после оценки
+    по снимку (qty, avg, last, has_open, known) ставит каждому следующий срок;
+    observe() — тик цены для оценки волатильности; wake() — оценить сейчас.
+    """
+
+    def __init__(self, dca_pct: float, tp_pct: float,
+                 min_interval: float = SCHED_MIN_INTERVAL, max_interval: float = SCHED_MAX_INTERVAL):
+        self.dca_pct = dca_pct
+        self.tp_pct = tp_pct
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self._heap: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}       # актуальный срок; в куче могут быть устаревшие записи
+        self._interval: Dict[str, float] = {}
+        self._var: Dict[str, float] = {}       # EWMA квадрата лог-доходности на секунду
+        self._tick: Dict[str, Tuple[float, float]] = {}  # (цена, время) последнего тика
+        # wake() прерывает сон цикла до ближайшего срока
+        self.woken = asyncio.Event()
+
+    # ---------- набор тикеров ----------
+    def sync(self, symbols: Iterable[str]) -> None:
+        """Новые тикеры white_list — на оценку сразу, удалённые — забыть."""
+        wanted = set(symbols)
+        now = time.monotonic()
+        for sym in list(self._due):
+            if sym not in wanted:
+                del self._due[sym]
+                self._interval.pop(sym, None)
+                self._var.pop(sym, None)
+                self._tick.pop(sym, None)
+        for sym in wanted:
+            if sym not in self._due:
+                self._push(sym, now)
+        # куча не должна разрастаться устаревшими записями
+        if len(self._heap) > 4 * len(self._due) + 64:
+            self._heap = [(d, s) for s, d in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def _push(self, sym: str, due: float) -> None:
+        self._due[sym] = due
+        heapq.heappush(self._heap, (due, sym))
+
+    def wake(self, symbol: str) -> None:
+        if symbol in self._due and self._due[symbol] > time.monotonic():
+            self._push(symbol, time.monotonic())
+            self.woken.set()
+
+    # ---------- выдача ----------
+    def due(self, now: Optional[float] = None) -> List[str]:
+        now = time.monotonic() if now is None else now
+        out = []
+        while self._heap and self._heap[0][0] <= now:
+            due, sym = heapq.heappop(self._heap)
+            if self._due.get(sym) == due:
+                out.append(sym)
+                # до reschedule не выдаём повторно; если оценка сорвалась —
+                # тикер вернётся через max_interval
+                self._push(sym, now + self.max_interval)
+        return out
+
+    def next_due(self) -> float:
+        """time.monotonic() ближайшего срока (inf, если тикеров нет)."""
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else math.inf
+
+    # ---------- волатильность ----------
+    def observe(self, symbol: str, px: float) -> None:
+        now = time.monotonic()
+        prev = self._tick.get(symbol)
+        self._tick[symbol] = (px, now)
+        if prev is None or prev[0] <= 0 or px <= 0:
+            return
+        dt = max(now - prev[1], 1e-3)
+        r2 = math.log(px / prev[0]) ** 2 / dt
+        a = 1.0 - 0.5 ** (dt / SCHED_VOL_HALFLIFE)
+        v = self._var.get(symbol)
+        self._var[symbol] = r2 if v is None else v + a * (r2 - v)
+
+    def volatility(self, symbol: str) -> float:
+        """σ лог-цены на √сек (не ниже SCHED_VOL_FLOOR)."""
+        return max(math.sqrt(self._var.get(symbol, 0.0)), SCHED_VOL_FLOOR)
+
+    # ---------- расписание ----------
+    def intervals(self, symbols: List[str], qty: np.ndarray, avg: np.ndarray, last: np.ndarray,
+                  has_open: np.ndarray, known: np.ndarray) -> np.ndarray:
+        """
+        Интервал до следующей оценки, одним проходом NumPy:
+          * позиция есть — по расстоянию до ближайшего порога DCA/TP;
+          * позиции нет, цена есть — первая покупка, минимум;
+          * открытый ордер, нет строки или цены — максимум (разбудят
+            колбэк ордера, reconcile или новая цена).
+        """
+        n = len(symbols)
+        vol = np.fromiter((self.volatility(s) for s in symbols), dtype=np.float64, count=n)
+        out = np.full(n, self.max_interval)
+
+        free = known & ~has_open & (last > 0)
+        out[free & (qty <= 0)] = self.min_interval
+
+        held = free & (qty > 0) & (avg > 0)
+        if held.any():
+            lv = np.log(last[held])
+            la = np.log(avg[held])
+            to_dca = lv - (la + math.log1p(-self.dca_pct))
+            to_tp = (la + math.log1p(self.tp_pct)) - lv
+            dist = np.clip(np.minimum(to_dca, to_tp), 0.0, None)
+            t = SCHED_SAFETY * (dist / vol[held]) ** 2
+            out[held] = np.clip(t, self.min_interval, self.max_interval)
+        return out
+
+    def reschedule(self, symbols: List[str], qty: np.ndarray, avg: np.ndarray, last: np.ndarray,
+                   has_open: np.ndarray, known: np.ndarray) -> None:
+        now = time.monotonic()
+        for sym, dt in zip(symbols, self.intervals(symbols, qty, avg, last, has_open, known).tolist()):
+            if sym not in self._due:
+                continue  # успели убрать из white_list
+            self._interval[sym] = dt
+            # wake() во время оценки мог поставить срок раньше — не откладываем
+            self._push(sym, min(now + dt, self._due[sym]))
+
+    def hot_count(self) -> int:
+        return sum(1 for dt in self._interval.values() if dt <= SCHED_HOT_INTERVAL)
+
+    def __len__(self) -> int:
+        return len(self._due)
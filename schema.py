@@ -0,0 +1,440 @@
+# schema.py
+# Единая версионная схема bot.db. Версия — в PRAGMA user_version;
+# migrate() применяет недостающие миграции по порядку, каждую в своей
+# транзакции (BEGIN IMMEDIATE — два процесса не мигрируют одновременно).
+# engine.ensure_schema и db.init_db вызывают только migrate().
+import logging
+from typing import Awaitable, Callable, Iterable, List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+from book import OPEN_STATUSES
+from contracts import CREATE_CONTRACTS_SQL
+
+log = logging.getLogger("schema")
+
+# текущее время в orders/positions — целые секунды epoch
+NOW_SQL = "CAST(strftime('%s','now') AS INTEGER)"
+
+# ---------------------------
+# Таблицы
+# ---------------------------
+CREATE_WHITE_LIST_SQL = """
+CREATE TABLE IF NOT EXISTS white_list(
+    id   INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    pair TEXT
+)
+"""
+
+CREATE_TRADE_PARAMS_SQL = """
+CREATE TABLE IF NOT EXISTS trade_params(
+    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    timeout_socket TEXT,
+    min_bnb TEXT,
+    min_balance TEXT,
+    position_size TEXT,
+    min_order TEXT,
+    min_price TEXT,
+    min_daily_percent TEXT,
+    daily_percent TEXT,
+    auto_daily_percent TEXT,
+    order_timer TEXT,
+    min_value TEXT,
+    sell_up TEXT,
+    buy_down TEXT,
+    max_trade_pairs TEXT,
+    auto_trade_pairs BOOLEAN,
+    progressive_max_pairs BOOLEAN,
+    delta_percent BOOLEAN,
+    delta_deep BOOLEAN,
+    num_aver BOOLEAN,
+    step_aver TEXT,
+    max_aver TEXT,
+    quantity_aver TEXT,
+    average_percent TEXT,
+    trailing_stop BOOLEAN,
+    trailing_percent TEXT,
+    trailing_part TEXT,
+    trailing_price TEXT,
+    new_listing BOOLEAN,
+    listing_order TEXT,
+    max_buy_listing TEXT,
+    user_order BOOLEAN,
+    fiat_currencies TEXT,
+    quote_asset TEXT,
+    double_asset BOOLEAN,
+    pump_detector BOOLEAN,
+    pump_order TEXT,
+    pump_up TEXT,
+    max_pump_pairs TEXT,
+    trailing_pump BOOLEAN,
+    tg_template TEXT,
+    individual_depth BOOLEAN,
+    reinvest_position BOOLEAN,
+    reinvest_percent TEXT,
+    trading_view BOOLEAN,
+    max_trading_view TEXT,
+    row_sell TEXT,
+    sell_count BOOLEAN,
+    trailing_value TEXT,
+    signals BOOLEAN,
+    max_signals TEXT,
+    volatility BOOLEAN,
+    delisting_sale BOOLEAN,
+    conf_key TEXT,
+    dev_signals BOOLEAN,
+    max_dev_signals TEXT,
+    average_dev_signals BOOLEAN
+)
+"""
+
+CREATE_POSITIONS_SQL = """
+CREATE TABLE IF NOT EXISTS positions(
+    symbol TEXT PRIMARY KEY,
+    qty REAL,
+    avg_cost REAL,
+    last REAL,
+    updated_at INTEGER
+)
+"""
+
+# Ордера IB: одна таблица на engine.py и db.py.
+# permId — стабильный ID от IB, но сразу после отправки он 0 → храним NULL
+# и ключуемся по (clientId, orderId): orderId уникален только в пределах
+# clientId, у воркеров supervisor.py они свои (NULL'ы уникальности не мешают).
+# symbol NOCASE — поиск по тикеру без UPPER() и с индексом.
+ORDER_COLUMNS = (
+    "orderId", "clientId", "permId", "action", "symbol", "orderType", "lmtPrice", "tif", "outsideRth",
+    "status", "filled", "remaining", "avgFillPrice", "lastFillPrice", "whyHeld", "raw_json",
+    "created_at", "updated_at",
+)
+
+CREATE_ORDERS_SQL = f"""
+CREATE TABLE IF NOT EXISTS orders(
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    orderId       INTEGER,                -- локальный ID (у нас — timestamp)
+    clientId      INTEGER,                -- clientId подключения, выставившего ордер
+    permId        INTEGER,                -- глобальный стабильный ID от IB
+    action        TEXT,                   -- BUY / SELL
+    symbol        TEXT COLLATE NOCASE,    -- тикер, например AAPL
+    orderType     TEXT,                   -- MKT / LMT / …
+    lmtPrice      REAL,
+    tif           TEXT,                   -- GTC / DAY
+    outsideRth    INTEGER,                -- 1/0
+    status        TEXT,                   -- Submitted / Filled / Cancelled / Killed …
+    filled        REAL,
+    remaining     REAL,
+    avgFillPrice  REAL,
+    lastFillPrice REAL,
+    whyHeld       TEXT,
+    raw_json      TEXT,
+    created_at    INTEGER NOT NULL DEFAULT ({NOW_SQL}),
+    updated_at    INTEGER NOT NULL DEFAULT ({NOW_SQL})
+)
+"""
+
+ORDERS_INDEXES = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_orders_permId ON orders(permId)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_orders_client_orderId ON orders(clientId, orderId)",
+    # «есть ли открытый ордер по тикеру» — только по индексу
+    "CREATE INDEX IF NOT EXISTS ix_orders_symbol_status ON orders(symbol, status)",
+    # сверка открытых с IB (status IN ... → permId)
+    "CREATE INDEX IF NOT EXISTS ix_orders_status_permId ON orders(status, permId)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_natural ON orders(symbol, action, orderType, lmtPrice)",
+)
+
+# Открытые статусы — литералами, а не плейсхолдерами: SQLite берёт частичный
+# индекс, только если в запросе стоит то же самое условие, что и в WHERE индекса.
+OPEN_STATUS_SQL = "status IN (" + ", ".join(f"'{st}'" for st in sorted(OPEN_STATUSES)) + ")"
+
+# частичные индексы только по открытым ордерам: размер — число открытых,
+# а не вся история, поиск «есть ли открытый» не растёт вместе с таблицей
+OPEN_ORDERS_INDEXES = (
+    f"CREATE INDEX IF NOT EXISTS ix_orders_open_symbol ON orders(symbol) WHERE {OPEN_STATUS_SQL}",
+    f"CREATE INDEX IF NOT EXISTS ix_orders_open_keys ON orders(permId, orderId) WHERE {OPEN_STATUS_SQL}",
+)
+
+# холодная таблица для завершённых ордеров (Filled/Cancelled/Killed …), id — из orders
+CREATE_ORDERS_ARCHIVE_SQL = """
+CREATE TABLE IF NOT EXISTS orders_archive(
+    id            INTEGER PRIMARY KEY,
+    orderId       INTEGER,
+    clientId      INTEGER,
+    permId        INTEGER,
+    action        TEXT,
+    symbol        TEXT COLLATE NOCASE,
+    orderType     TEXT,
+    lmtPrice      REAL,
+    tif           TEXT,
+    outsideRth    INTEGER,
+    status        TEXT,
+    filled        REAL,
+    remaining     REAL,
+    avgFillPrice  REAL,
+    lastFillPrice REAL,
+    whyHeld       TEXT,
+    raw_json      TEXT,
+    created_at    INTEGER,
+    updated_at    INTEGER,
+    archived_at   INTEGER NOT NULL
+)
+"""
+
+ORDERS_ARCHIVE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS ix_orders_archive_symbol ON orders_archive(symbol, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_archive_permId ON orders_archive(permId)",
+)
+
+# счётчик версии конфигурации: триггеры на white_list/trade_params увеличивают v,
+# config_cache.py перечитывает таблицы, только когда v сдвинулся
+CREATE_CONFIG_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS config_version(
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    v  INTEGER NOT NULL
+)
+"""
+
+CONFIG_TABLES = ("white_list", "trade_params")
+
+
+def version_triggers_sql(table: str) -> List[str]:
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{op[:3].lower()} AFTER {op} ON {table}\n"
+        f"BEGIN UPDATE config_version SET v = v + 1 WHERE id = 1; END"
+        for op in ("INSERT", "UPDATE", "DELETE")
+    ]
+
+# symbols: цены и количества — REAL/INTEGER вместо TEXT
+SYMBOLS_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ("pair", "TEXT UNIQUE"),
+    ("baseAsset", "TEXT"), ("quoteAsset", "TEXT"),
+    ("stepSize", "REAL"), ("tickSize", "REAL"), ("minNotional", "REAL"),
+    ("priceChangePercent", "REAL"), ("bidPrice", "REAL"), ("askPrice", "REAL"), ("value", "REAL"),
+    ("averagePrice", "REAL"), ("buyPrice", "REAL"), ("sellPrice", "REAL"), ("trailingPrice", "REAL"),
+    ("allQuantity", "REAL"), ("freeQuantity", "REAL"), ("lockQuantity", "REAL"),
+    ("orderId", "INTEGER"), ("profit", "REAL"), ("totalQuote", "REAL"),
+    ("stepAveraging", "REAL"), ("numAveraging", "INTEGER"), ("statusOrder", "TEXT"), ("timer", "TEXT"),
+    ("pumpDetector", "TEXT"), ("pumpSignal", "TEXT"), ("lowPrice", "REAL"),
+    ("multiplierDown", "REAL"), ("multiplierUp", "REAL"), ("lockedQuote", "REAL"), ("twSignal", "TEXT"),
+    ("oco", "INTEGER"), ("lastEvent", "TEXT"), ("manualReinvest", "INTEGER"), ("rowSell", "TEXT"),
+    ("sellCount", "INTEGER"), ("bidMultiplierDown", "REAL"), ("askMultiplierUp", "REAL"),
+    ("signal", "TEXT"), ("averagingBlocking", "INTEGER"), ("rowTimer", "TEXT"),
+    ("delisting", "INTEGER"), ("volatility", "REAL"),
+)
+
+CREATE_SYMBOLS_SQL = (
+    "CREATE TABLE IF NOT EXISTS symbols(\n"
+    "    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,\n"
+    + ",\n".join(f"    {name} {decl}" for name, decl in SYMBOLS_COLUMNS)
+    + "\n)"
+)
+
+
+def upsert_order_sql(columns: Sequence[str], named: bool = False, keep: Sequence[str] = ()) -> str:
+    """
+    UPSERT ордера по permId, а если его ещё нет — по (clientId, orderId).
+    Ключи не затираются NULL'ами: permId приходит позже orderId.
+    keep — колонки, где NULL значит «оставить как есть» (raw_json без изменений).
+    """
+    values = ", ".join(f":{c}" if named else "?" for c in columns)
+    keys = ("orderId", "clientId", "permId", "created_at")
+    sets = [f"{c}=COALESCE(excluded.{c}, {c})" if c in keep else f"{c}=excluded.{c}"
+            for c in columns if c not in keys]
+    if "updated_at" not in columns:
+        sets.append(f"updated_at={NOW_SQL}")
+
+    def clause(target: Sequence[str]) -> str:
+        others = [f"{c}=COALESCE(excluded.{c}, {c})" for c in keys[:3] if c not in target and c in columns]
+        body = ",\n    ".join(others + sets)
+        return f"ON CONFLICT({', '.join(target)}) DO UPDATE SET\n    {body}"
+
+    return (f"INSERT INTO orders ({', '.join(columns)})\nVALUES ({values})\n"
+            f"{clause(('permId',))}\n{clause(('clientId', 'orderId'))}")
+
+
+async def kill_missing_open_orders(cx: aiosqlite.Connection, perm_ids: Iterable[Optional[int]],
+                                   order_ids: Optional[Iterable[Tuple[int, Optional[int]]]] = None,
+                                   symbols: Optional[Iterable[str]] = None) -> int:
+    """
+    Открытые в БД ордера, которых нет среди открытых в IB → Killed.
+    Ключи IB — во временные таблицы (executemany), затем один UPDATE с
+    анти-джойном: число запросов не зависит от размера книги, лимита
+    SQLite на число параметров нет. Ордер жив, если совпал permId или
+    пара (clientId, orderId); у строк из старой схемы clientId нет (NULL) — для
+    них хватает orderId.
+    order_ids=None — сверка только по permId (строки без permId не трогаем).
+    symbols — только ордера этих тикеров (воркер supervisor.py сверяет свою часть).
+    Коммит — за вызывающим.
+    """
+    await cx.execute("CREATE TEMP TABLE IF NOT EXISTS ib_open_perm(permId INTEGER PRIMARY KEY)")
+    await cx.execute("CREATE TEMP TABLE IF NOT EXISTS ib_open_oid("
+                     "clientId INTEGER, orderId INTEGER, PRIMARY KEY(orderId, clientId))")
+    await cx.execute("DELETE FROM ib_open_perm")
+    await cx.execute("DELETE FROM ib_open_oid")
+    await cx.executemany("INSERT OR IGNORE INTO ib_open_perm VALUES(?)", ((int(p),) for p in perm_ids if p))
+    where = [OPEN_STATUS_SQL, "NOT EXISTS (SELECT 1 FROM ib_open_perm k WHERE k.permId = orders.permId)"]
+    if order_ids is None:
+        where.append("permId IS NOT NULL")
+    else:
+        await cx.executemany("INSERT OR IGNORE INTO ib_open_oid VALUES(?, ?)",
+                             ((int(c or 0), int(o)) for c, o in order_ids if o))
+        where.append("NOT EXISTS (SELECT 1 FROM ib_open_oid k WHERE k.orderId = orders.orderId "
+                     "AND (orders.clientId IS NULL OR k.clientId = orders.clientId))")
+    if symbols is not None:
+        await cx.execute("CREATE TEMP TABLE IF NOT EXISTS ib_scope(symbol TEXT PRIMARY KEY COLLATE NOCASE)")
+        await cx.execute("DELETE FROM ib_scope")
+        await cx.executemany("INSERT OR IGNORE INTO ib_scope VALUES(?)", ((s,) for s in symbols))
+        where.append("symbol IN (SELECT symbol FROM ib_scope)")
+    cur = await cx.execute(f"UPDATE orders SET status='Killed', updated_at={NOW_SQL} WHERE " + " AND ".join(where))
+    return cur.rowcount
+
+
+
+# ---------------------------
+# Миграции
+# ---------------------------
+Migration = Callable[[aiosqlite.Connection], Awaitable[None]]
+
+
+async def _columns(cx: aiosqlite.Connection, table: str) -> List[str]:
+    rows = await cx.execute_fetchall(f"PRAGMA table_info({table})")
+    return [r[1] for r in rows]
+
+
+async def _m1_base(cx: aiosqlite.Connection) -> None:
+    """Таблицы, которые не меняются: white_list, trade_params, positions, contracts."""
+    for sql in (CREATE_WHITE_LIST_SQL, CREATE_TRADE_PARAMS_SQL, CREATE_POSITIONS_SQL, CREATE_CONTRACTS_SQL):
+        await cx.execute(sql)
+
+
+def _epoch(col: str) -> str:
+    # CURRENT_TIMESTAMP ('YYYY-MM-DD HH:MM:SS') из старой схемы db.py → секунды
+    return (f"CASE WHEN typeof({col})='text' THEN CAST(strftime('%s', {col}) AS INTEGER) "
+            f"ELSE {col} END")
+
+
+async def _m2_orders(cx: aiosqlite.Connection) -> None:
+    """
+    orders из db.py (action/orderType, permId NOT NULL) и из engine.py
+    (side/type, без уникальных ключей) → одна таблица. Дубли индексов уходят
+    вместе со старой таблицей.
+    """
+    old = await _columns(cx, "orders")
+    if not old:
+        await cx.execute(CREATE_ORDERS_SQL)
+    else:
+        aliases = {"action": "side", "orderType": "type"}
+        exprs = []
+        for c in ORDER_COLUMNS:
+            src = c if c in old else aliases.get(c) if aliases.get(c) in old else None
+            if src is None:
+                exprs.append(NOW_SQL if c in ("created_at", "updated_at") else "NULL")
+            elif c in ("orderId", "permId"):
+                exprs.append(f"NULLIF({src}, 0)")
+            elif c in ("created_at", "updated_at"):
+                exprs.append(f"COALESCE({_epoch(src)}, {NOW_SQL})")
+            else:
+                exprs.append(src)
+        await cx.execute("ALTER TABLE orders RENAME TO orders_old")
+        await cx.execute(CREATE_ORDERS_SQL)
+        await cx.execute(f"INSERT INTO orders (id, {', '.join(ORDER_COLUMNS)}) "
+                         f"SELECT id, {', '.join(exprs)} FROM orders_old ORDER BY id")
+        await cx.execute("DROP TABLE orders_old")
+        # дубли permId: оставляем последнюю строку. orderId не трогаем: старым
+        # строкам clientId не известен (NULL), под ключ (clientId, orderId) они не попадают
+        cur = await cx.execute("""
+            DELETE FROM orders WHERE permId IS NOT NULL
+              AND id NOT IN (SELECT MAX(id) FROM orders WHERE permId IS NOT NULL GROUP BY permId)""")
+        if cur.rowcount:
+            log.warning("schema: dropped %d duplicate orders by permId", cur.rowcount)
+    for sql in ORDERS_INDEXES:
+        await cx.execute(sql)
+
+
+async def _m3_symbols(cx: aiosqlite.Connection) -> None:
+    """symbols: TEXT-числа → REAL/INTEGER (пустые строки → NULL)."""
+    old = await _columns(cx, "symbols")
+    if not old:
+        await cx.execute(CREATE_SYMBOLS_SQL)
+        return
+    names = [n for n, _ in SYMBOLS_COLUMNS]
+    exprs = []
+    for name, decl in SYMBOLS_COLUMNS:
+        if name not in old:
+            exprs.append("NULL")
+        elif decl in ("REAL", "INTEGER"):
+            # аффинность колонки сама превратит '85.752' в 85.752
+            exprs.append(f"NULLIF(TRIM({name}), '')")
+        else:
+            exprs.append(name)
+    await cx.execute("ALTER TABLE symbols RENAME TO symbols_old")
+    await cx.execute(CREATE_SYMBOLS_SQL)
+    await cx.execute(f"INSERT INTO symbols (id, {', '.join(names)}) "
+                     f"SELECT id, {', '.join(exprs)} FROM symbols_old ORDER BY id")
+    await cx.execute("DROP TABLE symbols_old")
+
+
+async def _m4_open_orders(cx: aiosqlite.Connection) -> None:
+    """
+    Частичные индексы по открытым ордерам вместо (symbol, status)/(status, permId),
+    которые росли вместе с историей; orders_archive для завершённых.
+    """
+    for sql in OPEN_ORDERS_INDEXES:
+        await cx.execute(sql)
+    await cx.execute("DROP INDEX IF EXISTS ix_orders_symbol_status")
+    await cx.execute("DROP INDEX IF EXISTS ix_orders_status_permId")
+    await cx.execute(CREATE_ORDERS_ARCHIVE_SQL)
+    for sql in ORDERS_ARCHIVE_INDEXES:
+        await cx.execute(sql)
+
+
+async def _m5_config_version(cx: aiosqlite.Connection) -> None:
+    """config_version и триггеры на white_list/trade_params (раньше их ставил config_cache.py)."""
+    await cx.execute(CREATE_CONFIG_VERSION_SQL)
+    await cx.execute("INSERT OR IGNORE INTO config_version(id, v) VALUES (1, 0)")
+    for table in CONFIG_TABLES:
+        for sql in version_triggers_sql(table):
+            await cx.execute(sql)
+
+
+MIGRATIONS: Tuple[Tuple[int, str, Migration], ...] = (
+    (1, "base tables", _m1_base),
+    (2, "orders: unified table, unique permId/(clientId, orderId), covering indexes", _m2_orders),
+    (3, "symbols: typed numeric columns", _m3_symbols),
+    (4, "orders: partial open-order indexes, orders_archive", _m4_open_orders),
+    (5, "config_version counter and white_list/trade_params triggers", _m5_config_version),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def _user_version(cx: aiosqlite.Connection) -> int:
+    async with cx.execute("PRAGMA user_version") as cur:
+        return (await cur.fetchone())[0]
+
+
+async def migrate(cx: aiosqlite.Connection) -> int:
+    """Довести схему до SCHEMA_VERSION. Вернёт итоговую версию."""
+    version = await _user_version(cx)
+    if version >= SCHEMA_VERSION:
+        return version
+    if cx.in_transaction:
+        await cx.commit()
+    for target, title, step in MIGRATIONS:
+        if target <= version:
+            continue
+        await cx.execute("BEGIN IMMEDIATE")
+        try:
+            # пока ждали write-лок, другой процесс мог уже мигрировать
+            version = await _user_version(cx)
+            if target <= version:
+                await cx.rollback()
+                continue
+            await step(cx)
+            await cx.execute(f"PRAGMA user_version = {target}")
+            await cx.commit()
+        except BaseException:
+            await cx.rollback()
+            raise
+        version = target
+        log.info("schema: migrated to v%d (%s)", target, title)
+    return version
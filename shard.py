@@ -0,0 +1,57 @@
+# shard.py
+# Раздача тикеров white_list по воркерам supervisor.py — rendezvous-хеш (HRW).
+# Владелец тикера зависит только от (тикер, число воркеров): новые/удалённые
+# тикеры не двигают остальные, при смене числа воркеров переезжает ~1/N.
+import os
+import hashlib
+from typing import Dict, Iterable, List
+
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+
+
+def _score(key: bytes, worker: int) -> int:
+    h = hashlib.blake2b(key, digest_size=8, person=worker.to_bytes(8, "little"))
+    return int.from_bytes(h.digest(), "little")
+
+
+def owner(symbol: str, workers: int = WORKERS) -> int:
+    """Индекс воркера, которому принадлежит тикер (регистр не важен — symbol NOCASE)."""
+    if workers <= 1:
+        return 0
+    key = symbol.upper().encode()
+    return max(range(workers), key=lambda w: _score(key, w))
+
+
+def assign(symbols: Iterable[str], workers: int = WORKERS) -> Dict[int, List[str]]:
+    """{воркер: тикеры} для всего white_list."""
+    out: Dict[int, List[str]] = {w: [] for w in range(max(1, workers))}
+    for sym in symbols:
+        out[owner(sym, workers)].append(sym)
+    return out
+
+
+class Shard:
+    """Своя часть white_list для воркера index из workers (кэш решений по тикеру)."""
+
+    def __init__(self, workers: int = WORKERS, index: int = WORKER_INDEX):
+        if not 0 <= index < max(1, workers):
+            raise ValueError(f"WORKER_INDEX={index} out of range for WORKERS={workers}")
+        self.workers = max(1, workers)
+        self.index = index
+        self._owns: Dict[str, bool] = {}
+
+    @property
+    def sharded(self) -> bool:
+        return self.workers > 1
+
+    def owns(self, symbol: str) -> bool:
+        if self.workers == 1:
+            return True
+        hit = self._owns.get(symbol)
+        if hit is None:
+            hit = self._owns[symbol] = owner(symbol, self.workers) == self.index
+        return hit
+
+    def filter(self, symbols: Iterable[str]) -> List[str]:
+        return [s for s in symbols if self.owns(s)]
@@ -0,0 +1,228 @@
+# snapshot_api.py
+# Состояние движка для Telegram-части без запросов к его SQLite.
+# Движок держит неизменяемый снимок (позиции, открытые ордера, PnL, статус),
+# уже сериализованный в JSON, и отдаёт его по Unix-сокету: строка запроса —
+# имя раздела, ответ — одна строка JSON. Снимок пересобирается по запросу,
+# но не чаще раза в SNAPSHOT_SEC — без клиентов он ничего не стоит.
+# Движок не отвечает (остановлен, перезапускается) — fetch() читает те же
+# разделы из БД отдельным read-only соединением: в WAL читатель не ждёт писателя.
+#
+#   python snapshot_api.py positions
+#   echo pnl | nc -U dca.sock
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import stat
+from typing import Any, Callable, Dict, List, Optional
+
+from schema import OPEN_STATUS_SQL
+from shard import WORKERS
+
+log = logging.getLogger("snapshot_api")
+
+DB_PATH = os.getenv("DB_PATH", "bot.db")
+# "" — не поднимать сокет
+SNAPSHOT_SOCKET = os.getenv("SNAPSHOT_SOCKET", "dca.sock")
+SNAPSHOT_SEC = float(os.getenv("SNAPSHOT_SEC", "1"))
+SNAPSHOT_TIMEOUT = float(os.getenv("SNAPSHOT_TIMEOUT", "2"))
+
+SECTIONS = ("positions", "orders", "pnl", "status")
+
+
+def socket_path(path: str, worker: int = 0, workers: int = WORKERS) -> str:
+    """У воркеров supervisor.py — свой сокет: dca.sock → dca.w1.sock."""
+    if workers <= 1:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.w{worker}{ext}"
+
+
+def pnl_of(positions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Итоги по позициям: стоимость, вложено, нереализованный PnL."""
+    value = sum(p["market_value"] for p in positions)
+    cost = sum(p["qty"] * p["avg_cost"] for p in positions)
+    upnl = sum(p["unrealized_pnl"] for p in positions)
+    return {"positions": len(positions), "market_value": value, "cost_basis": cost,
+            "unrealized_pnl": upnl, "unrealized_pct": upnl / cost * 100.0 if cost else 0.0}
+
+
+def position_row(symbol: str, qty: float, avg: float, last: float) -> Dict[str, Any]:
+    upnl = (last - avg) * qty if last > 0 else 0.0
+    return {"symbol": symbol, "qty": qty, "avg_cost": avg, "last": last,
+            "market_value": qty * last, "unrealized_pnl": upnl,
+            "unrealized_pct": (last / avg - 1.0) * 100.0 if avg > 0 and last > 0 else 0.0}
+
+
+# ---------------------------
+# Сервер (в процессе движка)
+# ---------------------------
+class SnapshotServer:
+    """
+    build() → {раздел: данные} — вызывается на event loop'е движка, только
+    когда снимок старше interval и кто-то его спросил. Каждый раздел
+    сериализуется один раз; все клиенты получают одни и те же байты.
+    """
+
+    def __init__(self, build: Callable[[], Dict[str, Any]], path: str, interval: float = SNAPSHOT_SEC):
+        self.build = build
+        self.path = path
+        self.interval = interval
+        self._encoded: Dict[str, bytes] = {}
+        self._built_at = 0.0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.requests = 0
+        self.builds = 0
+
+    def _current(self) -> Dict[str, bytes]:
+        now = time.monotonic()
+        if not self._encoded or now - self._built_at >= self.interval:
+            snap = self.build()
+            ts = time.time()
+            encoded = {name: json.dumps({"ts": ts, name: data}, default=str).encode() + b"\n"
+                       for name, data in snap.items()}
+            encoded["all"] = json.dumps({"ts": ts, **snap}, default=str).encode() + b"\n"
+            self._encoded, self._built_at = encoded, now
+            self.builds += 1
+        return self._encoded
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # одно соединение — сколько угодно запросов, по строке на каждый
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 30)
+                if not line:
+                    break
+                name = line.decode("utf-8", "replace").strip() or "all"
+                self.requests += 1
+                body = self._current().get(name)
+                if body is None:
+                    body = json.dumps({"error": f"unknown section {name!r}"}).encode() + b"\n"
+                writer.write(body)
+                await writer.drain()
+        except Exception as e:
+            log.debug("snapshot request failed: %s", e)
+        finally:
+            writer.close()
+
+    async def start(self) -> None:
+        if not self.path or self._server is not None:
+            return
+        await _claim(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, self.path)
+        os.chmod(self.path, 0o600)
+        log.info("snapshot API on %s", self.path)
+
+    async def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+async def _claim(path: str) -> None:
+    """
+    Сокет от прошлого запуска (процесс убили) — bind на нём упадёт, удаляем.
+    Но только мёртвый сокет: если на нём кто-то отвечает — это второй движок
+    с тем же SNAPSHOT_SOCKET/шардом, стартовать не даём; не сокет — не трогаем.
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise RuntimeError(f"{path} exists and is not a socket, refusing to remove it")
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_unix_connection(path), 1.0)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+        return
+    except (OSError, asyncio.TimeoutError) as e:
+        raise RuntimeError(f"{path}: cannot tell whether the socket is in use ({e})")
+    writer.close()
+    raise RuntimeError(f"{path} is served by another process (second engine for this shard?)")
+
+
+# ---------------------------
+# Клиент (Telegram-часть, утилиты)
+# ---------------------------
+async def _ask(path: str, section: str, timeout: float) -> Dict[str, Any]:
+    reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(path), timeout)
+    try:
+        writer.write(section.encode() + b"\n")
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), timeout)
+    finally:
+        writer.close()
+    if not line:
+        raise ConnectionError(f"{path}: empty reply")
+    return json.loads(line)
+
+
+def read_db_snapshot(db_path: str = DB_PATH) -> Dict[str, Any]:
+    """
+    Запасной путь: positions и открытые ордера из БД. Соединение read-only
+    (mode=ro, query_only) — писать не может и write-лок не берёт.
+    """
+    cx = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=1.0)
+    try:
+        cx.execute("PRAGMA query_only=ON")
+        positions = [position_row(s, q or 0.0, a or 0.0, l or 0.0) for s, q, a, l in cx.execute(
+            "SELECT symbol, qty, avg_cost, last FROM positions WHERE qty != 0 ORDER BY symbol")]
+        cx.row_factory = sqlite3.Row
+        orders = [dict(r) for r in cx.execute(
+            f"SELECT orderId, permId, symbol, action, orderType, lmtPrice, status, filled, remaining, "
+            f"avgFillPrice, updated_at FROM orders WHERE {OPEN_STATUS_SQL} ORDER BY symbol")]
+    finally:
+        cx.close()
+    return {"positions": positions, "orders": orders, "pnl": pnl_of(positions),
+            "status": {"source": "db"}}
+
+
+def _merge(replies: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Ответы «all» от воркеров → один снимок; PnL пересчитываем по всем позициям."""
+    positions = sorted((row for r in replies for row in r["positions"]), key=lambda row: row["symbol"])
+    orders = sorted((row for r in replies for row in r["orders"]), key=lambda row: row["symbol"])
+    return {"ts": min(r["ts"] for r in replies), "positions": positions, "orders": orders,
+            "pnl": pnl_of(positions), "status": [r["status"] for r in replies]}
+
+
+async def fetch(section: str = "all", path: str = SNAPSHOT_SOCKET, workers: int = WORKERS,
+                db_path: str = DB_PATH, timeout: float = SNAPSHOT_TIMEOUT) -> Dict[str, Any]:
+    """
+    Раздел (или all) со всех воркеров, слитый в один ответ. Хоть один сокет
+    не ответил — весь ответ из БД (source=db), чтобы не смешивать источники.
+    """
+    if section not in SECTIONS and section != "all":
+        raise ValueError(f"unknown section {section!r}")
+    sections = SECTIONS if section == "all" else (section,)
+    try:
+        if workers <= 1:
+            snap = await _ask(path, section, timeout)
+        else:
+            snap = _merge(await asyncio.gather(*(_ask(socket_path(path, w, workers), "all", timeout)
+                                                 for w in range(workers))))
+        return {"ts": snap["ts"], "source": "engine", **{name: snap[name] for name in sections}}
+    except (OSError, asyncio.TimeoutError, ValueError, KeyError) as e:
+        log.debug("snapshot socket unavailable (%s), reading DB", e)
+    snap = await asyncio.get_running_loop().run_in_executor(None, read_db_snapshot, db_path)
+    return {"ts": time.time(), "source": "db", **{name: snap[name] for name in sections}}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    section = argv[0] if argv else "all"
+    print(json.dumps(asyncio.run(fetch(section)), indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
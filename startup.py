@@ -0,0 +1,109 @@
+# startup.py
+# Быстрый старт движка: последнее состояние из SQLite поднимается сразу,
+# начальные сверки с IB идут параллельно, а тикер начинает торговать, как
+# только по нему самому всё сверено (Readiness), не дожидаясь остальных.
+# Длительности фаз старта — в лог и в метрики (StartupTimer).
+import time
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import metrics
+
+log = logging.getLogger("startup")
+
+
+class StartupTimer:
+    """Фазы старта могут перекрываться: для каждой — (начало от старта, длительность)."""
+
+    def __init__(self):
+        self.t0 = time.monotonic()
+        self.phases: Dict[str, Tuple[float, float]] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = (started - self.t0, time.monotonic() - started)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.t0
+
+    def report(self) -> None:
+        parts = [f"{name}={dur * 1e3:.0f}ms@{start * 1e3:.0f}" for name, (start, dur) in self.phases.items()]
+        log.info("startup: %s; total %.2fs", " ".join(parts), self.elapsed())
+        for name, (_, dur) in self.phases.items():
+            metrics.gauge("startup_phase_seconds", dur, phase=name)
+
+
+class Readiness:
+    """
+    Тикер готов к торговле, когда (1) сверены открытые ордера (один запрос
+    на все тикеры), (2) позиция подтверждена из IB и (3) пришла цена.
+    Восстановленное из БД состояние до этого только показывается, не торгуется.
+    on_ready(symbol) — тикер только что стал готов (разбудить оценку).
+    """
+
+    def __init__(self, on_ready: Optional[Callable[[str], None]] = None):
+        self.on_ready = on_ready
+        self.t0 = time.monotonic()
+        self.orders_synced = False
+        self._confirmed: Set[str] = set()
+        self._priced: Set[str] = set()
+        self.ready: Set[str] = set()
+        self._expected: Set[str] = set()
+        self.first_ready_after: Optional[float] = None
+        self.all_ready_after: Optional[float] = None
+
+    def expect(self, symbols: Iterable[str]) -> None:
+        """Тикеры старта — по ним считаем «все готовы»."""
+        self._expected = set(symbols)
+        self.t0 = time.monotonic()
+
+    def is_ready(self, symbol: str) -> bool:
+        return symbol in self.ready
+
+    def filter(self, symbols: List[str]) -> List[str]:
+        ready = self.ready
+        return [s for s in symbols if s in ready]
+
+    # ---------- события ----------
+    def set_orders_synced(self) -> None:
+        if not self.orders_synced:
+            self.orders_synced = True
+            for sym in self._confirmed & self._priced:
+                self._check(sym)
+
+    def confirm(self, symbols: Iterable[str]) -> None:
+        for sym in symbols:
+            if sym not in self._confirmed:
+                self._confirmed.add(sym)
+                self._check(sym)
+
+    def priced(self, symbol: str) -> None:
+        if symbol not in self._priced:
+            self._priced.add(symbol)
+            self._check(symbol)
+
+    def _check(self, sym: str) -> None:
+        if sym in self.ready or not self.orders_synced:
+            return
+        if sym not in self._confirmed or sym not in self._priced:
+            return
+        self.ready.add(sym)
+        now = time.monotonic() - self.t0
+        if self.first_ready_after is None:
+            self.first_ready_after = now
+            log.info("startup: first symbol ready (%s) after %.2fs", sym, now)
+        if self.all_ready_after is None and self._expected and self._expected <= self.ready:
+            self.all_ready_after = now
+            log.info("startup: all %d symbols ready after %.2fs", len(self._expected), now)
+            metrics.gauge("startup_all_ready_seconds", now)
+        if self.on_ready is not None:
+            self.on_ready(sym)
+
+    def pending(self) -> List[str]:
+        """Ожидаемые тикеры, которые ещё не готовы."""
+        return sorted(self._expected - self.ready)
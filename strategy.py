@@ -0,0 +1,118 @@
+# strategy.py
+# Чистая стадия решений DCA/TP: без IB и без БД.
+# На вход — массивы qty/avg_cost/last/флаги по всем тикерам, на выход —
+# намерения (первая покупка, докупка, тейк-профит, пропуск + причина)
+# за один проход NumPy. Исполняет их engine.execute_action.
+from typing import List, NamedTuple, Sequence, Union
+
+import numpy as np
+
+# Что делать с тикером
+SKIP, FIRST_BUY, DCA_BUY, TP_SELL = 0, 1, 2, 3
+KIND_NAMES = {SKIP: "SKIP", FIRST_BUY: "FIRST_BUY", DCA_BUY: "DCA_BUY", TP_SELL: "TP_SELL"}
+
+# Почему пропуск
+R_NONE, R_OPEN_ORDER, R_NO_ROW, R_NO_LAST, R_INVALID, R_TP_NOTHING, R_HOLD = range(7)
+REASON_NAMES = {
+    R_NONE: "",
+    R_OPEN_ORDER: "open_order",
+    R_NO_ROW: "no_position_row",
+    R_NO_LAST: "no_last",
+    R_INVALID: "avg_last_invalid",
+    R_TP_NOTHING: "tp_nothing_to_sell",
+    R_HOLD: "hold",
+}
+
+# первая заявка — на «тик» ниже last
+FIRST_BUY_DISCOUNT = 0.999
+
+Num = Union[float, np.ndarray]
+
+
+class Decisions(NamedTuple):
+    kind: np.ndarray     # int8, SKIP/FIRST_BUY/DCA_BUY/TP_SELL
+    reason: np.ndarray   # int8, R_* (для SKIP)
+    qty: np.ndarray      # float64, объём заявки
+    limit: np.ndarray    # float64, лимитная цена
+
+
+class Action(NamedTuple):
+    symbol: str
+    kind: int
+    reason: int
+    qty: float
+    limit: float
+    pos_qty: float
+    avg: float
+    last: float
+
+
+def decide_arrays(qty: np.ndarray, avg: np.ndarray, last: np.ndarray,
+                  has_open: np.ndarray, known: np.ndarray,
+                  base_qty: Num, dca_pct: Num, tp_pct: Num) -> Decisions:
+    """
+    Правила dca_loop в векторном виде (параметры — скаляры или массивы той же длины):
+      * есть открытый ордер → пропуск;
+      * нет строки позиции → пропуск (создаст reconcile);
+      * qty <= 0 → первая покупка на last*0.999, если last > 0;
+      * last <= avg*(1-dca) → докупка на last;
+      * last >= avg*(1+tp) → продажа min(base, floor(qty)) на last.
+    """
+    qty = np.asarray(qty, dtype=np.float64)
+    avg = np.asarray(avg, dtype=np.float64)
+    last = np.asarray(last, dtype=np.float64)
+    has_open = np.asarray(has_open, dtype=bool)
+    known = np.asarray(known, dtype=bool)
+    n = qty.shape[0]
+
+    kind = np.zeros(n, dtype=np.int8)
+    reason = np.full(n, R_HOLD, dtype=np.int8)
+    out_qty = np.zeros(n, dtype=np.float64)
+    limit = np.zeros(n, dtype=np.float64)
+    base = np.broadcast_to(np.asarray(base_qty, dtype=np.float64), (n,))
+
+    free = ~has_open & known
+    has_last = last > 0
+
+    first = free & (qty <= 0)
+    first_ok = first & has_last
+
+    held = free & (qty > 0)
+    valid = held & (avg > 0) & has_last
+    dca = valid & (last <= avg * (1 - dca_pct))
+    tp = valid & ~dca & (last >= avg * (1 + tp_pct))
+    sell_qty = np.minimum(base, np.floor(qty))
+    tp_ok = tp & (sell_qty > 0)
+
+    reason[has_open] = R_OPEN_ORDER
+    reason[~has_open & ~known] = R_NO_ROW
+    reason[first & ~has_last] = R_NO_LAST
+    reason[held & ~valid] = R_INVALID
+    reason[tp & ~tp_ok] = R_TP_NOTHING
+
+    buy = first_ok | dca
+    kind[first_ok] = FIRST_BUY
+    kind[dca] = DCA_BUY
+    kind[tp_ok] = TP_SELL
+    reason[buy | tp_ok] = R_NONE
+
+    out_qty[buy] = base[buy]
+    out_qty[tp_ok] = sell_qty[tp_ok]
+    limit[first_ok] = np.round(last[first_ok] * FIRST_BUY_DISCOUNT, 2)
+    limit[dca | tp_ok] = np.round(last[dca | tp_ok], 2)
+    return Decisions(kind, reason, out_qty, limit)
+
+
+def decide(symbols: Sequence[str], qty: np.ndarray, avg: np.ndarray, last: np.ndarray,
+           has_open: np.ndarray, known: np.ndarray,
+           base_qty: Num, dca_pct: Num, tp_pct: Num) -> List[Action]:
+    """decide_arrays + упаковка в список Action (по одному на тикер)."""
+    qty = np.asarray(qty, dtype=np.float64)
+    avg = np.asarray(avg, dtype=np.float64)
+    last = np.asarray(last, dtype=np.float64)
+    d = decide_arrays(qty, avg, last, has_open, known, base_qty, dca_pct, tp_pct)
+    return [
+        Action(sym, int(k), int(r), float(q), float(lm), float(pq), float(a), float(lp))
+        for sym, k, r, q, lm, pq, a, lp in zip(
+            symbols, d.kind, d.reason, d.qty, d.limit, qty, avg, last)
+    ]
@@ -0,0 +1,254 @@
+# supervisor.py
+# Движок в WORKERS процессах: у каждого свой IB clientId (IB_CLIENT_ID + индекс),
+# свой dca_loop и своя часть white_list (shard.py — rendezvous-хеш, новые тикеры
+# достаются воркеру сами, без пересборки). Воркеры раз в WORKER_STATUS_SEC шлют
+# engine.status() в очередь; supervisor сводит их в лог и перезапускает упавших.
+# Общий SQLite: WAL + busy_timeout + повтор транзакций при busy (dbpool.retry_busy).
+#
+#   WORKERS=4 python supervisor.py
+import os
+import time
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing as mp
+from typing import Dict, List, Optional
+
+from config_cache import get_config
+from dbpool import get_pool
+from logsetup import setup_logging
+from schema import migrate
+from shard import WORKERS, assign
+
+log = logging.getLogger("supervisor")
+
+DB_PATH = os.getenv("DB_PATH", "bot.db")
+IB_CLIENT_ID = int(os.getenv("IB_CLIENT_ID", "103"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+SUPERVISOR_STATUS_SEC = float(os.getenv("SUPERVISOR_STATUS_SEC", "30"))
+WORKER_STATUS_SEC = float(os.getenv("WORKER_STATUS_SEC", "5"))
+# воркер, проживший меньше WORKER_MIN_UPTIME, перезапускаем с растущей паузой
+WORKER_MIN_UPTIME = float(os.getenv("WORKER_MIN_UPTIME", "60"))
+WORKER_RESTART_MAX = float(os.getenv("WORKER_RESTART_MAX", "60"))
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", "15"))
+
+
+# ---------------------------
+# Воркер (дочерний процесс)
+# ---------------------------
+def _worker(index: int, status_q: mp.Queue) -> None:
+    # WORKERS/WORKER_INDEX/IB_CLIENT_ID уже в окружении — см. Worker.start()
+    setup_logging(worker=index)
+    import engine
+    try:
+        asyncio.run(_worker_main(engine, status_q))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_main(engine, status_q: mp.Queue) -> None:
+    async def report():
+        while True:
+            await asyncio.sleep(WORKER_STATUS_SEC)
+            try:
+                status_q.put_nowait({"pid": os.getpid(), "ts": time.time(), **engine.status()})
+            except queue.Full:
+                pass
+
+    task = asyncio.ensure_future(report())
+    try:
+        await engine.main()
+    finally:
+        task.cancel()
+
+
+class Worker:
+    def __init__(self, index: int, workers: int, status_q: mp.Queue):
+        self.index = index
+        self.workers = workers
+        self.status_q = status_q
+        self.client_id = IB_CLIENT_ID + index
+        self.proc: Optional[mp.Process] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.backoff = 1.0
+        self.next_start = 0.0
+        self.status: dict = {}
+
+    def env(self) -> Dict[str, str]:
+        env = {"WORKERS": str(self.workers), "WORKER_INDEX": str(self.index),
+               "IB_CLIENT_ID": str(self.client_id), "DB_PATH": DB_PATH}
+        if METRICS_PORT:
+            env["METRICS_PORT"] = str(METRICS_PORT + self.index)
+        return env
+
+    def start(self) -> None:
+        # модули читают env при импорте, а spawn-ребёнок импортирует их заново —
+        # окружение воркера выставляем на время start(), ребёнок получит копию
+        env = self.env()
+        saved = {k: os.environ.get(k) for k in env}
+        os.environ.update(env)
+        try:
+            self.proc = mp.get_context("spawn").Process(
+                target=_worker, args=(self.index, self.status_q), name=f"dca-w{self.index}", daemon=False)
+            self.proc.start()
+        finally:
+            for k, v in saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+        self.started_at = time.monotonic()
+        self.status = {}
+        log.info("worker %d started (pid=%s, clientId=%d)", self.index, self.proc.pid, self.client_id)
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.is_alive()
+
+    def check(self) -> None:
+        """Упал — перезапустить (с backoff, если падает сразу после старта)."""
+        if self.alive:
+            if time.monotonic() - self.started_at >= WORKER_MIN_UPTIME:
+                self.backoff = 1.0
+            return
+        now = time.monotonic()
+        if self.proc is not None:
+            code = self.proc.exitcode
+            self.proc = None
+            self.restarts += 1
+            if now - self.started_at < WORKER_MIN_UPTIME:
+                self.next_start = now + self.backoff
+                self.backoff = min(self.backoff * 2, WORKER_RESTART_MAX)
+            log.error("worker %d exited (code=%s), restart in %.0fs",
+                      self.index, code, max(0.0, self.next_start - now))
+        if now >= self.next_start:
+            self.start()
+
+    def stop(self) -> None:
+        """SIGINT — движок допишет буфер и закроет соединения; не успел — terminate."""
+        if self.alive:
+            os.kill(self.proc.pid, signal.SIGINT)
+
+    def join(self, timeout: float) -> None:
+        if self.proc is None:
+            return
+        self.proc.join(timeout)
+        if self.proc.is_alive():
+            log.error("worker %d did not stop in %.0fs, terminating", self.index, timeout)
+            self.proc.terminate()
+            self.proc.join(5)
+
+
+# ---------------------------
+# Supervisor
+# ---------------------------
+def _drain(status_q: mp.Queue, workers: List[Worker]) -> None:
+    while True:
+        try:
+            st = status_q.get_nowait()
+        except queue.Empty:
+            return
+        w = st.get("worker")
+        if isinstance(w, int) and 0 <= w < len(workers):
+            workers[w].status = st
+
+
+def summary(workers: List[Worker]) -> dict:
+    """Сводное состояние по всем воркерам."""
+    per = []
+    for w in workers:
+        st = w.status
+        per.append({"worker": w.index, "alive": w.alive, "pid": w.proc.pid if w.proc else None,
+                    "client_id": w.client_id, "restarts": w.restarts,
+                    "symbols": st.get("symbols"), "cycles": st.get("cycles"),
+                    "errors": st.get("errors"), "ib_connected": st.get("ib_connected"),
+                    "open_orders": st.get("open_orders"), "orders_in_flight": st.get("orders_in_flight"),
+                    "last_cycle_seconds": st.get("last_cycle_seconds")})
+
+    def total(key):
+        return sum(p[key] or 0 for p in per)
+
+    return {"workers": len(workers), "alive": sum(1 for p in per if p["alive"]),
+            "ib_connected": total("ib_connected"), "symbols": total("symbols"),
+            "open_orders": total("open_orders"), "errors": total("errors"), "per_worker": per}
+
+
+def _log_summary(s: dict) -> None:
+    log.info("workers %d/%d alive, IB %d/%d connected, %d symbols, %d open orders, %d cycle errors",
+             s["alive"], s["workers"], s["ib_connected"], s["workers"], s["symbols"],
+             s["open_orders"], s["errors"])
+    for p in s["per_worker"]:
+        last = p["last_cycle_seconds"]
+        log.info("  w%d pid=%s clientId=%d symbols=%s cycles=%s last_cycle=%s restarts=%d",
+                 p["worker"], p["pid"], p["client_id"], p["symbols"], p["cycles"],
+                 f"{last * 1e3:.0f}ms" if last is not None else "-", p["restarts"])
+
+
+def _log_assignment(pairs: List[str], prev: Optional[List[str]], workers: int) -> None:
+    shards = assign(pairs, workers)
+    sizes = "/".join(str(len(shards[w])) for w in range(workers))
+    if prev is None:
+        log.info("white_list: %d symbols over %d workers (%s)", len(pairs), workers, sizes)
+        return
+    added = sorted(set(pairs) - set(prev))
+    removed = sorted(set(prev) - set(pairs))
+    log.info("white_list changed: +%d -%d symbols, now %s", len(added), len(removed), sizes)
+    for w in range(workers):
+        owned = set(shards[w])
+        mine = [s for s in added if s in owned]
+        if mine:
+            log.info("  w%d takes %s", w, ", ".join(mine))
+
+
+async def supervise(n: int = WORKERS) -> None:
+    n = max(1, n)
+    # схему доводим один раз здесь, а не наперегонки в N воркерах
+    pool = get_pool(DB_PATH)
+    async with pool.acquire() as cx:
+        await migrate(cx)
+    await pool.close()
+
+    config = get_config(DB_PATH)
+    await config.refresh()
+    pairs = config.pairs()
+    _log_assignment(pairs, None, n)
+
+    status_q: mp.Queue = mp.get_context("spawn").Queue(maxsize=1000)
+    workers = [Worker(i, n, status_q) for i in range(n)]
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    next_status = time.monotonic() + SUPERVISOR_STATUS_SEC
+    try:
+        while not stop.is_set():
+            _drain(status_q, workers)
+            for w in workers:
+                w.check()
+            if time.monotonic() >= next_status:
+                next_status = time.monotonic() + SUPERVISOR_STATUS_SEC
+                if await config.refresh():
+                    _log_assignment(config.pairs(), pairs, n)
+                    pairs = config.pairs()
+                _log_summary(summary(workers))
+            try:
+                await asyncio.wait_for(stop.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        log.info("stopping %d workers", n)
+        for w in workers:
+            w.stop()
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for w in workers:
+            await loop.run_in_executor(None, w.join, max(0.0, deadline - time.monotonic()))
+        await config.close()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(supervise())
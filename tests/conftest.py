@@ -0,0 +1,6 @@
+# conftest.py
+# Модули бота лежат в корне репозитория — тесты импортируют их как есть.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
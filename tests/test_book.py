@@ -0,0 +1,72 @@
+# test_book.py
+# LiveBook.unsettled: исполнение держит тикер, пока позиция его не отразит.
+import time
+
+from ib_insync import LimitOrder, OrderStatus, Stock, Trade
+
+from book import LiveBook
+
+
+def trade(status, filled, qty=10, perm_id=7, action="BUY"):
+    order = LimitOrder(action, qty, 100.0, orderId=1, clientId=5, permId=perm_id)
+    return Trade(Stock("AAA", "SMART", "USD"), order,
+                 OrderStatus(orderId=1, status=status, filled=filled, remaining=qty - filled))
+
+
+def book_with_position(qty=0.0):
+    book = LiveBook()
+    book.set_position("AAA", qty, 100.0)
+    return book
+
+
+def test_fill_holds_until_position_catches_up():
+    book = book_with_position()
+    book.apply_trade(trade("Submitted", 0))
+    book.apply_trade(trade("Filled", 10))
+    assert book.settling("AAA") and book.busy("AAA")
+    book.set_position("AAA", 10.0, 100.0)
+    assert not book.busy("AAA")
+
+
+def test_position_before_filled_is_cleared_by_next_update():
+    book = book_with_position()
+    book.apply_trade(trade("Submitted", 0))
+    book.set_position("AAA", 10.0, 100.0)       # positionEvent раньше Filled
+    book.apply_trade(trade("Filled", 10))
+    assert book.settling("AAA")
+    book.take_dirty()
+    book.set_position("AAA", 10.0, 100.0)       # тот же qty, но снят после исполнения
+    assert not book.settling("AAA")
+    assert "AAA" in book.take_dirty()            # тикер освободился — оценить заново
+
+
+def test_snapshot_requested_before_fill_only_covers_its_shift():
+    book = book_with_position()
+    asof = time.monotonic()
+    book.apply_trade(trade("Submitted", 0))
+    book.apply_trade(trade("Submitted", 4))
+    book.apply_trade(trade("Filled", 10))
+    book.set_position("AAA", 0.0, 100.0, asof=asof)
+    assert book.unsettled[book.index("AAA")] == 10
+    book.set_position("AAA", 4.0, 100.0, asof=asof)
+    assert book.unsettled[book.index("AAA")] == 6
+    book.set_position("AAA", 10.0, 100.0, asof=asof)
+    assert not book.settling("AAA")
+
+
+def test_first_seen_fill_is_not_counted():
+    book = book_with_position(10.0)
+    # старт/reconcile: ордер впервые виден уже исполненным
+    book.apply_trade(trade("Filled", 10))
+    assert not book.settling("AAA")
+    book.apply_trade(trade("Submitted", 4, perm_id=8))
+    book.apply_trade(trade("Filled", 10, perm_id=8))
+    assert book.unsettled[book.index("AAA")] == 6
+
+
+def test_live_fill_on_first_seen_order_is_counted():
+    book = book_with_position()
+    book.apply_trade(trade("Filled", 10, action="SELL"), live=True)
+    assert book.unsettled[book.index("AAA")] == -10
+    book.set_position("AAA", -10.0, 100.0)
+    assert not book.busy("AAA")
@@ -0,0 +1,38 @@
+# test_logsetup.py
+# Запись проходит через очередь: JSON-поле "exc" на месте, msg без traceback.
+import json
+import logging
+import queue
+import sys
+
+from logsetup import JsonFormatter, _QueueHandler
+
+
+def _through_queue(record):
+    q = queue.SimpleQueue()
+    _QueueHandler(q).handle(record)
+    return q.get_nowait()
+
+
+def _record(exc_info=None):
+    return logging.LogRecord("x", logging.ERROR, __file__, 1, "[%s] boom", ("AAPL",), exc_info)
+
+
+def test_exception_survives_queue_as_json_exc():
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        record = _through_queue(_record(sys.exc_info()))
+    assert record.exc_info is None
+    out = json.loads(JsonFormatter({"worker": 1}).format(record))
+    assert out["msg"] == "[AAPL] boom"
+    assert out["exc"].startswith("Traceback") and "ZeroDivisionError" in out["exc"]
+    assert out["worker"] == 1
+    # текстовый формат по-прежнему печатает traceback после сообщения
+    text = logging.Formatter("%(levelname)s:%(message)s").format(record)
+    assert text.startswith("ERROR:[AAPL] boom\nTraceback")
+
+
+def test_record_without_exception_has_no_exc():
+    out = json.loads(JsonFormatter().format(_through_queue(_record())))
+    assert out["msg"] == "[AAPL] boom" and "exc" not in out
@@ -0,0 +1,176 @@
+# test_schema.py
+# migrate() на bot.db из старой схемы и повторный прогон; сверка Killed.
+import asyncio
+import os
+import shutil
+import sqlite3
+
+import aiosqlite
+import pytest
+
+import schema
+
+LEGACY_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot.db")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _migrate(path: str) -> int:
+    cx = await aiosqlite.connect(path)
+    try:
+        return await schema.migrate(cx)
+    finally:
+        await cx.close()
+
+
+def _dump(path: str):
+    cx = sqlite3.connect(path)
+    try:
+        objects = cx.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name").fetchall()
+        orders = cx.execute("SELECT * FROM orders ORDER BY id").fetchall()
+        return objects, orders
+    finally:
+        cx.close()
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    path = str(tmp_path / "bot.db")
+    shutil.copy(LEGACY_DB, path)
+    return path
+
+
+def test_migrate_legacy_db(legacy_db):
+    before = sqlite3.connect(legacy_db)
+    legacy = before.execute("SELECT orderId, permId, symbol, status FROM orders ORDER BY id").fetchall()
+    before.close()
+
+    assert run(_migrate(legacy_db)) == schema.SCHEMA_VERSION
+
+    cx = sqlite3.connect(legacy_db)
+    try:
+        assert cx.execute("PRAGMA user_version").fetchone()[0] == schema.SCHEMA_VERSION
+        cols = [r[1] for r in cx.execute("PRAGMA table_info(orders)")]
+        assert cols[1:] == list(schema.ORDER_COLUMNS)
+        indexes = {r[1] for r in cx.execute("PRAGMA index_list(orders)")}
+        assert {"ux_orders_permId", "ux_orders_client_orderId", "ix_orders_open_symbol"} <= indexes
+        assert "ux_orders_orderId" not in indexes
+        # строки и IB-ключи на месте, clientId старым строкам не известен
+        rows = cx.execute("SELECT orderId, permId, symbol, status, clientId FROM orders ORDER BY id").fetchall()
+        assert [r[:4] for r in rows] == legacy
+        assert all(r[4] is None for r in rows)
+        created = cx.execute("SELECT DISTINCT typeof(created_at) FROM orders").fetchall()
+        assert created == [("integer",)]
+        # триггеры config_version
+        v0 = cx.execute("SELECT v FROM config_version").fetchone()[0]
+        cx.execute("INSERT INTO white_list(pair) VALUES('ZZZZ')")
+        assert cx.execute("SELECT v FROM config_version").fetchone()[0] == v0 + 1
+        assert "orders_archive" in {r[0] for r in cx.execute("SELECT name FROM sqlite_master")}
+    finally:
+        cx.close()
+
+
+def test_migrate_is_idempotent(legacy_db):
+    run(_migrate(legacy_db))
+    first = _dump(legacy_db)
+    assert run(_migrate(legacy_db)) == schema.SCHEMA_VERSION
+    assert _dump(legacy_db) == first
+
+
+def test_migrate_empty_db(tmp_path):
+    path = str(tmp_path / "new.db")
+    assert run(_migrate(path)) == schema.SCHEMA_VERSION
+    first = _dump(path)
+    run(_migrate(path))
+    assert _dump(path) == first
+
+
+def test_upsert_keys_by_client_and_order_id(tmp_path):
+    path = str(tmp_path / "new.db")
+    run(_migrate(path))
+    sql = schema.upsert_order_sql(("orderId", "clientId", "permId", "symbol", "status"))
+    cx = sqlite3.connect(path)
+    try:
+        # один orderId у двух клиентов — два ордера; permId потом догоняет свою строку
+        cx.execute(sql, (1, 103, None, "AAA", "PendingSubmit"))
+        cx.execute(sql, (1, 104, None, "BBB", "PendingSubmit"))
+        cx.execute(sql, (1, 103, 555, "AAA", "Submitted"))
+        cx.execute(sql, (1, 104, 556, "BBB", "Filled"))
+        rows = cx.execute("SELECT orderId, clientId, permId, symbol, status FROM orders ORDER BY id").fetchall()
+    finally:
+        cx.close()
+    assert rows == [(1, 103, 555, "AAA", "Submitted"), (1, 104, 556, "BBB", "Filled")]
+
+
+# ---------------------------
+# kill_missing_open_orders
+# ---------------------------
+ORDERS = [
+    # orderId, clientId, permId, symbol, status
+    (1, 103, 501, "AAA", "Submitted"),        # жив по permId
+    (2, 103, None, "BBB", "PendingSubmit"),   # жив по (clientId, orderId)
+    (2, 104, None, "CCC", "PendingSubmit"),   # тот же orderId у другого клиента — убит
+    (3, None, None, "DDD", "Submitted"),      # старая строка без clientId — жива по orderId
+    (4, 103, 504, "EEE", "Submitted"),        # нет в IB — убит
+    (5, 103, 505, "FFF", "Filled"),           # не открыт — не трогаем
+    (6, 103, None, "GGG", "Submitted"),       # нет в IB, без permId
+]
+
+
+async def _kill(path, perm_ids, order_ids=None, symbols=None):
+    cx = await aiosqlite.connect(path)
+    try:
+        n = await schema.kill_missing_open_orders(cx, perm_ids, order_ids, symbols)
+        await cx.commit()
+        rows = await cx.execute_fetchall("SELECT symbol, status FROM orders ORDER BY id")
+        return n, dict(rows)
+    finally:
+        await cx.close()
+
+
+@pytest.fixture
+def orders_db(tmp_path):
+    path = str(tmp_path / "orders.db")
+    run(_migrate(path))
+    cx = sqlite3.connect(path)
+    cx.executemany("INSERT INTO orders(orderId, clientId, permId, symbol, status) VALUES(?,?,?,?,?)", ORDERS)
+    cx.commit()
+    cx.close()
+    return path
+
+
+def test_kill_missing_by_perm_and_client_order(orders_db):
+    n, status = run(_kill(orders_db, [501, None, 0], [(103, 2), (103, 3), (103, None)]))
+    assert n == 3
+    assert status == {"AAA": "Submitted", "BBB": "PendingSubmit", "CCC": "Killed", "DDD": "Submitted",
+                      "EEE": "Killed", "FFF": "Filled", "GGG": "Killed"}
+
+
+def test_kill_missing_perm_only_keeps_rows_without_perm(orders_db):
+    n, status = run(_kill(orders_db, [501]))
+    assert n == 1
+    assert status["EEE"] == "Killed"
+    assert {status[s] for s in ("BBB", "CCC", "DDD", "GGG")} == {"PendingSubmit", "Submitted"}
+
+
+def test_kill_missing_scoped_by_symbols(orders_db):
+    n, status = run(_kill(orders_db, [], [], symbols=["eee", "GGG"]))
+    assert n == 2
+    assert status["EEE"] == status["GGG"] == "Killed"
+    assert status["CCC"] == "PendingSubmit"
+
+
+def test_kill_missing_reuses_temp_tables(orders_db):
+    # второй вызов на том же соединении не видит ключей первого
+    async def twice():
+        cx = await aiosqlite.connect(orders_db)
+        try:
+            first = await schema.kill_missing_open_orders(cx, [501, 504], [(103, 2), (104, 2), (103, 6), (0, 3)])
+            n = await schema.kill_missing_open_orders(cx, [501], [(103, 2), (104, 2), (103, 6), (0, 3)])
+            return first, n
+        finally:
+            await cx.close()
+    first, n = run(twice())
+    assert first == 0 and n == 1
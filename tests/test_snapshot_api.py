@@ -0,0 +1,57 @@
+# test_snapshot_api.py
+# SnapshotServer.start: мёртвый сокет удаляется, живой и чужой файл — нет.
+import asyncio
+import socket
+
+import pytest
+
+from snapshot_api import SnapshotServer, _ask
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+def server(path):
+    return SnapshotServer(lambda: {"positions": []}, str(path), interval=0)
+
+
+def test_start_replaces_stale_socket(tmp_path):
+    path = tmp_path / "dca.sock"
+    dead = socket.socket(socket.AF_UNIX)
+    dead.bind(str(path))
+    dead.close()          # файл остался, никто не слушает
+
+    async def go():
+        srv = server(path)
+        await srv.start()
+        try:
+            return await _ask(str(path), "positions", 1.0)
+        finally:
+            await srv.stop()
+    assert run(go())["positions"] == []
+    assert not path.exists()
+
+
+def test_start_refuses_live_socket(tmp_path):
+    path = tmp_path / "dca.sock"
+
+    async def go():
+        first = server(path)
+        await first.start()
+        try:
+            with pytest.raises(RuntimeError, match="another process"):
+                await server(path).start()
+            # первый сервер продолжает отвечать
+            return await _ask(str(path), "positions", 1.0)
+        finally:
+            await first.stop()
+    assert run(go())["positions"] == []
+
+
+def test_start_keeps_non_socket_file(tmp_path):
+    path = tmp_path / "dca.sock"
+    path.write_text("not a socket")
+    with pytest.raises(RuntimeError, match="not a socket"):
+        run(server(path).start())
+    assert path.read_text() == "not a socket"
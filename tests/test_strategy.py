@@ -0,0 +1,79 @@
+# test_strategy.py
+# decide_arrays() против прежней скалярной логики evaluate_symbol из engine.py.
+import math
+
+import numpy as np
+import pytest
+
+from strategy import (DCA_BUY, FIRST_BUY, R_HOLD, R_INVALID, R_NO_LAST, R_NO_ROW, R_NONE,
+                      R_OPEN_ORDER, R_TP_NOTHING, SKIP, TP_SELL, decide, decide_arrays)
+
+
+def scalar(qty, avg, last, has_open, known, base, dca_pct, tp_pct):
+    """Ветки старого evaluate_symbol (ордер считаем выставленным) → (kind, reason, qty, limit)."""
+    if has_open:
+        return SKIP, R_OPEN_ORDER, 0.0, 0.0
+    if not known:
+        return SKIP, R_NO_ROW, 0.0, 0.0
+    if qty <= 0:
+        if not last or last <= 0:
+            return SKIP, R_NO_LAST, 0.0, 0.0
+        return FIRST_BUY, R_NONE, base, round(last * 0.999, 2)
+    if avg <= 0 or last <= 0:
+        return SKIP, R_INVALID, 0.0, 0.0
+    if last <= avg * (1 - dca_pct):
+        return DCA_BUY, R_NONE, base, round(last, 2)
+    if last >= avg * (1 + tp_pct) and qty > 0:
+        sell_qty = min(base, math.floor(qty))
+        if sell_qty <= 0:
+            return SKIP, R_TP_NOTHING, 0.0, 0.0
+        return TP_SELL, R_NONE, float(sell_qty), round(last, 2)
+    return SKIP, R_HOLD, 0.0, 0.0
+
+
+def _random_rows(rng: np.random.Generator, n: int):
+    avg = np.round(rng.uniform(1, 200, n), 2)
+    # last около avg, чтобы DCA/TP/удержание встречались одинаково часто
+    last = np.round(avg * rng.uniform(0.9, 1.1, n), 2)
+    qty = rng.choice([0.0, 0.4, 1.0, 3.0, 10.0, 25.5, -2.0], n)
+    # некорректные avg/last и отсутствующая цена
+    avg[rng.random(n) < 0.05] = 0.0
+    last[rng.random(n) < 0.05] = 0.0
+    has_open = rng.random(n) < 0.1
+    known = rng.random(n) > 0.1
+    return qty, avg, last, has_open, known
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_decide_arrays_matches_scalar_rules(seed):
+    rng = np.random.default_rng(seed)
+    n = 40_000
+    qty, avg, last, has_open, known = _random_rows(rng, n)
+    base = rng.choice([1.0, 5.0, 10.0], n)
+    dca_pct = rng.choice([0.01, 0.02, 0.05], n)
+    tp_pct = rng.choice([0.01, 0.02, 0.05], n)
+
+    d = decide_arrays(qty, avg, last, has_open, known, base, dca_pct, tp_pct)
+    for i in range(n):
+        want = scalar(qty[i], avg[i], last[i], has_open[i], known[i], base[i], dca_pct[i], tp_pct[i])
+        got = (int(d.kind[i]), int(d.reason[i]), float(d.qty[i]), float(d.limit[i]))
+        assert got == want, (i, qty[i], avg[i], last[i], has_open[i], known[i])
+
+
+def test_scalar_parameters_broadcast():
+    qty = np.array([0.0, 10.0, 10.0, 10.0])
+    avg = np.array([0.0, 100.0, 100.0, 100.0])
+    last = np.array([50.0, 97.0, 103.0, 100.0])
+    flags = np.zeros(4, dtype=bool)
+    d = decide_arrays(qty, avg, last, flags, ~flags, 5, 0.02, 0.02)
+    assert d.kind.tolist() == [FIRST_BUY, DCA_BUY, TP_SELL, SKIP]
+    assert d.qty.tolist() == [5.0, 5.0, 5.0, 0.0]
+    assert d.limit.tolist() == [49.95, 97.0, 103.0, 0.0]
+
+
+def test_decide_packs_actions():
+    actions = decide(["AAA", "BBB"], [0.0, 2.0], [0.0, 10.0], [20.0, 11.0],
+                     [False, True], [True, True], 1, 0.02, 0.02)
+    assert [(a.symbol, a.kind, a.reason) for a in actions] == [("AAA", FIRST_BUY, R_NONE),
+                                                               ("BBB", SKIP, R_OPEN_ORDER)]
+    assert actions[1].pos_qty == 2.0 and actions[1].last == 11.0
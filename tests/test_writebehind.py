@@ -0,0 +1,166 @@
+# test_writebehind.py
+# WriteBehind: схлопывание по ключу, повтор при занятой БД, future по таблицам.
+import asyncio
+import sqlite3
+from contextlib import asynccontextmanager
+
+import pytest
+
+from writebehind import WriteBehind
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.staged = []
+
+    async def executemany(self, sql, rows):
+        await asyncio.sleep(0)   # как настоящий драйвер — отдаём управление
+        err = self.pool.errors.get(sql)
+        if err:
+            raise err.pop(0)
+        self.staged.append((sql, list(rows)))
+
+    async def commit(self):
+        self.pool.committed.append(self.staged)
+        self.staged = []
+
+
+class FakePool:
+    """errors: sql → список исключений, по одному на попытку executemany."""
+
+    def __init__(self):
+        self.errors = {}
+        self.committed = []
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield FakeConnection(self)
+
+    def rows(self, sql):
+        return [row for commit in self.committed for s, rows in commit if s == sql for row in rows]
+
+
+def busy():
+    return sqlite3.OperationalError("database is locked")
+
+
+def make(pool, **kw):
+    wb = WriteBehind(pool, max_rows=kw.get("max_rows", 100), max_delay=kw.get("max_delay", 0.01))
+    wb.register("orders", "ORDERS")
+    wb.register("ind", "IND")
+    return wb
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+def test_coalesces_by_key_and_writes_one_transaction():
+    async def go():
+        pool = FakePool()
+        wb = make(pool)
+        wb.put("orders", 1, ("a",))
+        wb.put("orders", 1, ("b",))
+        done = wb.put("orders", 2, ("c",))
+        wb.put("ind", "X", ("x",))
+        await wb.flush()
+        assert done.done() and done.result() is None
+        await wb.close()
+        return pool, wb
+    pool, wb = run(go())
+    assert len(pool.committed) == 1
+    assert pool.rows("ORDERS") == [("b",), ("c",)]
+    assert pool.rows("IND") == [("x",)]
+    assert wb.rows_coalesced == 1 and wb.rows_written == 3
+
+
+def test_busy_requeues_rows_and_keeps_waiter_pending():
+    async def go():
+        pool = FakePool()
+        pool.errors["ORDERS"] = [busy()]
+        wb = make(pool)
+        done = wb.put("orders", 1, ("old",))
+        with pytest.raises(sqlite3.OperationalError):
+            await wb.flush()
+        assert not done.done()
+        # новое состояние, положенное до повтора, не перетирается старым
+        again = wb.put("orders", 1, ("new",))
+        assert again is done
+        await done
+        await wb.close()
+        return pool
+    pool = run(go())
+    assert pool.rows("ORDERS") == [("new",)]
+
+
+def test_put_during_failed_flush_resolves_both_waiters():
+    async def go():
+        pool = FakePool()
+        pool.errors["ORDERS"] = [busy()]
+        wb = make(pool)
+        first = wb.put("orders", 1, ("a",))
+        flush = asyncio.ensure_future(wb.flush())
+        await asyncio.sleep(0)
+        second = wb.put("orders", 2, ("b",))
+        assert second is not first
+        with pytest.raises(sqlite3.OperationalError):
+            await flush
+        await asyncio.gather(first, second)
+        await wb.close()
+        return pool
+    pool = run(go())
+    assert sorted(pool.rows("ORDERS")) == [("a",), ("b",)]
+
+
+def test_permanent_error_fails_only_its_table():
+    async def go():
+        pool = FakePool()
+        pool.errors["IND"] = [sqlite3.IntegrityError("bad row"), sqlite3.IntegrityError("bad row")]
+        wb = make(pool)
+        order = wb.put("orders", 1, ("a",))
+        ind = wb.put("ind", "X", ("x",))
+        with pytest.raises(sqlite3.IntegrityError):
+            await wb.flush()
+        assert order.result() is None
+        assert isinstance(ind.exception(), sqlite3.IntegrityError)
+        await wb.close()
+        return pool
+    pool = run(go())
+    assert pool.rows("ORDERS") == [("a",)]
+    assert pool.rows("IND") == []
+
+
+@pytest.mark.parametrize("order_first", [True, False])
+def test_isolated_write_requeues_busy_table(order_first):
+    async def go():
+        pool = FakePool()
+        wb = make(pool)
+        calls = []
+        real = wb._write
+
+        async def write(batch):
+            calls.append(sorted(batch))
+            if len(batch) > 1:
+                raise sqlite3.DatabaseError("poisoned batch")
+            if "orders" in batch and calls.count(["orders"]) == 1:
+                raise busy()
+            if "ind" in batch:
+                raise sqlite3.IntegrityError("bad row")
+            await real(batch)
+        wb._write = write
+        if order_first:
+            order = wb.put("orders", 1, ("a",))
+            ind = wb.put("ind", "X", ("x",))
+        else:
+            ind = wb.put("ind", "X", ("x",))
+            order = wb.put("orders", 1, ("a",))
+        with pytest.raises(sqlite3.Error):
+            await wb.flush()
+        assert not order.done()
+        assert isinstance(ind.exception(), sqlite3.IntegrityError)
+        await order
+        await wb.close()
+        return pool
+    pool = run(go())
+    assert pool.rows("ORDERS") == [("a",)]
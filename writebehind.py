@@ -0,0 +1,200 @@
+# writebehind.py
+import os
+import asyncio
+import logging
+import sqlite3
+from typing import Any, Dict, Hashable, Optional, Sequence
+
+from dbpool import DBPool, is_busy
+from metrics import span
+
+log = logging.getLogger("writebehind")
+
+# сброс по размеру (строк в буфере) или по времени (сек с первой отложенной строки)
+WB_MAX_ROWS = int(os.getenv("WB_MAX_ROWS", "200"))
+WB_MAX_DELAY = float(os.getenv("WB_MAX_DELAY", "0.5"))
+
+
+class WriteBehind:
+    """
+    Буфер отложенной записи для upsert'ов. Строки группируются по ключу
+    (permId / symbol) — пишется только последнее состояние; сброс —
+    executemany по каждой таблице в одной транзакции, когда набралось
+    WB_MAX_ROWS строк или прошло WB_MAX_DELAY сек.
+    put() возвращает future таблицы, которая завершится, когда строка на диске;
+    flush() — явный барьер: всё, что положили до него, записано.
+    БД занята (busy) — flush() бросает ошибку, строки возвращаются в буфер, а
+    future остаются ждать повторного сброса; падают только на постоянной ошибке
+    своей таблицы — сбой symbol_indicators не роняет ожидание записи ордера.
+    """
+
+    def __init__(self, pool: DBPool, max_rows: int = WB_MAX_ROWS, max_delay: float = WB_MAX_DELAY):
+        self.pool = pool
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._sql: Dict[str, str] = {}
+        self._pending: Dict[str, Dict[Hashable, Sequence[Any]]] = {}
+        self._waiters: Dict[str, asyncio.Future] = {}   # таблица → future её строк
+        self._count = 0
+        self._dirty = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # статистика для бенчмарков/метрик
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_coalesced = 0
+
+    def register(self, table: str, sql: str) -> None:
+        """sql — INSERT ... ON CONFLICT ... с позиционными параметрами."""
+        self._sql[table] = sql
+        self._pending.setdefault(table, {})
+
+    # ---------- запись ----------
+    def put(self, table: str, key: Hashable, params: Sequence[Any]) -> asyncio.Future:
+        pending = self._pending[table]
+        if key in pending:
+            self.rows_coalesced += 1
+        else:
+            self._count += 1
+        pending[key] = params
+        waiter = self._waiters.get(table)
+        if waiter is None:
+            waiter = self._waiters[table] = asyncio.get_running_loop().create_future()
+            # если никто не ждёт — ошибку уже залогировал flush()
+            waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._dirty.set()
+        if self._count >= self.max_rows:
+            self._full.set()
+        self._ensure_task()
+        return waiter
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            batch, waiters = self._take()
+            for table in [t for t in waiters if t not in batch]:
+                waiters.pop(table).set_result(None)
+            if not batch:
+                return
+            try:
+                await self._write(batch)
+            except sqlite3.OperationalError as e:
+                if not is_busy(e):
+                    await self._write_isolated(batch, e, waiters)
+                    return
+                # БД занята другим процессом — вернём строки в буфер и повторим
+                log.error("write-behind flush failed (%d rows), will retry: %s",
+                          sum(len(r) for r in batch.values()), e)
+                self._retry(batch, waiters)
+                raise
+            except sqlite3.DatabaseError as e:
+                await self._write_isolated(batch, e, waiters)
+                return
+            self._done(batch, waiters)
+
+    async def _write(self, batch) -> None:
+        with span("db_commit"):
+            async with self.pool.acquire() as cx:
+                for table, rows in batch.items():
+                    await cx.executemany(self._sql[table], list(rows.values()))
+                await cx.commit()
+
+    async def _write_isolated(self, batch, err: Exception, waiters: Dict[str, asyncio.Future]) -> None:
+        """
+        Ошибка не временная (схема/constraint): пишем таблицы по отдельности,
+        чтобы одна «ядовитая» таблица не держала остальные. Её строки теряем,
+        ждущие её — получают ошибку; занятая БД — строки таблицы в буфер на повтор.
+        """
+        written, failed = {}, None
+        for table, rows in batch.items():
+            try:
+                await self._write({table: rows})
+            except Exception as e:
+                failed = failed or e
+                if is_busy(e):
+                    log.error("write-behind: %d %s rows, will retry: %s", len(rows), table, e)
+                    self._retry({table: rows}, {table: waiters.pop(table)} if table in waiters else {})
+                    continue
+                log.error("write-behind: dropped %d %s rows: %s", len(rows), table, e)
+                waiter = waiters.pop(table, None)
+                if waiter is not None:
+                    waiter.set_exception(e)
+                continue
+            written[table] = rows
+        self._done(written, waiters)
+        if failed is not None:
+            raise failed
+
+    def _done(self, batch, waiters: Dict[str, asyncio.Future]) -> None:
+        self.flushes += 1
+        self.rows_written += sum(len(r) for r in batch.values())
+        for waiter in waiters.values():
+            waiter.set_result(None)
+
+    def _take(self):
+        batch = {t: rows for t, rows in self._pending.items() if rows}
+        waiters, self._waiters = self._waiters, {}
+        self._pending = {t: {} for t in self._sql}
+        self._count = 0
+        self._dirty.clear()
+        self._full.clear()
+        return batch, waiters
+
+    def _retry(self, batch, waiters: Dict[str, asyncio.Future]) -> None:
+        """
+        Строки — обратно в буфер (более новое состояние, положенное во время
+        сброса, не перетираем); их future завершатся вместе со следующим сбросом.
+        """
+        for table, rows in batch.items():
+            pending = self._pending[table]
+            for key, params in rows.items():
+                if key not in pending:
+                    pending[key] = params
+                    self._count += 1
+        for table, waiter in waiters.items():
+            current = self._waiters.get(table)
+            if current is None:
+                self._waiters[table] = waiter
+            else:
+                # пока писали, в таблицу положили ещё строки — у них уже своя future
+                current.add_done_callback(lambda f, w=waiter: _chain(f, w))
+        if self._count:
+            self._dirty.set()
+
+    # ---------- фоновый сброс ----------
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await self._dirty.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                await asyncio.sleep(self.max_delay)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+def _chain(src: asyncio.Future, dst: asyncio.Future) -> None:
+    if dst.done():
+        return
+    if src.cancelled():
+        dst.cancel()
+    elif src.exception() is not None:
+        dst.set_exception(src.exception())
+    else:
+        dst.set_result(None)